@@ -13,6 +13,7 @@ SOURCE_BUCKET = os.getenv('SOURCE_BUCKET', 'rules-repository')
 CHUNKED_BUCKET = os.getenv('CHUNKED_BUCKET', 'chunked-rules-repository')
 DIRECT_CHUNKED_BUCKET = os.getenv('DIRECT_CHUNKED_BUCKET', 'rules-repository-alpha')
 UNPROCESSED_BUCKET = os.getenv('UNPROCESSED_BUCKET', 'unprocessed-files-error-on-pdf-processing')
+UNPROCESSED_FOLDER = os.getenv('UNPROCESSED_FOLDER', 'to_further_process')
 
 # Processing Configuration - Optimized for c5ad.8xlarge (32 vCPUs, 64GB RAM)
 MAX_WORKERS_FILENAME_CLEANING = int(os.getenv('MAX_WORKERS_FILENAME_CLEANING', 32))
@@ -20,11 +21,21 @@ MAX_WORKERS_OCR_PAGE = int(os.getenv('MAX_WORKERS_OCR_PAGE', 16))
 MAX_CONCURRENT_FILES = int(os.getenv('MAX_CONCURRENT_FILES', 32))
 MAX_WORKERS_PER_STAGE = int(os.getenv('MAX_WORKERS_PER_STAGE', 16))
 MAX_PARALLEL_FILES = int(os.getenv('MAX_PARALLEL_FILES', 10))
-DEFAULT_DPI_OCR = int(os.getenv('DEFAULT_DPI_OCR', 300))
+DEFAULT_DPI_OCR = int(os.getenv('DEFAULT_DPI_OCR', 200))
 OCR_TEXT_THRESHOLD = int(os.getenv('OCR_TEXT_THRESHOLD', 50))
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', 100))
 ASYNC_PROCESSING = os.getenv('ASYNC_PROCESSING', 'true').lower() == 'true'
 
+# Document cache: PDFs already converted, watermark-cleaned and OCR'd, keyed by
+# the SHA-256 of the source file, so re-ingested duplicates skip those stages.
+# Disabled unless a bucket is set (keep it out of any KB data source)
+DOCUMENT_CACHE_BUCKET = os.getenv('DOCUMENT_CACHE_BUCKET', '')
+DOCUMENT_CACHE_PREFIX = os.getenv('DOCUMENT_CACHE_PREFIX', 'document-cache/')
+# Part of every cache key; bump it when a stage's code changes its output.
+# Stage settings (DPI, watermark terms, OCR engine and model) are keyed
+# automatically
+DOCUMENT_CACHE_VERSION = os.getenv('DOCUMENT_CACHE_VERSION', '1')
+
 # SQS Configuration
 SQS_QUEUE_URL = os.getenv('SQS_QUEUE_URL')
 VISIBILITY_TIMEOUT = int(os.getenv('VISIBILITY_TIMEOUT', 1800))
@@ -39,6 +50,16 @@ S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 100))
 S3_READ_TIMEOUT = int(os.getenv('S3_READ_TIMEOUT', 60))
 S3_CONNECT_TIMEOUT = int(os.getenv('S3_CONNECT_TIMEOUT', 60))
 
+# Largest source object the workers will download; bigger uploads are skipped
+MAX_SOURCE_FILE_SIZE = int(os.getenv('MAX_SOURCE_FILE_SIZE', 500 * 1024 * 1024))
+
+# KB Sync Batching: folders queued for ingestion are synced once per interval,
+# or sooner when this many distinct folders are waiting
+KB_SYNC_FLUSH_INTERVAL = int(os.getenv('KB_SYNC_FLUSH_INTERVAL', 30))
+KB_SYNC_MAX_PENDING = int(os.getenv('KB_SYNC_MAX_PENDING', 50))
+# Folders (each its own ingestion job) synced at once
+KB_SYNC_MAX_CONCURRENCY = int(os.getenv('KB_SYNC_MAX_CONCURRENCY', 4))
+
 # Metrics Configuration
 METRICS_PORT = int(os.getenv('METRICS_PORT', 8000))
 
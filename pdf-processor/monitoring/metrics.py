@@ -1,8 +1,16 @@
-from prometheus_client import Counter, Histogram, Gauge, start_http_server
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, multiprocess, start_http_server
+import atexit
+import os
 import time
 import re
 import socketserver
 import logging
+from threading import Lock
+
+# Multiprocess mode: when set (before prometheus_client is imported), every
+# process writes its samples to mmap'd files in this directory and the metrics
+# server aggregates them, so workers in separate processes are all reported
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
 
 # Processing metrics
 files_processed_total = Counter('pdf_files_processed_total', 'Total files processed', ['status', 'folder'])
@@ -16,36 +24,61 @@ s3_upload_duration = Histogram('s3_upload_duration_seconds', 'S3 upload duration
 # KB Sync metrics
 kb_sync_total = Counter('kb_sync_total', 'Total KB sync attempts', ['folder', 'status'])
 kb_sync_duration = Histogram('kb_sync_duration_seconds', 'KB sync duration', ['folder'])
-kb_mapping_found = Gauge('kb_mapping_found', 'KB mapping found for folder', ['folder'])
+kb_mapping_found = Gauge('kb_mapping_found', 'KB mapping found for folder', ['folder'], multiprocess_mode='max')
 
 # File tracking metrics - NEW ADDITIONS
 files_uploaded_total = Counter('files_uploaded_total', 'Total files uploaded to source bucket', ['folder'])
 chunks_created_total = Counter('chunks_created_total', 'Total PDF chunks created', ['folder'])
 processed_chunks_created_total = Counter('processed_chunks_created_total', 'Total processed PDF chunks created', ['folder'])
 direct_chunks_created_total = Counter('direct_chunks_created_total', 'Total direct PDF chunks created', ['folder'])
-files_pending_sync = Gauge('files_pending_kb_sync', 'Files waiting for KB sync', ['folder'])
+files_pending_sync = Gauge('files_pending_kb_sync', 'Files waiting for KB sync', ['folder'], multiprocess_mode='mostrecent')
 kb_sync_success_total = Counter('kb_sync_success_total', 'Successfully synced files to KB', ['folder'])
 
 # Real-time SQS Queue metrics
-sqs_messages_available = Gauge('sqs_messages_available', 'Messages currently in SQS queue')
-sqs_messages_in_flight = Gauge('sqs_messages_in_flight', 'Messages being processed by EC2')
+# Gauges that report a single value (a queue depth, a rate) keep the latest
+# write in multiprocess mode; counts of work in progress are summed over the
+# live processes
+sqs_messages_available = Gauge('sqs_messages_available', 'Messages currently in SQS queue', multiprocess_mode='mostrecent')
+sqs_messages_in_flight = Gauge('sqs_messages_in_flight', 'Messages being processed by EC2', multiprocess_mode='livesum')
 messages_processed = Counter('sqs_messages_processed_total', 'Total SQS messages processed')
 
 # Real-time Processing Stage metrics
-files_in_conversion = Gauge('files_in_conversion', 'Files currently being converted')
-files_in_ocr = Gauge('files_in_ocr', 'Files currently in OCR processing')
-files_in_chunking = Gauge('files_in_chunking', 'Files currently being chunked')
-files_in_kb_sync = Gauge('files_in_kb_sync', 'Files currently syncing to KB')
+files_in_conversion = Gauge('files_in_conversion', 'Files currently being converted', multiprocess_mode='livesum')
+files_in_ocr = Gauge('files_in_ocr', 'Files currently in OCR processing', multiprocess_mode='livesum')
+files_in_chunking = Gauge('files_in_chunking', 'Files currently being chunked', multiprocess_mode='livesum')
+files_in_kb_sync = Gauge('files_in_kb_sync', 'Files currently syncing to KB', multiprocess_mode='livesum')
 
 # Pipeline overview
-pipeline_stage_files = Gauge('pipeline_stage_files', 'Files in each pipeline stage', ['stage'])
+pipeline_stage_files = Gauge('pipeline_stage_files', 'Files in each pipeline stage', ['stage'], multiprocess_mode='livesum')
 
 # System metrics
-active_processing_jobs = Gauge('active_processing_jobs', 'Number of active processing jobs')
-processing_rate = Gauge('processing_rate_per_hour', 'Processing rate per hour')
+active_processing_jobs = Gauge('active_processing_jobs', 'Number of active processing jobs', multiprocess_mode='livesum')
+processing_rate = Gauge('processing_rate_per_hour', 'Processing rate per hour', multiprocess_mode='mostrecent')
+
+# Cap on distinct folder label values. Every new value allocates a full set
+# of series per metric (a histogram is one series per bucket), so folders past
+# the cap are reported as "other"
+MAX_FOLDER_LABELS = 100
+_folder_labels = set()
+_folder_labels_lock = Lock()
+
+# Durations below this (seconds) are measurement noise; skipping them saves the
+# bucket/sum updates on hot paths such as small S3 operations
+OBSERVATION_NOISE_FLOOR = 0.0005
+
+# The metrics server is started at most once per process; a second bind to the
+# same port fails with "Address already in use"
+_metrics_server_started = False
+_metrics_server_lock = Lock()
 
 def start_metrics_server(port=8000):
     """Start Prometheus metrics server with connection error handling"""
+    global _metrics_server_started
+    with _metrics_server_lock:
+        if _metrics_server_started:
+            logging.info("Metrics server already running")
+            return
+        _metrics_server_started = True
     try:
         # Monkey patch the socketserver to handle connection errors silently
         original_handle_error = socketserver.BaseServer.handle_error
@@ -62,12 +95,27 @@ def start_metrics_server(port=8000):
         
         socketserver.BaseServer.handle_error = silent_handle_error
         
-        start_http_server(port)
+        if PROMETHEUS_MULTIPROC_DIR:
+            # Serve the samples of all processes from the shared directory
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            start_http_server(port, registry=registry)
+        else:
+            start_http_server(port)
         print(f"Metrics server started on port {port}")
     except Exception as e:
+        with _metrics_server_lock:
+            _metrics_server_started = False
         logging.error(f"Failed to start metrics server: {e}")
         # Continue without metrics server rather than crashing
 
+def _mark_process_dead():
+    """Drop this process's live gauge samples from the multiprocess directory on exit"""
+    multiprocess.mark_process_dead(os.getpid())
+
+if PROMETHEUS_MULTIPROC_DIR:
+    atexit.register(_mark_process_dead)
+
 def sanitize_label_value(value):
     """Sanitize label values for Prometheus compatibility"""
     if not value:
@@ -80,33 +128,51 @@ def sanitize_label_value(value):
     sanitized = sanitized.strip('_')
     return sanitized or "default"
 
+def canonical_folder(folder):
+    """Map a folder or S3 key to a bounded folder label (top-level folder only)"""
+    label = sanitize_label_value(str(folder).split('/')[0] if folder else folder)
+    if label in _folder_labels:
+        return label
+    with _folder_labels_lock:
+        if len(_folder_labels) < MAX_FOLDER_LABELS:
+            _folder_labels.add(label)
+            return label
+    return "other"
+
+def observe_duration(histogram, duration):
+    """Observe a duration on a histogram, skipping sub-noise-floor values"""
+    if duration is None or duration < OBSERVATION_NOISE_FLOOR:
+        return
+    histogram.observe(duration)
+
 def record_processing_time(step_name, duration):
     """Record processing time for a specific step"""
-    processing_duration.labels(step=step_name).observe(duration)
+    observe_duration(processing_duration.labels(step=step_name), duration)
 
 def record_file_processed(status, folder):
     """Record a file processing completion"""
-    files_processed_total.labels(status=status, folder=folder).inc()
+    files_processed_total.labels(status=status, folder=canonical_folder(folder)).inc()
 
 def record_kb_sync(folder, status, duration=None):
     """Record KB sync attempt"""
+    folder = canonical_folder(folder)
     kb_sync_total.labels(folder=folder, status=status).inc()
     if duration:
-        kb_sync_duration.labels(folder=folder).observe(duration)
+        observe_duration(kb_sync_duration.labels(folder=folder), duration)
 
 # NEW HELPER FUNCTIONS
 def record_file_uploaded(folder):
     """Record a file uploaded to source bucket"""
-    files_uploaded_total.labels(folder=folder).inc()
+    files_uploaded_total.labels(folder=canonical_folder(folder)).inc()
 
 def record_chunks_created(folder, chunk_count):
     """Record PDF chunks created"""
-    chunks_created_total.labels(folder=folder).inc(chunk_count)
+    chunks_created_total.labels(folder=canonical_folder(folder)).inc(chunk_count)
 
 def record_kb_sync_success(folder):
     """Record successful KB sync"""
-    kb_sync_success_total.labels(folder=folder).inc()
+    kb_sync_success_total.labels(folder=canonical_folder(folder)).inc()
 
 def update_pending_sync_count(folder, count):
     """Update the count of files pending KB sync"""
-    files_pending_sync.labels(folder=folder).set(count)
+    files_pending_sync.labels(folder=canonical_folder(folder)).set(count)
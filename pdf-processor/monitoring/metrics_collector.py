@@ -1,29 +1,17 @@
 import time
 import logging
-import socketserver
-from prometheus_client import Counter, Histogram, Gauge, start_http_server
-import time
+from threading import Lock
+from prometheus_client import Counter, Histogram
 # Import shared metrics from metrics.py
 from monitoring import metrics as shared_metrics
+# The metrics server lives with the shared metrics; re-exported for callers
+from monitoring.metrics import start_metrics_server
 from typing import Dict, Any
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class SilentHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """Custom HTTP server that silently handles connection reset errors."""
-    
-    def handle_error(self, request, client_address):
-        """Override to silently handle ConnectionResetError."""
-        import sys
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        
-        # Only log non-connection reset errors
-        if not isinstance(exc_value, (ConnectionResetError, BrokenPipeError)):
-            logger.error(f"HTTP server error from {client_address}: {exc_value}")
-        # Silently ignore connection reset errors as they're normal
-
 # Document Processing Pipeline Metrics
 class DocumentMetrics:
     """Centralized metrics collection for document processing pipeline."""
@@ -76,11 +64,20 @@ class DocumentMetrics:
         self.ocr_duration = Histogram('document_ocr_duration_seconds', 'Time for OCR processing')
         self.chunking_duration = Histogram('document_chunking_duration_seconds', 'Time to chunk document')
         
+        # processing_duration children by step, bound on first use; every file
+        # records several steps, and labels() is a locked lookup per call
+        self._step_durations = {}
+        
+    @staticmethod
+    def _canonicalize(folder: str) -> str:
+        """Bound the folder label to the top-level folder (see shared_metrics.canonical_folder)."""
+        return shared_metrics.canonical_folder(folder)
+    
     def record_s3_upload(self, bucket: str, duration: float, success: bool = True):
         """Record S3 upload metrics."""
         status = 'success' if success else 'failed'
         self.s3_uploads_total.labels(bucket=bucket, status=status).inc()
-        self.s3_upload_duration.observe(duration)
+        shared_metrics.observe_duration(self.s3_upload_duration, duration)
         
     def record_conversion(self, from_format: str, to_format: str, duration: float, success: bool = True):
         """Record format conversion metrics."""
@@ -103,13 +100,13 @@ class DocumentMetrics:
         """Record S3 output upload metrics."""
         status = 'success' if success else 'failed'
         self.s3_uploads_total.labels(bucket='chunked-rules-repository', status=status).inc()
-        self.s3_upload_duration.observe(duration)
+        shared_metrics.observe_duration(self.s3_upload_duration, duration)
         
     def record_kb_sync(self, duration: float, success: bool = True):
         """Record KB sync metrics."""
         status = 'success' if success else 'failed'
         self.kb_sync_total.labels(status=status).inc()
-        self.kb_sync_duration.observe(duration)
+        shared_metrics.observe_duration(self.kb_sync_duration, duration)
         
     def record_file_processing(self, duration: float, success: bool = True):
         """Record overall file processing metrics."""
@@ -132,60 +129,57 @@ class DocumentMetrics:
     # NEW HELPER METHODS FOR FILE TRACKING
     def record_file_uploaded(self, folder: str):
         """Record a file uploaded to source bucket"""
-        self.files_uploaded_total.labels(folder=folder).inc()
+        self.files_uploaded_total.labels(folder=self._canonicalize(folder)).inc()
     
     def record_chunks_created(self, folder: str, chunk_count: int):
         """Record PDF chunks created"""
-        self.chunks_created_total.labels(folder=folder).inc(chunk_count)
+        self.chunks_created_total.labels(folder=self._canonicalize(folder)).inc(chunk_count)
     
     def record_kb_sync_success(self, folder: str):
         """Record successful KB sync"""
-        self.kb_sync_success_total.labels(folder=folder).inc()
+        self.kb_sync_success_total.labels(folder=self._canonicalize(folder)).inc()
     
     def update_pending_sync_count(self, folder: str, count: int):
         """Update the count of files pending KB sync"""
-        self.files_pending_sync.labels(folder=folder).set(count)
+        self.files_pending_sync.labels(folder=self._canonicalize(folder)).set(count)
     
     def record_processing_time(self, step_name: str, duration: float):
         """Record processing time for a specific step"""
-        self.processing_duration.labels(step=step_name).observe(duration)
+        histogram = self._step_durations.get(step_name)
+        if histogram is None:
+            histogram = self._step_durations.setdefault(step_name, self.processing_duration.labels(step=step_name))
+        shared_metrics.observe_duration(histogram, duration)
     
     def record_file_processed(self, status: str, folder: str):
         """Record a file processing completion"""
-        self.files_processed_total.labels(status=status, folder=folder).inc()
+        self.files_processed_total.labels(status=status, folder=self._canonicalize(folder)).inc()
     
     def record_kb_sync_attempt(self, folder: str, status: str, duration: float = None):
         """Record KB sync attempt"""
+        folder = self._canonicalize(folder)
         self.kb_sync_total.labels(folder=folder, status=status).inc()
         if duration:
-            self.kb_sync_duration.labels(folder=folder).observe(duration)
+            shared_metrics.observe_duration(self.kb_sync_duration.labels(folder=folder), duration)
+
+# Global metrics instance, created on first use. DocumentMetrics registers
+# its own collectors in the default registry, so it must only be built once
+_metrics = None
+_metrics_lock = Lock()
 
-# Global metrics instance
-metrics = DocumentMetrics()
+def get_metrics() -> DocumentMetrics:
+    """Return the process-wide DocumentMetrics instance."""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = DocumentMetrics()
+    return _metrics
 
-def start_metrics_server(port: int = 8000):
-    """Start the Prometheus metrics server with connection error handling."""
-    try:
-        # Monkey patch the socketserver to handle connection errors silently
-        original_handle_error = socketserver.BaseServer.handle_error
-        
-        def silent_handle_error(self, request, client_address):
-            """Handle errors silently for connection resets."""
-            import sys
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            
-            # Only log non-connection reset errors
-            if not isinstance(exc_value, (ConnectionResetError, BrokenPipeError, OSError)):
-                original_handle_error(self, request, client_address)
-            # Silently ignore connection reset errors
-        
-        socketserver.BaseServer.handle_error = silent_handle_error
-        
-        start_http_server(port)
-        logger.info(f"Metrics server started on port {port}")
-    except Exception as e:
-        logger.error(f"Failed to start metrics server: {e}")
-        # Continue without metrics server rather than crashing
+def __getattr__(name: str):
+    """Resolve the module-level `metrics` name lazily (from ... import metrics)."""
+    if name == 'metrics':
+        return get_metrics()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == "__main__":
     start_metrics_server()
@@ -7,7 +7,7 @@ from PyPDF2 import PdfReader, PdfWriter
 import os
 from io import BytesIO
 import logging
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 from config import CHUNKED_BUCKET, DIRECT_CHUNKED_BUCKET
 from .metadata_service import MetadataService
 from .metadata_page import MetadataPageService
@@ -232,7 +232,29 @@ class ChunkingService:
             self.logger.error(f"Error chunking PDF: {e}")
             return []
     
-    async def chunk_pdf_processed(self, pdf_data: bytes, key: str, enhanced_pdf_data: bytes = None) -> List[Tuple[BytesIO, Dict[str, Any]]]:
+    def open_reader(self, pdf_data: bytes) -> Optional[PdfReader]:
+        """
+        Parse PDF data once so both chunking streams can share the reader.
+        
+        Args:
+            pdf_data: PDF data
+            
+        Returns:
+            PdfReader (decrypted if needed), or None if the data cannot be parsed
+        """
+        try:
+            reader = PdfReader(BytesIO(pdf_data))
+            
+            if reader.is_encrypted:
+                reader.decrypt('')
+            
+            return reader
+            
+        except Exception as e:
+            self.logger.error(f"Error opening PDF for chunking: {e}")
+            return None
+    
+    async def chunk_pdf_processed(self, pdf_data: bytes, key: str, enhanced_pdf_data: bytes = None, reader: PdfReader = None) -> List[Tuple[BytesIO, Dict[str, Any]]]:
         """
         Chunk PDF for processed stream (enhanced content) -> chunked-rules-repository -> KB sync
         
@@ -240,25 +262,37 @@ class ChunkingService:
             pdf_data: Original PDF data
             key: S3 key path (e.g., "test/space testing folder/NBB Q2 2025.pdf")
             enhanced_pdf_data: Enhanced PDF data (OCR + PDF-plumber processed)
+            reader: Already-parsed reader of the data to chunk, from open_reader
             
         Returns:
             List of (chunk_stream, metadata) tuples
         """
         try:
-            # Use enhanced data if available, otherwise use original
-            data_to_chunk = enhanced_pdf_data if enhanced_pdf_data else pdf_data
-            
-            # Convert bytes to BytesIO stream
-            pdf_stream = BytesIO(data_to_chunk)
-            pdf_stream.seek(0)
-            reader = PdfReader(pdf_stream)
-            
-            if reader.is_encrypted:
-                reader.decrypt('')
+            if reader is None:
+                # Use enhanced data if available, otherwise use original
+                data_to_chunk = enhanced_pdf_data if enhanced_pdf_data else pdf_data
+                
+                # Convert bytes to BytesIO stream
+                pdf_stream = BytesIO(data_to_chunk)
+                pdf_stream.seek(0)
+                reader = PdfReader(pdf_stream)
+                
+                if reader.is_encrypted:
+                    reader.decrypt('')
             
             total_pages = len(reader.pages)
             processed_chunks = []
             
+            # Folder path and filename are the same for every page, so the
+            # chunk key prefix is worked out once for the whole document
+            folder_path = '/'.join(key.split('/')[:-1]) if '/' in key else ''
+            original_filename = key.split('/')[-1]
+            base_filename = os.path.splitext(original_filename)[0]
+            
+            # Generate normalized filename for S3 keys (replace spaces with underscores)
+            normalized_base_filename = base_filename.replace(' ', '_')
+            chunk_key_prefix = f"{folder_path}/{normalized_base_filename}" if folder_path else normalized_base_filename
+            
             for page_num in range(total_pages):
                 # Get base metadata for this specific page
                 metadata = self.extract_metadata(key, page_num + 1, total_pages)
@@ -267,26 +301,11 @@ class ChunkingService:
                 metadata['processing_method'] = 'processed'
                 metadata['chunk_type'] = 'processed'
                 
-                # Extract folder path and filename properly
-                folder_path = '/'.join(key.split('/')[:-1]) if '/' in key else ''
-                original_filename = key.split('/')[-1]
-                base_filename = os.path.splitext(original_filename)[0]
                 page_number = metadata.get('page_number', 1)
                 
-                # Generate normalized filename for S3 keys (replace spaces with underscores)
-                normalized_base_filename = base_filename.replace(' ', '_')
-                
-                # Generate chunk filenames
-                chunk_filename = f"{normalized_base_filename}_page_{page_number}.pdf"
-                processed_chunk_filename = f"{normalized_base_filename}_page_{page_number}_processed.pdf"
-                
                 # Build full S3 keys with folder structure preserved
-                if folder_path:
-                    chunk_key = f"{folder_path}/{chunk_filename}"
-                    processed_chunk_key = f"{folder_path}/{processed_chunk_filename}"
-                else:
-                    chunk_key = chunk_filename
-                    processed_chunk_key = processed_chunk_filename
+                chunk_key = f"{chunk_key_prefix}_page_{page_number}.pdf"
+                processed_chunk_key = f"{chunk_key_prefix}_page_{page_number}_processed.pdf"
                 
                 # Dual URIs for processed chunks (stored in chunked-rules-repository)
                 # 1. chunk_s3_uri_processed: Points to the processed chunk in chunked-rules-repository
@@ -326,29 +345,41 @@ class ChunkingService:
             self.logger.error(f"Error in processed chunking for {key}: {e}")
             return []
     
-    async def chunk_pdf_direct(self, pdf_data: bytes, key: str) -> List[Tuple[BytesIO, Dict[str, Any]]]:
+    async def chunk_pdf_direct(self, pdf_data: bytes, key: str, reader: PdfReader = None) -> List[Tuple[BytesIO, Dict[str, Any]]]:
         """
         Chunk PDF for direct stream (original content) -> rules-repository-alpha -> Storage only
         
         Args:
             pdf_data: Original PDF data
             key: S3 key path (e.g., "test/space testing folder/NBB Q2 2025.pdf")
+            reader: Already-parsed reader of pdf_data, from open_reader
             
         Returns:
             List of (chunk_stream, metadata) tuples
         """
         try:
-            # Convert bytes to BytesIO stream
-            pdf_stream = BytesIO(pdf_data)
-            pdf_stream.seek(0)
-            reader = PdfReader(pdf_stream)
-            
-            if reader.is_encrypted:
-                reader.decrypt('')
+            if reader is None:
+                # Convert bytes to BytesIO stream
+                pdf_stream = BytesIO(pdf_data)
+                pdf_stream.seek(0)
+                reader = PdfReader(pdf_stream)
+                
+                if reader.is_encrypted:
+                    reader.decrypt('')
             
             total_pages = len(reader.pages)
             direct_chunks = []
             
+            # Folder path and filename are the same for every page, so the
+            # chunk key prefix is worked out once for the whole document
+            folder_path = '/'.join(key.split('/')[:-1]) if '/' in key else ''
+            original_filename = key.split('/')[-1]
+            base_filename = os.path.splitext(original_filename)[0]
+            
+            # Generate normalized filename for S3 keys (replace spaces with underscores)
+            normalized_base_filename = base_filename.replace(' ', '_')
+            chunk_key_prefix = f"{folder_path}/{normalized_base_filename}" if folder_path else normalized_base_filename
+            
             for page_num in range(total_pages):
                 # Get base metadata for this specific page
                 metadata = self.extract_metadata(key, page_num + 1, total_pages)
@@ -357,23 +388,10 @@ class ChunkingService:
                 metadata['processing_method'] = 'direct'
                 metadata['chunk_type'] = 'direct'
                 
-                # Extract folder path and filename properly
-                folder_path = '/'.join(key.split('/')[:-1]) if '/' in key else ''
-                original_filename = key.split('/')[-1]
-                base_filename = os.path.splitext(original_filename)[0]
                 page_number = metadata.get('page_number', 1)
                 
-                # Generate normalized filename for S3 keys (replace spaces with underscores)
-                normalized_base_filename = base_filename.replace(' ', '_')
-                
-                # Generate chunk filename
-                chunk_filename = f"{normalized_base_filename}_page_{page_number}.pdf"
-                
                 # Build full S3 key with folder structure preserved
-                if folder_path:
-                    chunk_key = f"{folder_path}/{chunk_filename}"
-                else:
-                    chunk_key = chunk_filename
+                chunk_key = f"{chunk_key_prefix}_page_{page_number}.pdf"
                 
                 # Single URI for direct chunks (stored in rules-repository-alpha)
                 # chunk_s3_uri: Points to this direct chunk in rules-repository-alpha
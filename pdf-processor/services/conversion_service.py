@@ -17,6 +17,17 @@ logger = logging.getLogger(__name__)
 class ConversionService:
     """Service for converting various document formats to PDF."""
     
+    CONVERTIBLE_EXTENSIONS = frozenset({'.doc', '.docx', '.txt'})
+    
+    # Keys without an extension are treated as PDFs downstream
+    SUPPORTED_EXTENSIONS = CONVERTIBLE_EXTENSIONS | {'.pdf', ''}
+    
+    # PDF header. Only leading whitespace may come before it: text that merely
+    # mentions "%PDF-" (a .txt about PDFs) must still be converted
+    PDF_MAGIC = b'%PDF-'
+    PDF_MAGIC_WINDOW = 1024
+    
+    
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         
@@ -189,4 +200,30 @@ class ConversionService:
     def is_convertible_format(self, filename: str) -> bool:
         """Check if file format can be converted to PDF."""
         extension = os.path.splitext(filename)[1].lower()
-        return extension in ['.doc', '.docx', '.txt']
+        return extension in self.CONVERTIBLE_EXTENSIONS
+    
+    def needs_conversion(self, file_content: bytes, filename: str) -> bool:
+        """
+        Check if a file has to be converted before processing.
+        
+        A convertible extension is not enough: content that already carries
+        the PDF header (a mislabeled .doc, say) skips conversion entirely.
+        
+        Args:
+            file_content: File content as bytes
+            filename: Filename including extension
+            
+        Returns:
+            True if the file should go through convert_to_pdf
+        """
+        if not self.is_convertible_format(filename):
+            return False
+        if file_content[:self.PDF_MAGIC_WINDOW].lstrip().startswith(self.PDF_MAGIC):
+            self.logger.info(f"{filename} is already a PDF, skipping conversion")
+            return False
+        return True
+    
+    def is_supported_format(self, filename: str) -> bool:
+        """Check if file is a PDF or a format that can be converted to PDF."""
+        extension = os.path.splitext(filename)[1].lower()
+        return extension in self.SUPPORTED_EXTENSIONS
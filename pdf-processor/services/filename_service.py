@@ -22,6 +22,11 @@ ULTRA_STRICT_REGEX = r"[^a-zA-Z0-9_/ ]"
 MULTIPLE_UNDERSCORES_REGEX = r"_{2,}"
 WHITESPACE_REGEX = r"\s+"
 
+# Compiled once at import time; clean_filename runs for every file and chunk
+ULTRA_STRICT_PATTERN = re.compile(ULTRA_STRICT_REGEX)
+MULTIPLE_UNDERSCORES_PATTERN = re.compile(MULTIPLE_UNDERSCORES_REGEX)
+WHITESPACE_PATTERN = re.compile(WHITESPACE_REGEX)
+
 class FilenameService:
     """Service for cleaning and norm  alizing filenames."""
     
@@ -53,15 +58,15 @@ class FilenameService:
         
         # Step 1: Remove ALL non-English characters completely - skip unidecode
         # Step 2: Remove special characters but keep spaces
-        cleaned_filename = re.sub(ULTRA_STRICT_REGEX, '', filename_only)
+        cleaned_filename = ULTRA_STRICT_PATTERN.sub('', filename_only)
         if cleaned_filename != filename_only:
             modified = True
         
         # Step 3: Replace spaces with underscores
-        cleaned_filename = re.sub(WHITESPACE_REGEX, '_', cleaned_filename)
+        cleaned_filename = WHITESPACE_PATTERN.sub('_', cleaned_filename)
         
         # Step 4: Replace multiple underscores with single underscore
-        cleaned_filename = re.sub(MULTIPLE_UNDERSCORES_REGEX, '_', cleaned_filename)
+        cleaned_filename = MULTIPLE_UNDERSCORES_PATTERN.sub('_', cleaned_filename)
         
         # Step 5: Remove leading/trailing underscores and dots
         cleaned_filename = cleaned_filename.strip('_.')
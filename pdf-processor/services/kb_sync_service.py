@@ -4,6 +4,7 @@ Implements Bedrock ingestion job management and error handling with concurrency
 """
 
 import json
+import atexit
 import boto3
 import uuid
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -19,7 +20,12 @@ try:
 except ImportError:
     # Windows doesn't have fcntl, use alternative locking
     fcntl = None
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
+from config import (
+    UNPROCESSED_BUCKET, UNPROCESSED_FOLDER,
+    KB_SYNC_FLUSH_INTERVAL, KB_SYNC_MAX_PENDING, KB_SYNC_MAX_CONCURRENCY
+)
+from monitoring.metrics_collector import metrics
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -27,37 +33,36 @@ logger = logging.getLogger(__name__)
 class KBMappingConfig:
     """Knowledge Base mapping configuration"""
     
+    # folder -> (knowledge_base_id, data_source_id)
     KB_MAPPING = {
-    # 'accounting-standards': {'id': '1XYVHJWXEA', 'data_source_id': 'VQ53AYFFGO'},
-    # 'accounting-global': {'id': 'BPFC6I50NY', 'data_source_id': 'C7NTSCZJPA'},
-    # 'commercial-laws': {'id': 'CAQ6E0JJBW', 'data_source_id': 'AY5EWVXYF6'},
-    # 'usecase-reports': {'id': 'MPLWH62JQA', 'data_source_id': 'ZJ3ZQYU5BJ'},
-    # 'Auditing Standards': {'id': 'XXFFTJYAD1', 'data_source_id': 'OH8L2PTHYU'},
-    # 'Auditing-global': {'id': 'GQOXRJAYPO', 'data_source_id': 'WWPU0ELXBR'},
-    # 'Banking Regulations': {'id': 'VDMWYPSOYO', 'data_source_id': 'I6QTPRZOSP'},
-    # 'Banking Regulations-test': {'id': 'S0X541AD9P', 'data_source_id': 'CIHLQL7Q5E'},
-    # 'Capital Market Regulations': {'id': 'UI4DH8O8GX', 'data_source_id': '8JKIFZD7HF'},
-    # 'Direct Taxes': {'id': 'PV2IGEHKRK', 'data_source_id': 'XNBPX5WR3B'},
-    # 'Indirect Taxes': {'id': 'QTTHYYFCZ9', 'data_source_id': 'JDT9KAXQJL'},
-    # 'Insurance': {'id': 'ECWHGFSH1R', 'data_source_id': 'LPBCRYCSEM'},
-    # 'Labour Law': {'id': 'CAQ6E0JJBW', 'data_source_id': 'PLIPBARA5R'},
-    # 'Finance Tools': {'id': '1XYVHJWXEA', 'data_source_id': '18HMESLJIY'},
-    # 'GIFT City': {'id': 'VDMWYPSOYO', 'data_source_id': 'RL7KXCTETU'},
-    # 'usecase-reports-2': {'id': 'MPLWH62JQA', 'data_source_id': 'DLEOONAFF3'},
-    # 'Direct-Taxes-case-laws': {'id': 'UJNOWHQEQ9', 'data_source_id': '9OUZYLFVCV'},
-    # 'Indirect-Taxes-case-laws': {'id': 'PMF8OY8ZSG', 'data_source_id': 'WRRCYQD3R0'},
-    # 'Insurance-caselaws': {'id': 'IUB7BI5IXQ', 'data_source_id': 'CB2LPPFQUW'},
-    # 'usecase-reports-3': {'id': 'MPLWH62JQA', 'data_source_id': '3USTFVCZLE'},
-    # 'usecase-reports-4': {'id': 'MPLWH62JQA', 'data_source_id': '7UMOIOM161'},
-    # 'usecase-reports-5': {'id': 'MPLWH62JQA', 'data_source_id': 'NHVSOJYK96'},
-    # 'commercial-case-laws': {'id': 'DQ6AIARMNQ', 'data_source_id': 'NXNCQID5NX'},
-    'test':{'id':'VDAPHQ1JTN','data_source_id':'EAVX8UD6RY'},
-    # 'Banking-Regulations-Bahrain':{'id':'DENKRCJT22','data_source_id':'CZL093W4EF'}
+    # 'accounting-standards': ('1XYVHJWXEA', 'VQ53AYFFGO'),
+    # 'accounting-global': ('BPFC6I50NY', 'C7NTSCZJPA'),
+    # 'commercial-laws': ('CAQ6E0JJBW', 'AY5EWVXYF6'),
+    # 'usecase-reports': ('MPLWH62JQA', 'ZJ3ZQYU5BJ'),
+    # 'Auditing Standards': ('XXFFTJYAD1', 'OH8L2PTHYU'),
+    # 'Auditing-global': ('GQOXRJAYPO', 'WWPU0ELXBR'),
+    # 'Banking Regulations': ('VDMWYPSOYO', 'I6QTPRZOSP'),
+    # 'Banking Regulations-test': ('S0X541AD9P', 'CIHLQL7Q5E'),
+    # 'Capital Market Regulations': ('UI4DH8O8GX', '8JKIFZD7HF'),
+    # 'Direct Taxes': ('PV2IGEHKRK', 'XNBPX5WR3B'),
+    # 'Indirect Taxes': ('QTTHYYFCZ9', 'JDT9KAXQJL'),
+    # 'Insurance': ('ECWHGFSH1R', 'LPBCRYCSEM'),
+    # 'Labour Law': ('CAQ6E0JJBW', 'PLIPBARA5R'),
+    # 'Finance Tools': ('1XYVHJWXEA', '18HMESLJIY'),
+    # 'GIFT City': ('VDMWYPSOYO', 'RL7KXCTETU'),
+    # 'usecase-reports-2': ('MPLWH62JQA', 'DLEOONAFF3'),
+    # 'Direct-Taxes-case-laws': ('UJNOWHQEQ9', '9OUZYLFVCV'),
+    # 'Indirect-Taxes-case-laws': ('PMF8OY8ZSG', 'WRRCYQD3R0'),
+    # 'Insurance-caselaws': ('IUB7BI5IXQ', 'CB2LPPFQUW'),
+    # 'usecase-reports-3': ('MPLWH62JQA', '3USTFVCZLE'),
+    # 'usecase-reports-4': ('MPLWH62JQA', '7UMOIOM161'),
+    # 'usecase-reports-5': ('MPLWH62JQA', 'NHVSOJYK96'),
+    # 'commercial-case-laws': ('DQ6AIARMNQ', 'NXNCQID5NX'),
+    'test':('VDAPHQ1JTN', 'EAVX8UD6RY'),
+    # 'Banking-Regulations-Bahrain':('DENKRCJT22', 'CZL093W4EF')
 }
     
     CHUNKED_BUCKET = 'chunked-rules-repository'
-    UNPROCESSED_BUCKET = 'unprocessed-files-error-on-pdf-processing'
-    UNPROCESSED_FOLDER = 'to_further_process'
 
 class KBIngestionService:
     """Service for managing Bedrock Knowledge Base ingestion jobs with concurrency control"""
@@ -74,12 +79,10 @@ class KBIngestionService:
             region_name=region_name
         )
         
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
+        # The process-wide S3 client: this service is built per file, and a
+        # fresh client would start from cold connections every time
+        from services.s3_service import get_s3_client
+        self.s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name)
         self.config = KBMappingConfig()
         
         # Thread-safe in-memory locks
@@ -328,7 +331,7 @@ class KBIngestionService:
         and starts a second sync job. Includes concurrency control.
         """
         kb_info = self.config.KB_MAPPING[folder]
-        kb_id = kb_info['id']
+        kb_id, data_source_id = kb_info
         failed_files_initial_sync = []
         files_successfully_moved = []
 
@@ -344,29 +347,29 @@ class KBIngestionService:
                 description_step1 = f"Initial batch sync for {folder}"
                 response = self.bedrock_client.start_ingestion_job(
                     clientToken=client_token_step1,
-                    dataSourceId=kb_info['data_source_id'],
-                    knowledgeBaseId=kb_info['id'],
+                    dataSourceId=data_source_id,
+                    knowledgeBaseId=kb_id,
                     description=description_step1
                 )
                 job_id_step1 = response['ingestionJob']['ingestionJobId']
-                logger.info(f"Started initial ingestion job {job_id_step1} for folder {folder}")
+                logger.info("Started initial ingestion job %s for folder %s", job_id_step1, folder)
 
                 wait_result_step1 = self.wait_for_ingestion_job(kb_info, job_id_step1, folder)
 
                 if 'failed_files' in wait_result_step1 and wait_result_step1['failed_files']:
                     failed_files_initial_sync.extend(wait_result_step1['failed_files'])
-                    logger.warning(f"Initial sync failed for these files due to token limits: {failed_files_initial_sync}")
+                    logger.warning("Initial sync failed for these files due to token limits: %s", failed_files_initial_sync)
 
                 # Step 2: Move Failed Files to Unprocessed Bucket
                 if failed_files_initial_sync:
-                    logger.info(f"Moving {len(failed_files_initial_sync)} files to unprocessed bucket ({self.config.UNPROCESSED_FOLDER}/).")
+                    logger.info("Moving %s files to unprocessed bucket (%s/).", len(failed_files_initial_sync), UNPROCESSED_FOLDER)
                     for failed_file_key in failed_files_initial_sync:
-                        destination_key = f"{self.config.UNPROCESSED_FOLDER}/{os.path.basename(failed_file_key)}"
+                        destination_key = f"{UNPROCESSED_FOLDER}/{os.path.basename(failed_file_key)}"
                         # move_s3_object will be implemented when needed
                         files_successfully_moved.append(destination_key)
 
             except Exception as e:
-                logger.error(f"Error during initial sync job start or wait for folder {folder}: {str(e)}")
+                logger.error("Error during initial sync job start or wait for folder %s: %s", folder, e)
                 return {'status': 'Error', 'message': f"Initial sync job failed to start or complete successfully: {str(e)}"}
 
             # Step 3: Start a Second Sync Attempt for Remaining Files
@@ -376,27 +379,27 @@ class KBIngestionService:
                 description_step2 = f"Retry sync after moving failed files for {folder}"
                 response = self.bedrock_client.start_ingestion_job(
                     clientToken=client_token_step2,
-                    dataSourceId=kb_info['data_source_id'],
-                    knowledgeBaseId=kb_info['id'],
+                    dataSourceId=data_source_id,
+                    knowledgeBaseId=kb_id,
                     description=description_step2
                 )
                 job_id_step2 = response['ingestionJob']['ingestionJobId']
-                logger.info(f"Started retry ingestion job {job_id_step2} for folder {folder}")
+                logger.info("Started retry ingestion job %s for folder %s", job_id_step2, folder)
 
                 wait_result_step2 = self.wait_for_ingestion_job(kb_info, job_id_step2, folder)
                 if wait_result_step2.get('status') != 'COMPLETE':
-                    logger.warning(f"Retry sync job {job_id_step2} completed with status: {wait_result_step2.get('status')}")
+                    logger.warning("Retry sync job %s completed with status: %s", job_id_step2, wait_result_step2.get('status'))
 
             except Exception as e:
-                logger.error(f"Error during retry sync job for folder {folder}: {str(e)}")
+                logger.error("Error during retry sync job for folder %s: %s", folder, e)
                 return {'status': 'Completed with Errors and Unprocessed Files', 'files_moved_to_unprocessed': files_successfully_moved, 'retry_sync_error': str(e)}
 
             # Final Result
             if files_successfully_moved:
-                logger.warning(f"Processing completed for folder {folder}. Files moved to {self.config.UNPROCESSED_BUCKET}/{self.config.UNPROCESSED_FOLDER}: {files_successfully_moved}")
+                logger.warning("Processing completed for folder %s. Files moved to %s/%s: %s", folder, UNPROCESSED_BUCKET, UNPROCESSED_FOLDER, files_successfully_moved)
                 return {'status': 'Completed with Failed Files', 'files_moved_to_unprocessed': files_successfully_moved}
             else:
-                logger.info(f"Processing completed successfully for folder {folder}. No files moved to unprocessed bucket.")
+                logger.info("Processing completed successfully for folder %s. No files moved to unprocessed bucket.", folder)
                 return {'status': 'COMPLETE'}
                 
         finally:
@@ -406,7 +409,7 @@ class KBIngestionService:
     def sync_to_knowledge_base_simple(self, folder: str, is_delete: bool = False) -> Dict[str, Any]:
         """Starts and waits for a single Bedrock ingestion job for a folder with concurrency control."""
         kb_info = self.config.KB_MAPPING[folder]
-        kb_id = kb_info['id']
+        kb_id, data_source_id = kb_info
         client_token = str(uuid.uuid4())
         description = f"{'Deletion sync' if is_delete else 'Batch sync'} for {folder}"
 
@@ -416,10 +419,11 @@ class KBIngestionService:
 
         try:
             # Log KB details for transparency
-            logger.info(f"[KB-SYNC] Starting sync for folder: {folder}")
-            logger.info(f"[KB-SYNC] Knowledge Base ID: {kb_info['id']}")
-            logger.info(f"[KB-SYNC] Data Source ID: {kb_info['data_source_id']}")
-            logger.info(f"[KB-SYNC] Sync Type: {'Deletion' if is_delete else 'Ingestion'}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("[KB-SYNC] Starting sync for folder: %s", folder)
+                logger.info("[KB-SYNC] Knowledge Base ID: %s", kb_id)
+                logger.info("[KB-SYNC] Data Source ID: %s", data_source_id)
+                logger.info("[KB-SYNC] Sync Type: %s", 'Deletion' if is_delete else 'Ingestion')
             
             # Count files in folder
             try:
@@ -428,25 +432,25 @@ class KBIngestionService:
                     Prefix=folder + '/'
                 )
                 file_count = len(response.get('Contents', []))
-                logger.info(f"[KB-SYNC] Files to sync: {file_count} in s3://{self.config.CHUNKED_BUCKET}/{folder}/")
+                logger.info("[KB-SYNC] Files to sync: %s in s3://%s/%s/", file_count, self.config.CHUNKED_BUCKET, folder)
             except:
-                logger.warning(f"[KB-SYNC] Could not count files in {folder}")
+                logger.warning("[KB-SYNC] Could not count files in %s", folder)
 
             try:
                 response = self.bedrock_client.start_ingestion_job(
                     clientToken=client_token,
-                    dataSourceId=kb_info['data_source_id'],
-                    knowledgeBaseId=kb_info['id'],
+                    dataSourceId=data_source_id,
+                    knowledgeBaseId=kb_id,
                     description=description
                 )
                 job_id = response['ingestionJob']['ingestionJobId']
-                logger.info(f"[KB-SYNC] ✅ Started ingestion job: {job_id}")
-                logger.info(f"[KB-SYNC] 📋 Job Description: {description}")
-                logger.info(f"[KB-SYNC] ⏱️  Monitoring job status...")
+                logger.info("[KB-SYNC] ✅ Started ingestion job: %s", job_id)
+                logger.info("[KB-SYNC] 📋 Job Description: %s", description)
+                logger.info("[KB-SYNC] ⏱️  Monitoring job status...")
             except Exception as e:
                 if 'ConflictException' in str(e) and 'ongoing ingestion job' in str(e):
-                    logger.warning(f"[KB-SYNC] ⚠️  ConflictException: Another ingestion job is already running for this data source")
-                    logger.info(f"[KB-SYNC] 🔄 Waiting for ongoing job to complete before retrying...")
+                    logger.warning("[KB-SYNC] ⚠️  ConflictException: Another ingestion job is already running for this data source")
+                    logger.info("[KB-SYNC] 🔄 Waiting for ongoing job to complete before retrying...")
                     
                     # Wait for existing job to complete (max 30 minutes)
                     max_wait_attempts = 60  # 30 minutes with 30-second intervals
@@ -457,23 +461,23 @@ class KBIngestionService:
                             client_token = str(uuid.uuid4())  # New token for retry
                             response = self.bedrock_client.start_ingestion_job(
                                 clientToken=client_token,
-                                dataSourceId=kb_info['data_source_id'],
-                                knowledgeBaseId=kb_info['id'],
+                                dataSourceId=data_source_id,
+                                knowledgeBaseId=kb_id,
                                 description=f"{description} (retry after conflict)"
                             )
                             job_id = response['ingestionJob']['ingestionJobId']
-                            logger.info(f"[KB-SYNC] ✅ Successfully started ingestion job after waiting: {job_id}")
+                            logger.info("[KB-SYNC] ✅ Successfully started ingestion job after waiting: %s", job_id)
                             break
                         except Exception as retry_e:
                             if 'ConflictException' in str(retry_e):
-                                logger.info(f"[KB-SYNC] 🕐 Still waiting for ongoing job to complete... (attempt {wait_attempt + 1}/{max_wait_attempts})")
+                                logger.info("[KB-SYNC] 🕐 Still waiting for ongoing job to complete... (attempt %s/%s)", wait_attempt + 1, max_wait_attempts)
                                 continue
                             else:
-                                logger.error(f"[KB-SYNC] ❌ Unexpected error during retry: {str(retry_e)}")
+                                logger.error("[KB-SYNC] ❌ Unexpected error during retry: %s", retry_e)
                                 raise retry_e
                     else:
                         # If we exhausted all wait attempts
-                        logger.error(f"[KB-SYNC] ❌ Timeout waiting for ongoing ingestion job to complete after 30 minutes")
+                        logger.error("[KB-SYNC] ❌ Timeout waiting for ongoing ingestion job to complete after 30 minutes")
                         return {'status': 'TIMEOUT', 'message': 'Timeout waiting for ongoing ingestion job to complete'}
                 else:
                     # Re-raise if it's not a ConflictException
@@ -484,35 +488,63 @@ class KBIngestionService:
             
             # Log final status
             if wait_result.get('status') == 'COMPLETE':
-                logger.info(f"[KB-SYNC] ✅ Knowledge Base sync COMPLETED successfully!")
-                logger.info(f"[KB-SYNC] 📊 Job ID: {job_id}")
-                logger.info(f"[KB-SYNC] 🗂️  Folder: {folder}")
-                logger.info(f"[KB-SYNC] 🔗 KB ID: {kb_info['id']}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("[KB-SYNC] ✅ Knowledge Base sync COMPLETED successfully!")
+                    logger.info("[KB-SYNC] 📊 Job ID: %s", job_id)
+                    logger.info("[KB-SYNC] 🗂️  Folder: %s", folder)
+                    logger.info("[KB-SYNC] 🔗 KB ID: %s", kb_id)
             else:
-                logger.warning(f"[KB-SYNC] ⚠️  Knowledge Base sync completed with status: {wait_result.get('status')}")
+                logger.warning("[KB-SYNC] ⚠️  Knowledge Base sync completed with status: %s", wait_result.get('status'))
                 if wait_result.get('failed_files'):
-                    logger.warning(f"[KB-SYNC] 📄 Failed files: {len(wait_result.get('failed_files', []))}")
+                    logger.warning("[KB-SYNC] 📄 Failed files: %s", len(wait_result.get('failed_files', [])))
             
             return wait_result
 
         except Exception as e:
-            logger.error(f"[KB-SYNC] ❌ Error during sync job for folder {folder}: {str(e)}")
+            logger.error("[KB-SYNC] ❌ Error during sync job for folder %s: %s", folder, e)
             raise
         finally:
             # Always release the lock
             self._release_kb_lock(kb_id)
 
-    def wait_for_ingestion_job(self, kb_info: Dict[str, str], job_id: str, folder_name: str = '') -> Dict[str, Any]:
+    def start_ingestion_job(self, folder: str) -> Optional[str]:
+        """
+        Start a Bedrock ingestion job for a folder without taking the KB lock
+        or waiting for the job to finish.
+        
+        Returns the job ID, or None when the data source already has a job
+        running (Bedrock allows one at a time).
+        """
+        kb_id, data_source_id = self.config.KB_MAPPING[folder]
+        try:
+            response = self.bedrock_client.start_ingestion_job(
+                clientToken=str(uuid.uuid4()),
+                dataSourceId=data_source_id,
+                knowledgeBaseId=kb_id,
+                description=f"Shutdown sync for {folder}"
+            )
+        except Exception as e:
+            if 'ConflictException' in str(e):
+                logger.warning("[KB-SYNC] ⚠️  KB %s already has an ingestion job running; files in %s may need another sync", kb_id, folder)
+                return None
+            raise
+        
+        job_id = response['ingestionJob']['ingestionJobId']
+        logger.info("[KB-SYNC] ✅ Started ingestion job %s for folder %s", job_id, folder)
+        return job_id
+
+    def wait_for_ingestion_job(self, kb_info: Tuple[str, str], job_id: str, folder_name: str = '') -> Dict[str, Any]:
         """
         Polls the knowledge base for ingestion job status, extracts failed files
         due to token limits if the job fails with relevant reasons.
         """
+        kb_id, data_source_id = kb_info
         max_attempts = 60
         interval = 30
         failed_files_due_to_tokens = []
 
-        logger.info(f"KB_SYNC: Monitoring ingestion job {job_id}")
-        logger.info(f"KB_SYNC: Maximum wait time: {max_attempts * interval / 60:.1f} minutes")
+        logger.info("KB_SYNC: Monitoring ingestion job %s", job_id)
+        logger.info("KB_SYNC: Maximum wait time: %.1f minutes", max_attempts * interval / 60)
 
         start_time = time.time()
         last_status = None
@@ -520,40 +552,40 @@ class KBIngestionService:
         for attempt in range(max_attempts):
             try:
                 response = self.bedrock_client.get_ingestion_job(
-                    dataSourceId=kb_info['data_source_id'],
+                    dataSourceId=data_source_id,
                     ingestionJobId=job_id,
-                    knowledgeBaseId=kb_info['id']
+                    knowledgeBaseId=kb_id
                 )
                 status = response['ingestionJob']['status']
                 failure_reasons = response['ingestionJob'].get('failureReasons', [])
                 
                 # Log status changes
                 if status != last_status:
-                    logger.info(f"KB_SYNC: Job status changed to '{status}'")
+                    logger.info("KB_SYNC: Job status changed to '%s'", status)
                     last_status = status
                 
                 # Progress update every 5 minutes
                 if attempt % 10 == 0 and attempt > 0:
                     elapsed = time.time() - start_time
-                    logger.info(f"KB_SYNC: Still processing... ({elapsed:.0f}s elapsed)")
+                    logger.info("KB_SYNC: Still processing... (%.0fs elapsed)", elapsed)
 
                 if status == 'COMPLETE':
                     elapsed = time.time() - start_time
-                    logger.info(f"KB_SYNC: Job completed successfully in {elapsed:.0f}s")
+                    logger.info("KB_SYNC: Job completed successfully in %.0fs", elapsed)
                     
                     # Log final statistics
                     stats = response['ingestionJob'].get('statistics', {})
                     processed = stats.get('documentsProcessed', 0)
                     failed = stats.get('documentsFailed', 0)
                     if processed or failed:
-                        logger.info(f"KB_SYNC: Final stats - Processed: {processed}, Failed: {failed}")
+                        logger.info("KB_SYNC: Final stats - Processed: %s, Failed: %s", processed, failed)
                     
                     return {'status': 'COMPLETE', 'failed_files': failed_files_due_to_tokens, 'duration': elapsed}
 
                 elif status == 'FAILED':
                     elapsed = time.time() - start_time
-                    logger.error(f"KB_SYNC: Job failed after {elapsed:.0f}s")
-                    logger.error(f"KB_SYNC: Failure reasons: {failure_reasons}")
+                    logger.error("KB_SYNC: Job failed after %.0fs", elapsed)
+                    logger.error("KB_SYNC: Failure reasons: %s", failure_reasons)
 
                     # Extract failed files and log to CSV using new method
                     failed_files_due_to_tokens = self._extract_failed_files_from_reasons(
@@ -561,7 +593,7 @@ class KBIngestionService:
                     )
 
                     if failed_files_due_to_tokens:
-                        logger.warning(f"KB_SYNC: {len(failed_files_due_to_tokens)} files failed due to token limits")
+                        logger.warning("KB_SYNC: %s files failed due to token limits", len(failed_files_due_to_tokens))
                         return {'status': 'FAILED_TOKEN_ERROR', 'failed_files': failed_files_due_to_tokens, 'duration': elapsed}
                     else:
                         # Log general failure to CSV if no specific files identified
@@ -577,13 +609,13 @@ class KBIngestionService:
                 elif status == 'IN_PROGRESS':
                     # Show progress every 5 minutes
                     if attempt % 10 == 0:
-                        logger.info(f"[KB-SYNC] 🔄 Job {job_id} is IN_PROGRESS... ({attempt+1}/{max_attempts})")
+                        logger.info("[KB-SYNC] 🔄 Job %s is IN_PROGRESS... (%s/%s)", job_id, attempt + 1, max_attempts)
 
                 time.sleep(interval)
 
             except Exception as e:
                 elapsed = time.time() - start_time
-                logger.error(f"[KB-SYNC] 🔥 Error checking job status for {job_id}: {str(e)} (after {elapsed:.0f}s)")
+                logger.error("[KB-SYNC] 🔥 Error checking job status for %s: %s (after %.0fs)", job_id, e, elapsed)
                 if failed_files_due_to_tokens:
                     return {'status': 'ERROR_DURING_WAIT', 'failed_files': failed_files_due_to_tokens, 'polling_error': str(e), 'duration': elapsed}
                 else:
@@ -591,7 +623,7 @@ class KBIngestionService:
 
         # Timeout
         elapsed = time.time() - start_time
-        logger.error(f"[KB-SYNC] ⏰ TIMEOUT! Job {job_id} timed out after {elapsed:.0f}s ({max_attempts} attempts)")
+        logger.error("[KB-SYNC] ⏰ TIMEOUT! Job %s timed out after %.0fs (%s attempts)", job_id, elapsed, max_attempts)
         if failed_files_due_to_tokens:
             return {'status': 'TIMEOUT_TOKEN_ERROR', 'failed_files': failed_files_due_to_tokens, 'timeout': True, 'duration': elapsed}
         else:
@@ -623,6 +655,144 @@ class KBIngestionService:
             logger.error(f"Error deleting S3 object: {str(e)}")
             return False
 
-    def get_kb_mapping(self) -> Dict[str, Dict[str, str]]:
+    def get_kb_mapping(self) -> Dict[str, Tuple[str, str]]:
         """Get the KB mapping configuration"""
         return self.config.KB_MAPPING
+
+
+class KBSyncBatcher:
+    """
+    Coalesces KB sync requests from processed files.
+    
+    An ingestion job re-syncs the whole folder, so files finishing in the same
+    folder only need one job between them. Folders are collected in a set and
+    handed to a small sync pool every flush_interval seconds, or as soon as
+    max_pending distinct folders are waiting. Folders sync concurrently, so a
+    long ingestion in one knowledge base does not hold up the others (the
+    per-KB lock still serializes jobs within one knowledge base).
+    
+    The SQS messages of queued folders are already deleted, so shutdown()
+    starts a job for each of them straight away rather than waiting for a
+    pool thread, and folders added after shutdown start theirs at once.
+    """
+    
+    def __init__(self, kb_service: KBIngestionService,
+                 flush_interval: int = KB_SYNC_FLUSH_INTERVAL,
+                 max_pending: int = KB_SYNC_MAX_PENDING,
+                 max_concurrency: int = KB_SYNC_MAX_CONCURRENCY):
+        self.kb_service = kb_service
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        
+        self._pending = set()
+        # Folders handed to the sync pool that have not started yet; a later
+        # flush skips them, as the queued sync will pick up their new files
+        self._scheduled = set()
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._kb_sync_stage = metrics.pipeline_stage_files.labels(stage='kb_sync')
+        self._sync_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='kb-sync')
+        
+        self._thread = threading.Thread(target=self._run, name='kb-sync-batcher', daemon=True)
+        self._thread.start()
+        # Queued folders are not lost on a normal interpreter exit either
+        atexit.register(self.shutdown)
+    
+    def add(self, folder: str) -> None:
+        """Queue a folder for the next KB sync"""
+        with self._pending_lock:
+            stopped = self._stopped.is_set()
+            if not stopped:
+                self._pending.add(folder)
+                pending_count = len(self._pending)
+        
+        if stopped:
+            # Nothing flushes the queue any more
+            self._start_folder(folder)
+        elif pending_count >= self.max_pending:
+            self._wake.set()
+    
+    def flush(self) -> None:
+        """Start a KB sync for every queued folder"""
+        with self._pending_lock:
+            folders = self._pending - self._scheduled
+            self._scheduled |= folders
+            self._pending = set()
+        
+        for folder in folders:
+            try:
+                self._sync_pool.submit(self._sync_folder, folder)
+            except RuntimeError:
+                # At interpreter exit the pool takes no new work
+                with self._pending_lock:
+                    self._scheduled.discard(folder)
+                self._start_folder(folder)
+    
+    def shutdown(self) -> None:
+        """Stop the background thread and start a KB job for every folder still queued"""
+        with self._pending_lock:
+            if self._stopped.is_set():
+                return
+            self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+        
+        # A sync waiting in the pool may sit behind ingestion polls of up to
+        # 30 minutes, longer than a container stop allows; cancel those and
+        # start their jobs here. Syncs already running keep polling
+        self._sync_pool.shutdown(wait=False, cancel_futures=True)
+        with self._pending_lock:
+            folders = self._pending | self._scheduled
+            self._pending = set()
+            self._scheduled = set()
+        
+        for folder in folders:
+            self._start_folder(folder)
+    
+    def _run(self):
+        """Background loop flushing the queue on each interval or wake-up"""
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            self.flush()
+    
+    def _start_folder(self, folder: str) -> None:
+        """Start a KB job for a folder without waiting for it"""
+        try:
+            self.kb_service.start_ingestion_job(folder)
+        except Exception as e:
+            metrics.record_kb_sync_attempt(folder, 'failed')
+            logger.error("[KB-SYNC] Could not start sync for %s: %s", folder, e)
+    
+    def _sync_folder(self, folder: str) -> None:
+        """Run one KB sync for a folder and record its metrics"""
+        with self._pending_lock:
+            self._scheduled.discard(folder)
+        
+        try:
+            logger.info("[KB-SYNC] Starting batched sync for folder: %s", folder)
+            metrics.files_in_kb_sync.inc()
+            self._kb_sync_stage.inc()
+            kb_start = time.perf_counter()
+            try:
+                kb_result = self.kb_service.sync_to_knowledge_base_simple(folder)
+            finally:
+                metrics.files_in_kb_sync.dec()
+                self._kb_sync_stage.dec()
+            kb_duration = time.perf_counter() - kb_start
+            logger.info("[KB-SYNC] Batched sync completed for %s: %s, duration=%.2fs", folder, kb_result, kb_duration)
+            
+            if kb_result.get('status') == 'COMPLETE':
+                metrics.record_kb_sync_success(folder)
+                metrics.record_processing_time('kb_sync', kb_duration)
+            else:
+                metrics.record_kb_sync_attempt(folder, 'failed', kb_duration)
+                logger.warning("[KB-SYNC] Batched sync for %s failed with status: %s", folder, kb_result.get('status'))
+                
+        except Exception as e:
+            metrics.record_kb_sync_attempt(folder, 'failed')
+            metrics.processing_errors.labels(error_type='sync_failed', step='kb_sync').inc()
+            logger.error("[KB-SYNC] Batched sync error for %s: %s", folder, e)
@@ -7,31 +7,91 @@ Fixes PDF files where chunk_s3_uri ends with "..." by replacing the first page w
 import boto3
 import csv
 import io
+import itertools
 import logging
+import os
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timezone, timedelta
-from PyPDF2 import PdfReader, PdfWriter
+import fitz
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib.utils import simpleSplit
 from threading import Lock
 import urllib3
-from typing import Dict, List, Tuple, Any
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Tuple, Any
 from io import BytesIO
-from config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, CHUNKED_BUCKET
+from botocore.config import Config
+from config import (
+    AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION, CHUNKED_BUCKET,
+    S3_MAX_POOL_CONNECTIONS, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT
+)
 
 # Suppress urllib3 warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
 
-# Thread-safe counters
-processed_count = 0
-fixed_count = 0
-skipped_count = 0
-error_count = 0
-processed_lock = Lock()
+# Leading bytes fetched to read page 1 before falling back to a full GET
+FIRST_PAGE_RANGE_BYTES = 256 * 1024
+
+# Matches "chunk_s3_uri:", "Chunk S3 Uri:" etc. in a single pass over the page text
+CHUNK_URI_PATTERN = re.compile(r'chunk[_\s]*s3[_\s]*uri\s*:\s*(s3://\S+)', re.IGNORECASE)
+
+# Metadata page field display order and labels
+FIELD_LABELS = {
+    'document_name': 'Document Name',
+    'processed_file_path': 'Processed File Path', 
+    'page_number': 'Page Number',
+    'total_pages': 'Total Pages',
+    'chunk_s3_uri_processed': 'Chunk S3 Uri Processed',
+    'chunk_s3_uri': 'Chunk S3 Uri',
+    'standard_type': 'Standard Type',
+    'country': 'Country',
+    'document_type': 'Document Type',
+    'document_category': 'Document Category',
+    'document_sub-category': 'Document Sub-Category',
+    'year': 'Year',
+    'state': 'State',
+    'State': 'State',  # Handle both capitalizations
+    'state_category': 'State Category',
+    'State_category': 'State Category',  # Handle both capitalizations
+    'Standard_type': 'Standard Type',  # Handle capitalization inconsistency
+    'complexity': 'Complexity'
+}
+
+# Pre-rendered content stream for the metadata page (same layout as the
+# ReportLab canvas in create_corrected_metadata_page): the static title,
+# table header and header rule, plus per-row and border templates
+METADATA_PAGE_HEADER = (
+    "BT /F2 16 Tf 1 0 0 1 400 460 Tm (Document Metadata) Tj ET\n"
+    "BT /F2 10 Tf 1 0 0 1 50 430 Tm (Field) Tj 120 0 Td (Value) Tj ET\n"
+    "50 425 m 950 425 l S\n"
+)
+METADATA_ROW_TEMPLATE = (
+    "BT /F1 10 Tf 1 0 0 1 50 {y} Tm ({label}) Tj 120 0 Td ({value}) Tj ET\n"
+    "0.8 G 50 {rule_y} m 950 {rule_y} l S 0 G\n"
+)
+METADATA_BORDER_TEMPLATE = "40 {y} 920 {height} re S\n"
+METADATA_VALUE_MAX_WIDTH = 780  # table width - label column - padding
+
+
+# Page resources for the pre-rendered content stream (F1/F2 = Helvetica/Helvetica-Bold)
+METADATA_PAGE_RESOURCES = (
+    "<</Font<<"
+    "/F1<</Type/Font/Subtype/Type1/BaseFont/Helvetica/Encoding/WinAnsiEncoding>>"
+    "/F2<</Type/Font/Subtype/Type1/BaseFont/Helvetica-Bold/Encoding/WinAnsiEncoding>>"
+    ">>>>"
+)
+
+# Folder prefix scanned when run as a script
+TARGET_FOLDER = os.getenv('TARGET_FOLDER', '')
+
+# Lock-free file counter (next() on itertools.count is atomic in CPython);
+# per-status totals are derived from the results once processing finishes
+processed_counter = itertools.count(1)
 
 # Use existing logger
 logger = logging.getLogger(__name__)
@@ -39,122 +99,222 @@ logger = logging.getLogger(__name__)
 class MetadataFixer:
     """Class to handle PDF metadata correction operations."""
     
-    def __init__(self, s3_service=None, bucket_name=None):
+    def __init__(self, s3_service=None, bucket_name=None, max_workers: int = 8, scan_workers: int = 32):
         self.results = []
         self.results_lock = Lock()
+        self.max_workers = max_workers
+        self.scan_workers = scan_workers
         
         # Use provided S3 service or create default
         if s3_service:
             self.s3_service = s3_service
             self.bucket_name = bucket_name or CHUNKED_BUCKET
         else:
-            # Fallback to standalone mode
+            # Fallback to standalone mode - size the connection pool to the scan and
+            # fix workers so they never wait on (or discard) pooled connections
+            config = Config(
+                region_name=AWS_REGION,
+                retries={'max_attempts': 10, 'mode': 'adaptive'},
+                max_pool_connections=max((max_workers + scan_workers) * 2, S3_MAX_POOL_CONNECTIONS),
+                connect_timeout=S3_CONNECT_TIMEOUT,
+                read_timeout=S3_READ_TIMEOUT,
+                tcp_keepalive=True
+            )
             self.s3_client = boto3.client(
                 "s3",
                 aws_access_key_id=AWS_ACCESS_KEY_ID,
                 aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
                 region_name=AWS_REGION,
+                config=config
             )
             self.bucket_name = CHUNKED_BUCKET
+        
+        # Resolve the boto3 client (orchestrator's or standalone) and its hot
+        # methods once instead of branching on every S3 call
+        self._s3 = self.s3_service.s3 if s3_service else self.s3_client
+        self._s3_get = self._s3.get_object
+        self._s3_put = self._s3.put_object
+        
+        # Constant prefix of every expected chunk_s3_uri
+        self._uri_prefix = f"s3://{self.bucket_name}/"
     
-    def extract_metadata_from_first_page(self, s3_key: str) -> Dict[str, Any]:
-        """Extract metadata from the first page of a PDF file."""
+    def _download_pdf(self, s3_key: str, max_bytes: int = None) -> Tuple[bytes, bool]:
+        """
+        Download the PDF body for s3_key, or only its first max_bytes bytes.
+        
+        Returns (body, complete) where complete is False when the ranged read
+        did not cover the whole object.
+        """
+        request = {'Bucket': self.bucket_name, 'Key': s3_key}
+        if max_bytes:
+            request['Range'] = f"bytes=0-{max_bytes - 1}"
+        
+        response = self._s3_get(**request)
+        body = response['Body'].read()
+        
+        # Ranged reads report "bytes 0-N/TOTAL"; small objects come back whole
+        content_range = response.get('ContentRange')
+        complete = not content_range or len(body) >= int(content_range.rsplit('/', 1)[1])
+        return body, complete
+    
+    def _first_page_text(self, pdf_bytes: bytes) -> str:
+        """Return the text of the first page, or '' for a PDF without pages."""
+        # MuPDF's C parser is far cheaper than PyPDF2 for first-page text
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+            if pdf_doc.page_count == 0:
+                return ''
+            return pdf_doc.load_page(0).get_text("text")
+    
+    def extract_metadata_from_first_page(self, s3_key: str, pdf_bytes: bytes = None) -> Tuple[Dict[str, Any], bytes]:
+        """
+        Extract metadata from the first page of a PDF file.
+
+        Downloads the object only when pdf_bytes is not supplied, starting with
+        a ranged read of the first FIRST_PAGE_RANGE_BYTES. Returns
+        (metadata, pdf_bytes) so callers can reuse the body instead of
+        issuing a second GetObject; pdf_bytes is None when only part of the
+        object was read.
+        """
+        complete = pdf_bytes is not None
         try:
-            logger.info(f"🔍 DEBUG: hasattr s3_service: {hasattr(self, 's3_service')}")
-            if hasattr(self, 's3_service'):
-                logger.info(f"🔍 DEBUG: s3_service type: {type(self.s3_service)}")
-                logger.info(f"🔍 DEBUG: s3_service dir: {[attr for attr in dir(self.s3_service) if not attr.startswith('_')]}")
-                try:
-                    # Use orchestrator's S3 service
-                    logger.info(f"🔍 DEBUG: Attempting s3_service.s3.get_object...")
-                    response = self.s3_service.s3.get_object(Bucket=self.bucket_name, Key=s3_key)
-                    logger.info(f"🔍 DEBUG: S3 get_object successful!")
-                except Exception as e:
-                    logger.error(f"🔍 DEBUG: S3 get_object failed: {e}")
-                    raise
-            else:
-                logger.info(f"🔍 DEBUG: Using standalone s3_client")
-                # Use standalone S3 client
-                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            pdf_content = response['Body'].read()
+            if pdf_bytes is None:
+                pdf_bytes, complete = self._download_pdf(s3_key, FIRST_PAGE_RANGE_BYTES)
             
-            with io.BytesIO(pdf_content) as pdf_stream:
-                pdf_reader = PdfReader(pdf_stream)
-                
-                if len(pdf_reader.pages) == 0:
-                    return {}
-                
-                first_page = pdf_reader.pages[0]
-                text = first_page.extract_text()
-                
-                # DEBUG: Log the extracted text to see what we're working with
-                logger.info(f"=== EXTRACTED TEXT FROM FIRST PAGE ===")
-                logger.info(f"Text length: {len(text)}")
-                logger.info(f"Raw text:\n{text}")
-                logger.info(f"=== END EXTRACTED TEXT ===")
+            try:
+                text = self._first_page_text(pdf_bytes)
+            except Exception:
+                if complete:
+                    raise
+                text = ''
+            
+            if not complete and 's3://' not in text:
+                # Page 1 did not fit in the ranged read - fall back to a full GET
+                pdf_bytes, complete = self._download_pdf(s3_key)
+                text = self._first_page_text(pdf_bytes)
+            
+            # DEBUG: Log the extracted text to see what we're working with
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"=== EXTRACTED TEXT FROM FIRST PAGE ===")
+                logger.debug(f"Text length: {len(text)}")
+                logger.debug(f"Raw text:\n{text}")
+                logger.debug(f"=== END EXTRACTED TEXT ===")
 
-                metadata = {}
-                
-                # Try multiple patterns to extract metadata
-                # Split text into lines and process each line individually
-                lines = text.split('\n')
-                matches = []
-                
-                for i, line in enumerate(lines):
-                    line = line.strip()
-                    # Look for lines that end with ':' (field names)
-                    if line.endswith(':') and i + 1 < len(lines):
-                        field_name = line[:-1].strip()  # Remove the ':'
-                        field_value = lines[i + 1].strip()  # Next line is the value
-                        
-                        # Skip table headers and empty values
-                        if (field_name and field_value and 
-                            field_name not in ['Field', 'Value', 'Document Metadata'] and
-                            field_value not in ['Field', 'Value']):
-                            matches.append((field_name, field_value))
-                
-                # DEBUG: Log what regex matches we found
-                logger.info(f"=== REGEX MATCHES FOUND ===")
-                logger.info(f"Total matches: {len(matches)}")
+            metadata = {}
+            
+            # Try multiple patterns to extract metadata
+            # Split text into lines and process each line individually
+            lines = text.split('\n')
+            matches = []
+            
+            for i, line in enumerate(lines):
+                line = line.strip()
+                # Look for lines that end with ':' (field names)
+                if line.endswith(':') and i + 1 < len(lines):
+                    field_name = line[:-1].strip()  # Remove the ':'
+                    field_value = lines[i + 1].strip()  # Next line is the value
+                    
+                    # Skip table headers and empty values
+                    if (field_name and field_value and 
+                        field_name not in ['Field', 'Value', 'Document Metadata'] and
+                        field_value not in ['Field', 'Value']):
+                        matches.append((field_name, field_value))
+            
+            # DEBUG: Log what regex matches we found
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"=== REGEX MATCHES FOUND ===")
+                logger.debug(f"Total matches: {len(matches)}")
                 for i, (key, value) in enumerate(matches):
-                    logger.info(f"Match {i+1}: '{key}' -> '{value}'")
-                logger.info(f"=== END REGEX MATCHES ===")
-                
-                for key, value in matches:
-                    key = key.strip().replace(' ', '_').lower()
-                    value = value.strip()
-                    if key and value:
-                        metadata[key] = value
-                
-                # Special handling for chunk_s3_uri with different possible names
-                chunk_uri_patterns = [
-                    r'chunk_s3_uri:\s*(s3://[^\s\n]+)',
-                    r'Chunk\s+S3\s+Uri:\s*(s3://[^\s\n]+)',
-                    r'chunk\s+s3\s+uri:\s*(s3://[^\s\n]+)',
-                ]
-                
-                for pattern in chunk_uri_patterns:
-                    uri_match = re.search(pattern, text, re.IGNORECASE)
-                    if uri_match:
-                        metadata['chunk_s3_uri'] = uri_match.group(1).strip()
-                        break
-                
-                # DEBUG: Log final extracted metadata
-                logger.info(f"=== FINAL EXTRACTED METADATA ===")
-                logger.info(f"Total fields extracted: {len(metadata)}")
+                    logger.debug(f"Match {i+1}: '{key}' -> '{value}'")
+                logger.debug(f"=== END REGEX MATCHES ===")
+            
+            for key, value in matches:
+                key = key.strip().replace(' ', '_').lower()
+                value = value.strip()
+                if key and value:
+                    metadata[key] = value
+            
+            # Special handling for chunk_s3_uri with different possible names
+            uri_match = CHUNK_URI_PATTERN.search(text)
+            if uri_match:
+                metadata['chunk_s3_uri'] = uri_match.group(1).strip()
+            
+            # DEBUG: Log final extracted metadata
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"=== FINAL EXTRACTED METADATA ===")
+                logger.debug(f"Total fields extracted: {len(metadata)}")
                 for key, value in metadata.items():
-                    logger.info(f"'{key}': '{value}'")
-                logger.info(f"=== END FINAL METADATA ===")
-                
-                return metadata
+                    logger.debug(f"'{key}': '{value}'")
+                logger.debug(f"=== END FINAL METADATA ===")
+            
+            return metadata, pdf_bytes if complete else None
                 
         except Exception as e:
             logger.error(f"Error extracting metadata from {s3_key}: {e}")
-            return {}
+            return {}, pdf_bytes if complete else None
     
-    def create_corrected_metadata_page(self, metadata: Dict[str, Any]) -> bytes:
-        """Create a new metadata page with corrected chunk_s3_uri in table format (landscape)."""
+    def _pdf_text(self, text: str) -> str:
+        """Escape text for a PDF string literal, or return None if it needs the ReportLab path."""
         try:
+            text.encode('cp1252')
+        except UnicodeEncodeError:
+            return None
+        if '\n' in text or '\r' in text:
+            return None
+        return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    
+    def _create_metadata_page_from_template(self, metadata: Dict[str, Any]) -> fitz.Document:
+        """
+        Build the metadata page straight from the pre-rendered content stream.
+        
+        Returns None when a value would need wrapping or cannot be drawn with
+        the standard Helvetica encoding, so the caller can fall back to ReportLab.
+        """
+        y_start = 430
+        row_height = 22
+        
+        content = [METADATA_PAGE_HEADER]
+        y = y_start - row_height
+        
+        for key, label in FIELD_LABELS.items():
+            if key in metadata:
+                value_str = str(metadata[key]) if metadata[key] is not None else "None"
+                
+                if stringWidth(value_str, "Helvetica", 10) > METADATA_VALUE_MAX_WIDTH:
+                    return None
+                value = self._pdf_text(value_str)
+                if value is None:
+                    return None
+                
+                row_y = y
+                # An empty value draws no line (matches simpleSplit returning [])
+                y -= row_height + (14 if value_str else 0)
+                content.append(METADATA_ROW_TEMPLATE.format(
+                    y=row_y, label=f"{label}:", value=value, rule_y=y + 10
+                ))
+        
+        content.append(METADATA_BORDER_TEMPLATE.format(y=y, height=y_start - y + 20))
+        
+        page_doc = fitz.open()
+        page = page_doc.new_page(width=1000, height=500)
+        contents_xref = page_doc.get_new_xref()
+        page_doc.update_object(contents_xref, "<<>>")
+        page_doc.update_stream(contents_xref, "".join(content).encode('cp1252'))
+        page_doc.xref_set_key(page.xref, "Contents", f"{contents_xref} 0 R")
+        page_doc.xref_set_key(page.xref, "Resources", METADATA_PAGE_RESOURCES)
+        return page_doc
+    
+    def create_corrected_metadata_page(self, metadata: Dict[str, Any]) -> fitz.Document:
+        """
+        Create a new metadata page with corrected chunk_s3_uri in table format (landscape).
+        
+        Returns a single-page fitz document (the caller closes it), or None on error.
+        """
+        try:
+            # Single-line values (the common case) skip the ReportLab canvas
+            page_doc = self._create_metadata_page_from_template(metadata)
+            if page_doc is not None:
+                return page_doc
+            
             packet = BytesIO()
             # Custom page size: wider and shorter to fit S3 URIs on single line
             # Standard landscape letter is 792x612, we'll use 1000x500 (much wider, shorter)
@@ -185,29 +345,7 @@ class MetadataFixer:
             c.setFont("Helvetica", 10)
             y = y_start - row_height
             
-            # Define field display order and labels
-            field_labels = {
-                'document_name': 'Document Name',
-                'processed_file_path': 'Processed File Path', 
-                'page_number': 'Page Number',
-                'total_pages': 'Total Pages',
-                'chunk_s3_uri_processed': 'Chunk S3 Uri Processed',
-                'chunk_s3_uri': 'Chunk S3 Uri',
-                'standard_type': 'Standard Type',
-                'country': 'Country',
-                'document_type': 'Document Type',
-                'document_category': 'Document Category',
-                'document_sub-category': 'Document Sub-Category',
-                'year': 'Year',
-                'state': 'State',
-                'State': 'State',  # Handle both capitalizations
-                'state_category': 'State Category',
-                'State_category': 'State Category',  # Handle both capitalizations
-                'Standard_type': 'Standard Type',  # Handle capitalization inconsistency
-                'complexity': 'Complexity'
-            }
-            
-            for key, label in field_labels.items():
+            for key, label in FIELD_LABELS.items():
                 if key in metadata:
                     value_str = str(metadata[key]) if metadata[key] is not None else "None"
                     
@@ -218,8 +356,13 @@ class MetadataFixer:
                     # Calculate available width (table_width - field name column width - padding)
                     max_width = table_width - (col2_x - col1_x) - 20  # ~800 pixels available
                     
-                    # Split text intelligently using reportlab's simpleSplit
-                    lines = simpleSplit(value_str, "Helvetica", 10, max_width)
+                    # Values that fit (the common case on this wide page) skip
+                    # reportlab's per-word simpleSplit measuring
+                    if "\n" not in value_str and stringWidth(value_str, "Helvetica", 10) <= max_width:
+                        lines = [value_str] if value_str else []
+                    else:
+                        # Split text intelligently using reportlab's simpleSplit
+                        lines = simpleSplit(value_str, "Helvetica", 10, max_width)
                     
                     # Draw all lines with proper spacing
                     for line in lines:
@@ -245,11 +388,9 @@ class MetadataFixer:
             
             c.showPage()
             c.save()
-            packet.seek(0)
             
-            # Convert to PDF page
-            metadata_pdf = PdfReader(packet)
-            return metadata_pdf.pages[0]
+            # Hand the page over in the fitz domain for assembly
+            return fitz.open(stream=packet.getvalue(), filetype="pdf")
             
         except Exception as e:
             logger.error(f"Error creating metadata page: {e}")
@@ -257,12 +398,15 @@ class MetadataFixer:
     
     def generate_expected_uri(self, chunk_path: str) -> str:
         """Generate the expected S3 URI from chunk file path."""
-        return f"s3://{self.bucket_name}/{chunk_path}"
+        return self._uri_prefix + chunk_path
     
-    def fix_single_file(self, s3_key: str) -> Dict[str, Any]:
-        """Fix a single PDF file's metadata if it has truncated chunk_s3_uri."""
-        global processed_count, fixed_count, skipped_count, error_count
+    def fix_single_file(self, s3_key: str, metadata: Dict[str, Any] = None, pdf_bytes: bytes = None) -> Dict[str, Any]:
+        """
+        Fix a single PDF file's metadata if it has truncated chunk_s3_uri.
         
+        metadata/pdf_bytes may be passed in from the scan so the object is not
+        downloaded and parsed a second time.
+        """
         result = {
             'file_path': s3_key,
             'status': 'processing',
@@ -276,14 +420,15 @@ class MetadataFixer:
         start_time = time.time()
         
         try:
-            with processed_lock:
-                processed_count += 1
-                current_count = processed_count
+            current_count = next(processed_counter)
             
             logger.info(f"Processing file {current_count}: {s3_key}")
             
-            # Extract current metadata
-            metadata = self.extract_metadata_from_first_page(s3_key)
+            # Extract current metadata (keeps the downloaded body for the rewrite below)
+            if metadata is None:
+                metadata, original_pdf_content = self.extract_metadata_from_first_page(s3_key, pdf_bytes)
+            else:
+                original_pdf_content = pdf_bytes
             
             if not metadata:
                 result.update({
@@ -291,8 +436,6 @@ class MetadataFixer:
                     'action_taken': 'No metadata found',
                     'error': 'Could not extract metadata'
                 })
-                with processed_lock:
-                    skipped_count += 1
                 return result
             
             current_chunk_uri = metadata.get('chunk_s3_uri', '')
@@ -312,86 +455,63 @@ class MetadataFixer:
                     'status': 'skipped',
                     'action_taken': 'URI already correct',
                 })
-                with processed_lock:
-                    skipped_count += 1
                 return result
             
-            # Download original PDF
-            if hasattr(self, 's3_service'):
-                # Use orchestrator's S3 service
-                response = self.s3_service.s3.get_object(Bucket=self.bucket_name, Key=s3_key)
-            else:
-                # Use standalone S3 client
-                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            original_pdf_content = response['Body'].read()
-            
-            # Read original PDF
-            original_reader = PdfReader(io.BytesIO(original_pdf_content))
-            
-            if len(original_reader.pages) < 2:
-                result.update({
-                    'status': 'error',
-                    'action_taken': 'PDF has less than 2 pages',
-                    'error': 'Cannot fix single-page PDF'
-                })
-                with processed_lock:
-                    error_count += 1
-                return result
-            
-            # Create new PDF with corrected metadata
-            writer = PdfWriter()
+            # The metadata probe may only have read the head of a large object
+            if original_pdf_content is None:
+                original_pdf_content, _ = self._download_pdf(s3_key)
             
             # Update metadata with correct URI
             corrected_metadata = metadata.copy()
             corrected_metadata['chunk_s3_uri'] = expected_uri
             
-            # Create new metadata page
-            new_metadata_page = self.create_corrected_metadata_page(corrected_metadata)
-            
-            if new_metadata_page is None:
-                result.update({
-                    'status': 'error',
-                    'action_taken': 'Failed to create metadata page',
-                    'error': 'Metadata page creation failed'
-                })
-                with processed_lock:
-                    error_count += 1
-                return result
-            
-            # Add corrected metadata page
-            writer.add_page(new_metadata_page)
-            
-            # Add all content pages (skip original metadata page)
-            for page_num in range(1, len(original_reader.pages)):
-                writer.add_page(original_reader.pages[page_num])
-            
-            # Write corrected PDF to memory
-            output_stream = io.BytesIO()
-            writer.write(output_stream)
-            output_stream.seek(0)
-            corrected_pdf_content = output_stream.getvalue()
-            
-            # Upload corrected PDF back to S3
-            if hasattr(self, 's3_service'):
-                # Use orchestrator's S3 service
-                self.s3_service.put_object(self.bucket_name, s3_key, corrected_pdf_content)
-            else:
-                # Use standalone S3 client
-                self.s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=s3_key,
-                    Body=corrected_pdf_content,
-                    ContentType='application/pdf'
-                )
+            # Read original PDF
+            with fitz.open(stream=original_pdf_content, filetype="pdf") as original_doc:
+                if original_doc.page_count < 2:
+                    result.update({
+                        'status': 'error',
+                        'action_taken': 'PDF has less than 2 pages',
+                        'error': 'Cannot fix single-page PDF'
+                    })
+                    return result
+                
+                # Create new metadata page
+                new_metadata_page = self.create_corrected_metadata_page(corrected_metadata)
+                
+                if new_metadata_page is None:
+                    result.update({
+                        'status': 'error',
+                        'action_taken': 'Failed to create metadata page',
+                        'error': 'Metadata page creation failed'
+                    })
+                    return result
+                
+                # Create new PDF: corrected metadata page, then all content pages
+                # (skip original metadata page). insert_pdf copies the page objects
+                # structurally in MuPDF instead of rewriting them one by one in Python
+                output_stream = io.BytesIO()
+                with new_metadata_page, fitz.open() as corrected_doc:
+                    corrected_doc.insert_pdf(new_metadata_page)
+                    corrected_doc.insert_pdf(original_doc, from_page=1)
+                    
+                    # Unchanged streams are copied as-is, not recompressed
+                    corrected_doc.save(output_stream, garbage=0, deflate=False)
+                output_stream.seek(0)
+            
+            # Upload corrected PDF back to S3 - boto3 reads the buffer directly,
+            # so no getvalue() copy of the whole PDF is made
+            self._s3_put(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Body=output_stream,
+                ContentType='application/pdf'
+            )
             
             result.update({
                 'status': 'fixed',
                 'action_taken': 'Replaced first page with corrected metadata',
             })
             
-            with processed_lock:
-                fixed_count += 1
-            
             logger.info(f"✅ Fixed: {s3_key}")
             
         except Exception as e:
@@ -400,8 +520,6 @@ class MetadataFixer:
                 'action_taken': 'Processing failed',
                 'error': str(e)
             })
-            with processed_lock:
-                error_count += 1
             logger.error(f"❌ Error fixing {s3_key}: {e}")
         
         finally:
@@ -409,63 +527,154 @@ class MetadataFixer:
         
         return result
     
-    def find_files_needing_fix(self) -> List[str]:
-        """Find all files in the target folder that need metadata fixing."""
-        files_to_fix = []
+    def _probe_candidate(self, key: str) -> Dict[str, Any]:
+        """
+        Read key's first-page metadata and tag it with the fix decision.
+        
+        The returned candidate carries the metadata (and the body when it was
+        read in full) only when needs_fix is set, so files that are already
+        correct never reach fix_single_file.
+        """
+        metadata, pdf_bytes = self.extract_metadata_from_first_page(key)
+        current_uri = metadata.get('chunk_s3_uri', '')
+        expected_uri = self.generate_expected_uri(key)
+        
+        # Check if needs fixing
+        needs_fix = bool(current_uri.endswith('...') or 
+                         (current_uri and current_uri != expected_uri))
+        
+        return {
+            'key': key,
+            'needs_fix': needs_fix,
+            'current_uri': current_uri,
+            'expected_uri': expected_uri,
+            'metadata': metadata if needs_fix else None,
+            'pdf_bytes': pdf_bytes if needs_fix else None,
+        }
+    
+    def iter_candidates(self, target_folder: str) -> Iterator[Dict[str, Any]]:
+        """
+        Scan target_folder and yield a tagged candidate (see _probe_candidate)
+        for every PDF as soon as its probe finishes.
         
-        logger.info(f"Scanning {TARGET_FOLDER} for files with truncated URIs...")
+        Keys are probed on scan_workers threads while listing continues, with
+        at most scan_workers * 4 probes outstanding.
+        """
+        logger.info(f"Scanning {target_folder} for files with truncated URIs...")
         
-        paginator = s3.get_paginator("list_objects_v2")
-        folder_path = TARGET_FOLDER if TARGET_FOLDER.endswith('/') else TARGET_FOLDER + '/'
-        page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=folder_path)
+        paginator = self._s3.get_paginator("list_objects_v2")
+        folder_path = target_folder if target_folder.endswith('/') else target_folder + '/'
+        page_iterator = paginator.paginate(
+            Bucket=self.bucket_name,
+            Prefix=folder_path,
+            PaginationConfig={'PageSize': 1000}  # max keys per ListObjectsV2 round-trip
+        )
         
         total_scanned = 0
+        total_found = 0
+        max_pending = self.scan_workers * 4
         
-        for page in page_iterator:
-            contents = page.get("Contents", [])
-            for obj in contents:
-                key = obj["Key"]
-                total_scanned += 1
-                
-                # Only process PDF files
-                if key.lower().endswith('.pdf') and not key.endswith('/'):
-                    metadata = self.extract_metadata_from_first_page(key)
-                    current_uri = metadata.get('chunk_s3_uri', '')
-                    expected_uri = self.generate_expected_uri(key)
+        with ThreadPoolExecutor(max_workers=self.scan_workers) as scan_executor:
+            pending = set()
+            
+            for page in page_iterator:
+                contents = page.get("Contents", [])
+                for obj in contents:
+                    key = obj["Key"]
+                    total_scanned += 1
+                    
+                    # Only process PDF files
+                    if key.lower().endswith('.pdf') and not key.endswith('/'):
+                        pending.add(scan_executor.submit(self._probe_candidate, key))
                     
-                    # Check if needs fixing
-                    if (current_uri.endswith('...') or 
-                        (current_uri and current_uri != expected_uri)):
-                        files_to_fix.append(key)
+                    # Block only when the probe window is full
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            candidate = future.result()
+                            total_found += candidate['needs_fix']
+                            yield candidate
+                
+                # Hand over whatever finished while this page was listed
+                done, pending = wait(pending, timeout=0)
+                for future in done:
+                    candidate = future.result()
+                    total_found += candidate['needs_fix']
+                    yield candidate
                 
-                if total_scanned % 1000 == 0:
-                    print(f"📊 Scanned {total_scanned:,} files, found {len(files_to_fix):,} needing fixes")
+                print(f"📊 Scanned {total_scanned:,} files, found {total_found:,} needing fixes")
+            
+            for future in as_completed(pending):
+                candidate = future.result()
+                total_found += candidate['needs_fix']
+                yield candidate
+        
+        logger.info(f"Scan complete: {total_found} files need fixing out of {total_scanned} scanned")
+    
+    def find_files_needing_fix(self, target_folder: str) -> List[Dict[str, Any]]:
+        """
+        Find all PDFs in the target folder, tagged with whether they need fixing.
         
-        logger.info(f"Scan complete: {len(files_to_fix)} files need fixing out of {total_scanned} scanned")
-        return files_to_fix
+        Returns dicts with key, needs_fix, current_uri and expected_uri; the
+        downloaded bodies are dropped so the list stays small.
+        """
+        return [
+            {
+                'key': candidate['key'],
+                'needs_fix': candidate['needs_fix'],
+                'current_uri': candidate['current_uri'],
+                'expected_uri': candidate['expected_uri'],
+            }
+            for candidate in self.iter_candidates(target_folder)
+        ]
     
-    def process_files_parallel(self, files_to_fix: List[str], max_workers: int = 8) -> List[Dict[str, Any]]:
-        """Process multiple files in parallel."""
+    def process_files_parallel(self, files_to_fix: Iterable, max_workers: int = None) -> List[Dict[str, Any]]:
+        """
+        Process multiple files in parallel (defaults to the worker count the client pool was sized for).
+        
+        files_to_fix may be S3 keys or tagged candidate dicts from
+        iter_candidates/find_files_needing_fix; candidates with needs_fix unset
+        are not submitted. A generator is consumed while earlier files are
+        being fixed, with at most max_workers * 4 submitted files held in memory.
+        """
         results = []
+        max_workers = max_workers or self.max_workers
+        max_pending = max_workers * 4
+        submitted = 0
         
         print(f"🔧 Starting parallel processing with {max_workers} workers...")
-        print(f"📁 Files to process: {len(files_to_fix):,}")
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_file = {
-                executor.submit(self.fix_single_file, file_path): file_path 
-                for file_path in files_to_fix
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_file):
-                result = future.result()
-                results.append(result)
+        def collect(done):
+            for future in done:
+                results.append(future.result())
                 
                 # Show progress every 10 files
                 if len(results) % 10 == 0:
-                    print(f"🔄 Processed {len(results):,}/{len(files_to_fix):,} files...")
+                    print(f"🔄 Processed {len(results):,}/{submitted:,} files...")
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Sliding window: only max_pending futures exist at any time, so
+            # memory tracks the worker count rather than the number of files
+            pending = set()
+            for candidate in files_to_fix:
+                if isinstance(candidate, str):
+                    candidate = (candidate,)
+                elif not candidate['needs_fix']:
+                    continue
+                else:
+                    candidate = (candidate['key'], candidate.get('metadata'), candidate.get('pdf_bytes'))
+                
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                
+                pending.add(executor.submit(self.fix_single_file, *candidate))
+                submitted += 1
+            
+            print(f"📁 Files to process: {submitted:,}")
+            
+            # Collect the remaining results as they complete
+            collect(as_completed(pending))
         
         return results
     
@@ -476,10 +685,7 @@ class MetadataFixer:
         print("="*150)
         
         # Summary statistics
-        status_counts = {}
-        for result in results:
-            status = result['status']
-            status_counts[status] = status_counts.get(status, 0) + 1
+        status_counts = Counter(result['status'] for result in results)
         
         print(f"\n📈 SUMMARY:")
         print(f"   Total Processed: {len(results):,}")
@@ -536,14 +742,21 @@ class MetadataFixer:
         timestamp = datetime.now(ist).strftime("%Y%m%d_%H%M%S")
         csv_filename = f"{TARGET_FOLDER.replace('/', '_')}_metadata_fixes_{timestamp}.csv"
         
-        with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = [
-                'file_path', 'status', 'original_uri', 'corrected_uri', 
-                'action_taken', 'error', 'processing_time'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
+        fieldnames = [
+            'file_path', 'status', 'original_uri', 'corrected_uri', 
+            'action_taken', 'error', 'processing_time'
+        ]
+        
+        # Large buffer keeps big result sets to a handful of write syscalls
+        with open(csv_filename, 'w', newline='', encoding='utf-8', buffering=1024 * 1024) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(fieldnames)
+            # Positional rows avoid DictWriter's per-row field lookups
+            writer.writerows(
+                (r['file_path'], r['status'], r['original_uri'], r['corrected_uri'],
+                 r['action_taken'], r['error'], r['processing_time'])
+                for r in results
+            )
         
         print(f"\n💾 Results exported to: {csv_filename}")
         return csv_filename
@@ -551,27 +764,22 @@ class MetadataFixer:
 def main():
     """Main execution function."""
     print(f"🔧 METADATA FIXER - {TARGET_FOLDER}")
-    print(f"🪣 S3 Bucket: {BUCKET_NAME}")
+    print(f"🪣 S3 Bucket: {CHUNKED_BUCKET}")
     ist = timezone(timedelta(hours=5, minutes=30))
     print(f"📅 Start time: {datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S IST')}")
     print("="*80)
     
-    fixer = MetadataFixer()
+    fixer = MetadataFixer(max_workers=8)
     
-    # Phase 1: Find files needing fixes
-    print("🔍 PHASE 1: Scanning for files with truncated URIs...")
-    files_to_fix = fixer.find_files_needing_fix()
+    # Phases 1+2: Scan for truncated URIs and fix each candidate as it is found,
+    # reusing the metadata and bytes the scan already fetched
+    print("🔍 PHASE 1+2: Scanning for files with truncated URIs and fixing them...")
+    results = fixer.process_files_parallel(fixer.iter_candidates(TARGET_FOLDER))
     
-    if not files_to_fix:
+    if not results:
         print("✅ No files found that need metadata fixing!")
         return
     
-    print(f"📋 Found {len(files_to_fix):,} files that need fixing")
-    
-    # Phase 2: Process files
-    print(f"\n🔧 PHASE 2: Processing files...")
-    results = fixer.process_files_parallel(files_to_fix, max_workers=8)
-    
     # Phase 3: Display results
     print(f"\n📊 PHASE 3: Results...")
     fixer.display_results_table(results)
@@ -580,7 +788,8 @@ def main():
     fixer.export_results_to_csv(results)
     
     print(f"\n🏁 Processing completed at: {datetime.now(ist).strftime('%Y-%m-%d %H:%M:%S IST')}")
-    print(f"📊 Final Stats: {fixed_count} fixed, {skipped_count} skipped, {error_count} errors")
+    status_counts = Counter(result['status'] for result in results)
+    print(f"📊 Final Stats: {status_counts['fixed']} fixed, {status_counts['skipped']} skipped, {status_counts['error']} errors")
 
 if __name__ == "__main__":
     main()
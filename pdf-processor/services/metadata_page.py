@@ -4,21 +4,284 @@ Handles creation of custom wide metadata pages for PDF chunks.
 Extracted from metadata_fixer.py to integrate with chunking service flow.
 """
 
+import functools
 import io
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime, timezone, timedelta
 from reportlab.pdfgen import canvas
-from PyPDF2 import PdfReader
+from PyPDF2 import PageObject
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
 
 logger = logging.getLogger(__name__)
 
+# Field display order and labels - enhanced from metadata_fixer. Keys are
+# canonical lowercase; metadata keys are matched case-insensitively so
+# 'State'/'state' style variants map to a single row
+FIELD_LABELS: Tuple[Tuple[str, str], ...] = (
+    ('document_name', 'Document Name'),
+    ('processed_file_path', 'Processed File Path'),
+    ('page_number', 'Page Number'),
+    ('total_pages', 'Total Pages'),
+    ('chunk_s3_uri_processed', 'Chunk S3 Uri Processed'),
+    ('chunk_s3_uri', 'Chunk S3 Uri'),
+    ('standard_type', 'Standard Type'),
+    ('country', 'Country'),
+    ('document_type', 'Document Type'),
+    ('document_category', 'Document Category'),
+    ('document_sub-category', 'Document Sub-Category'),
+    ('year', 'Year'),
+    ('state', 'State'),
+    ('state_category', 'State Category'),
+    ('complexity', 'Complexity'),
+    ('volume', 'Volume'),
+)
+
+# Custom page size: wider and shorter to fit S3 URIs on single line
+# Standard landscape letter is 792x612, we'll use 1000x500 (much wider, shorter)
+CUSTOM_PAGE_SIZE = (1000, 500)  # (width, height) in points
+
+# Table layout - optimized for wide custom page (1000px width)
+Y_START = 430
+COL1_X = 50   # Field name column
+COL2_X = 170  # Field value column (plenty of space)
+TABLE_WIDTH = 900  # Very wide table for custom page
+
+# Standard fonts with a built-in encoding; every other font ReportLab uses on
+# the page is WinAnsiEncoding
+SYMBOL_FONTS = ('Symbol', 'ZapfDingbats')
+
+# Footer timestamp: IST is UTC+5:30
+IST = timezone(timedelta(hours=5, minutes=30))
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S IST'
+
+# Hand-written content stream for the page (same layout and fonts as the
+# ReportLab drawing in render_page_content): static header, per-row, border
+# and footer templates. /F1 is Helvetica and /F2 Helvetica-Bold, as ReportLab names them
+PAGE_HEADER = (
+    "BT /F2 16 Tf 1 0 0 1 400 460 Tm (Document Metadata) Tj ET\n"
+    "BT /F2 10 Tf 1 0 0 1 50 430 Tm (Field) Tj 120 0 Td (Value) Tj ET\n"
+    "50 425 m 950 425 l S\n"
+)
+ROW_TEMPLATE = (
+    "BT /F1 10 Tf 14 TL 1 0 0 1 50 {y} Tm ({label}) Tj 120 0 Td {value} ET\n"
+    ".8 .8 .8 RG 50 {rule_y} m 950 {rule_y} l S 0 0 0 RG\n"
+)
+BORDER_TEMPLATE = "40 {y} 920 {height} re S\n"
+FOOTER_TEMPLATE = (
+    "BT /F1 8 Tf 1 0 0 1 50 {y} Tm (Generated: {timestamp}) Tj "
+    "500 0 Td (Format: Wide Metadata Page \\(1000x500\\) - Single Line URIs) Tj ET\n"
+)
+PAGE_FONTS = (('/F1', 'Helvetica'), ('/F2', 'Helvetica-Bold'))
+
+
+def _pdf_text(text: str) -> Optional[str]:
+    """Escape text for a PDF string literal, or return None if it needs the ReportLab path."""
+    try:
+        text.encode('cp1252')
+    except UnicodeEncodeError:
+        return None
+    if '\n' in text or '\r' in text:
+        return None
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _template_page_content(metadata: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Build the page content stream straight from the templates.
+    
+    Returns None when a value cannot be drawn with the standard Helvetica
+    encoding, so the caller can fall back to ReportLab.
+    """
+    row_height = 22
+    content = [PAGE_HEADER]
+    y = Y_START - row_height
+    
+    # Normalize metadata keys once for the case-insensitive label lookup
+    lower_map = {str(k).lower(): v for k, v in metadata.items()}
+    
+    for key, label in FIELD_LABELS:
+        if key in lower_map:
+            value_str = str(lower_map[key])
+            
+            # Values over 120 characters are broken every 160 characters,
+            # one line per 14pt of leading
+            if len(value_str) > 120:
+                lines = [value_str[i:i + 160] for i in range(0, len(value_str), 160)]
+            else:
+                lines = [value_str]
+            
+            escaped = [_pdf_text(line) for line in lines]
+            if None in escaped:
+                return None
+            
+            row_y = y
+            y -= 14 * (len(lines) - 1) + row_height
+            content.append(ROW_TEMPLATE.format(
+                y=row_y, label=f"{label}:", value=" T* ".join(f"({line}) Tj" for line in escaped), rule_y=y + 10
+            ))
+    
+    content.append(BORDER_TEMPLATE.format(y=y, height=Y_START - y + 20))
+    content.append(FOOTER_TEMPLATE.format(y=y - 30, timestamp=datetime.now(IST).strftime(TIMESTAMP_FORMAT)))
+    return "".join(content).encode('cp1252')
+
+@functools.lru_cache(maxsize=1)
+def _static_header_ops() -> Tuple[str, ...]:
+    """
+    Render the static part of the page (title, table header, header line) once
+    and return its content-stream operators for stamping onto each new page.
+    """
+    c = canvas.Canvas(io.BytesIO(), pagesize=CUSTOM_PAGE_SIZE)
+    
+    # Title - centered for custom wide page (1000px width)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(400, 460, "Document Metadata")
+    
+    # Draw table header
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(COL1_X, Y_START, "Field")
+    c.drawString(COL2_X, Y_START, "Value")
+    
+    # Draw header line
+    c.line(COL1_X, Y_START - 5, COL1_X + TABLE_WIDTH, Y_START - 5)
+    
+    # The canvas keeps the page operators in _code until showPage()
+    return tuple(c._code)
+
+@functools.lru_cache(maxsize=1)
+def _empty_page() -> PageObject:
+    """
+    Blank custom-size page returned when metadata page creation fails; built
+    once and shared (PdfWriter.add_page copies the page it is given).
+    """
+    return PageObject.create_blank_page(width=CUSTOM_PAGE_SIZE[0], height=CUSTOM_PAGE_SIZE[1])
+
 class MetadataPageService:
     """Service for creating custom wide metadata pages for PDF chunks."""
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
     
+    @staticmethod
+    def render_page_content(metadata: Dict[str, Any]) -> Tuple[bytes, Tuple[Tuple[str, str], ...]]:
+        """
+        Draw the metadata page and return its content stream and fonts.
+        
+        Args:
+            metadata: Dictionary containing metadata
+            
+        Returns:
+            Tuple of (uncompressed content stream, ((resource name, font name), ...))
+        """
+        # Emit the stream from the templates; only values outside Helvetica's
+        # encoding go through the ReportLab canvas below
+        content = _template_page_content(metadata)
+        if content is not None:
+            return content, PAGE_FONTS
+        
+        c = canvas.Canvas(io.BytesIO(), pagesize=CUSTOM_PAGE_SIZE)
+        
+        # Stamp the pre-rendered title and table header. Selecting the bold
+        # font first registers it under the same resource name (/F2) the
+        # cached operators refer to
+        c.setFont("Helvetica-Bold", 10)
+        for op in _static_header_ops():
+            c.addLiteral(op)
+        
+        y_start = Y_START
+        row_height = 22
+        col1_x = COL1_X
+        col2_x = COL2_X
+        table_width = TABLE_WIDTH
+        
+        # Draw table rows
+        c.setFont("Helvetica", 10)
+        y = y_start - row_height
+        
+        # Normalize metadata keys once for the case-insensitive label lookup
+        lower_map = {str(k).lower(): v for k, v in metadata.items()}
+        
+        for key, label in FIELD_LABELS:
+            if key in lower_map:
+                value = lower_map[key]
+                value_str = str(value) if value is not None else "None"
+        
+                # Draw field name
+                c.drawString(col1_x, y, f"{label}:")
+        
+                # Handle long values - custom wide page can fit S3 URIs on single line
+                if len(value_str) > 120:  # Very high limit for wide page
+                    # Only break extremely long values (longer than typical S3 URIs)
+                    max_chars = 160  # Much more characters per line for wide page
+                    lines = [value_str[i:i + max_chars] for i in range(0, len(value_str), max_chars)]
+        
+                    # Draw all lines in one text object (a single BT/ET block)
+                    # with 14pt leading - slightly more spacing for readability
+                    text_obj = c.beginText(col2_x, y)
+                    text_obj.setFont("Helvetica", 10)
+                    text_obj.setLeading(14)
+                    for line in lines:
+                        text_obj.textLine(line)
+                    c.drawText(text_obj)
+                    y -= 14 * (len(lines) - 1)
+                else:
+                    # Draw values normally (most S3 URIs will fit on single line)
+                    c.drawString(col2_x, y, value_str)
+        
+                y -= row_height
+        
+                # Add separator line between rows
+                c.setStrokeColorRGB(0.8, 0.8, 0.8)
+                c.line(col1_x, y + 10, col1_x + table_width, y + 10)
+                c.setStrokeColorRGB(0, 0, 0)  # Reset to black
+        
+        # Draw table border
+        c.rect(col1_x - 10, y, table_width + 20, y_start - y + 20)
+        
+        # Add timestamp in IST - positioned for custom wide page
+        c.setFont("Helvetica", 8)
+        c.drawString(col1_x, y - 30, f"Generated: {datetime.now(IST).strftime(TIMESTAMP_FORMAT)}")
+        c.drawString(col1_x + 500, y - 30, f"Format: Wide Metadata Page (1000x500) - Single Line URIs")
+        
+        # Take the operators straight off the canvas instead of saving a PDF
+        # and parsing it back; this is the stream showPage() would write. Text
+        # is octal-escaped, so the stream is plain ASCII. fontMapping holds
+        # the resource name of each font used (Helvetica /F1, Helvetica-Bold
+        # /F2, plus ZapfDingbats for glyphs Helvetica lacks)
+        content = ('\n'.join([c._preamble] + c._code) + '\n').encode('latin-1')
+        fonts = tuple((resource_name, font_name) for font_name, resource_name in c._doc.fontMapping.items())
+        return content, fonts
+    
+    @staticmethod
+    def build_page(content: bytes, fonts: Tuple[Tuple[str, str], ...]) -> PageObject:
+        """
+        Wrap a content stream as a custom-size PyPDF2 page.
+        
+        Args:
+            content: Page content stream from render_page_content
+            fonts: (resource name, font name) pairs from render_page_content
+            
+        Returns:
+            PyPDF2 PageObject
+        """
+        page = PageObject.create_blank_page(width=CUSTOM_PAGE_SIZE[0], height=CUSTOM_PAGE_SIZE[1])
+        
+        font_dict = DictionaryObject()
+        for resource_name, font_name in fonts:
+            font = DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'),
+                NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject(f'/{font_name}'),
+            })
+            if font_name not in SYMBOL_FONTS:
+                font[NameObject('/Encoding')] = NameObject('/WinAnsiEncoding')
+            font_dict[NameObject(resource_name)] = font
+        page[NameObject('/Resources')] = DictionaryObject({NameObject('/Font'): font_dict})
+        
+        stream = DecodedStreamObject()
+        stream.set_data(content)
+        page[NameObject('/Contents')] = stream
+        return page
+    
     def create_corrected_metadata_page(self, metadata: Dict[str, Any]):
         """
         Create a new metadata page with corrected chunk_s3_uri in table format (custom wide format).
@@ -31,112 +294,7 @@ class MetadataPageService:
             PyPDF2 PageObject with metadata
         """
         try:
-            packet = io.BytesIO()
-            # Custom page size: wider and shorter to fit S3 URIs on single line
-            # Standard landscape letter is 792x612, we'll use 1000x500 (much wider, shorter)
-            custom_page_size = (1000, 500)  # (width, height) in points
-            c = canvas.Canvas(packet, pagesize=custom_page_size)
-            
-            # Log the page size for debugging
-            self.logger.info(f"Created PDF with page size: {custom_page_size}")
-            
-            # Title - centered for custom wide page (1000px width)
-            c.setFont("Helvetica-Bold", 16)
-            c.drawString(400, 460, "Document Metadata")
-            
-            # Table setup - optimized for wide custom page (1000px width)
-            c.setFont("Helvetica", 10)
-            y_start = 430
-            row_height = 22
-            col1_x = 50   # Field name column
-            col2_x = 170  # Field value column (plenty of space)
-            table_width = 900  # Very wide table for custom page
-            
-            # Draw table header
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(col1_x, y_start, "Field")
-            c.drawString(col2_x, y_start, "Value")
-            
-            # Draw header line
-            c.line(col1_x, y_start - 5, col1_x + table_width, y_start - 5)
-            
-            # Draw table rows
-            c.setFont("Helvetica", 10)
-            y = y_start - row_height
-            
-            # Define field display order and labels - enhanced from metadata_fixer
-            field_labels = {
-                'document_name': 'Document Name',
-                'processed_file_path': 'Processed File Path', 
-                'page_number': 'Page Number',
-                'total_pages': 'Total Pages',
-                'chunk_s3_uri_processed': 'Chunk S3 Uri Processed',
-                'chunk_s3_uri': 'Chunk S3 Uri',
-                'standard_type': 'Standard Type',
-                'country': 'Country',
-                'document_type': 'Document Type',
-                'document_category': 'Document Category',
-                'document_sub-category': 'Document Sub-Category',
-                'year': 'Year',
-                'state': 'State',
-                'State': 'State',  # Handle both capitalizations
-                'state_category': 'State Category',
-                'State_category': 'State Category',  # Handle both capitalizations
-                'Standard_type': 'Standard Type',  # Handle capitalization inconsistency
-                'complexity': 'Complexity',
-                'volume': 'Volume'
-            }
-            
-            for key, label in field_labels.items():
-                if key in metadata:
-                    value_str = str(metadata[key]) if metadata[key] is not None else "None"
-                    
-                    # Draw field name
-                    c.drawString(col1_x, y, f"{label}:")
-                    
-                    # Handle long values - custom wide page can fit S3 URIs on single line
-                    if len(value_str) > 120:  # Very high limit for wide page
-                        # Only break extremely long values (longer than typical S3 URIs)
-                        max_chars = 160  # Much more characters per line for wide page
-                        lines = []
-                        for i in range(0, len(value_str), max_chars):
-                            lines.append(value_str[i:i+max_chars])
-                        
-                        # Draw first line
-                        c.drawString(col2_x, y, lines[0])
-                        
-                        # Draw additional lines with proper spacing
-                        for i, line in enumerate(lines[1:], 1):
-                            y -= 14  # Slightly more spacing for readability
-                            c.drawString(col2_x, y, line)
-                    else:
-                        # Draw values normally (most S3 URIs will fit on single line)
-                        c.drawString(col2_x, y, value_str)
-                    
-                    y -= row_height
-                    
-                    # Add separator line between rows
-                    c.setStrokeColorRGB(0.8, 0.8, 0.8)
-                    c.line(col1_x, y + 10, col1_x + table_width, y + 10)
-                    c.setStrokeColorRGB(0, 0, 0)  # Reset to black
-            
-            # Draw table border
-            c.rect(col1_x - 10, y, table_width + 20, y_start - y + 20)
-            
-            # Add timestamp in IST - positioned for custom wide page
-            c.setFont("Helvetica", 8)
-            ist = timezone(timedelta(hours=5, minutes=30))  # IST is UTC+5:30
-            current_time_ist = datetime.now(ist)
-            c.drawString(col1_x, y - 30, f"Generated: {current_time_ist.strftime('%Y-%m-%d %H:%M:%S IST')}")
-            c.drawString(col1_x + 500, y - 30, f"Format: Wide Metadata Page (1000x500) - Single Line URIs")
-            
-            c.showPage()
-            c.save()
-            packet.seek(0)
-            
-            # Convert to PDF page - EXACT MATCH TO metadata_fixer.py
-            metadata_pdf = PdfReader(packet)
-            final_page = metadata_pdf.pages[0]
+            final_page = self.build_page(*self.render_page_content(metadata))
             
             # Log success with actual dimensions
             media_box = final_page.mediabox
@@ -149,12 +307,7 @@ class MetadataPageService:
         except Exception as e:
             self.logger.error(f"Error creating metadata page: {e}")
             # Return empty page if metadata creation fails - use custom size fallback
-            packet = io.BytesIO()
-            c = canvas.Canvas(packet, pagesize=(1000, 500))  # Custom size fallback
-            c.showPage()
-            c.save()
-            packet.seek(0)
-            return PdfReader(packet).pages[0]
+            return _empty_page()
     
     def create_metadata_page(self, metadata: Dict[str, Any]):
         """
@@ -3,20 +3,72 @@ Metadata Service
 Creates metadata files for chunked PDFs in S3 based on folder structure rules.
 """
 
-import boto3
+import asyncio
+import itertools
 import json
 import logging
 from urllib.parse import urlparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
+from botocore.config import Config
+from config import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+from services.s3_service import get_s3_client
+
+# Try to import aioboto3 for async fan-out, fallback to a thread pool if not available
+try:
+    import aioboto3
+    AIOBOTO3_AVAILABLE = True
+except ImportError:
+    AIOBOTO3_AVAILABLE = False
+
+# Try to import orjson for fast metadata serialization, fallback to json if not available
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Shared S3 client for all MetadataService instances: the process-wide client
+# S3Service also uses, so metadata uploads reuse its warm connections
+# (boto3 clients are thread-safe)
+S3_CLIENT = get_s3_client(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION)
+
+# Keys that never get a metadata file: existing metadata files and folder markers
+SKIP_KEY_SUFFIXES = ('.metadata.json', '/')
+
+def serialize_metadata(metadata_dict: Dict) -> bytes:
+    """Serialize metadata attributes to the compact JSON body of a .metadata.json file."""
+    document = {"metadataAttributes": metadata_dict}
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(document)
+    return json.dumps(document, separators=(',', ':')).encode()
+
+def split_folder_levels(path: str) -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    Split the first three folder levels off an S3 key or prefix.
+    
+    Args:
+        path: S3 key or prefix like document-type/country/complexity/...
+        
+    Returns:
+        Tuple of (first, second, third or None), or None if the path has fewer than two levels
+    """
+    # Chained partitions stop after the third level instead of splitting the whole key
+    first, sep, rest = path.partition('/')
+    if not sep:
+        return None
+    second, sep, rest = rest.partition('/')
+    third = rest.partition('/')[0] if sep else None
+    return first, second, third
+
 class MetadataService:
     """Service for creating metadata files for chunked PDFs."""
     
-    ONLY_COUNTRY_LIST = [
+    ONLY_COUNTRY_LIST = frozenset({
         'accounting-standards',
         'commercial-laws',
         'Auditing Standards',
@@ -26,14 +78,31 @@ class MetadataService:
         'Insurance',
         'Labour Law',
         'Banking Regulations'
-    ]
+    })
+    
+    # Document types with their own metadata rules, as
+    # handler(country, complexity, volume, user_id) -> metadata attributes
+    METADATA_HANDLERS = {
+        'accounting-global': lambda country, complexity, volume, user_id: (
+            {"complexity": complexity} if complexity else {}
+        ),
+        'Banking Regulations-test': lambda country, complexity, volume, user_id: (
+            {"country": country, "complexity": complexity} if complexity else {"country": country}
+        ),
+        'Banking-Regulations-Bahrain': lambda country, complexity, volume, user_id: (
+            {"country": country, "volume": volume} if volume else {"country": country}
+        ),
+        'userspecific-temp-docs': lambda country, complexity, volume, user_id: (
+            {"user_id": user_id} if user_id else {}
+        ),
+    }
     
     def __init__(self):
-        """Initialize the metadata service with S3 client."""
-        self.s3_client = boto3.client('s3')
+        """Initialize the metadata service with the shared S3 client."""
+        self.s3_client = S3_CLIENT
         self.logger = logging.getLogger(__name__)
     
-    def create_metadata_file(self, bucket: str, key: str, metadata_dict: Dict) -> bool:
+    def create_metadata_file(self, bucket: str, key: str, metadata_dict: Dict, body: Optional[bytes] = None) -> bool:
         """
         Create a metadata file for the given S3 object.
         
@@ -41,21 +110,25 @@ class MetadataService:
             bucket: S3 bucket name
             key: S3 object key
             metadata_dict: Dictionary containing metadata attributes
+            body: Pre-serialized metadata JSON to reuse across many keys
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            metadata = {"metadataAttributes": metadata_dict}
             metadata_key = f"{key}.metadata.json"
+            if body is None:
+                body = serialize_metadata(metadata_dict)
 
             # Always create or replace the metadata file
             self.s3_client.put_object(
                 Bucket=bucket,
                 Key=metadata_key,
-                Body=json.dumps(metadata)
+                Body=body
             )
-            self.logger.info(f"Created metadata file: {metadata_key} with {metadata_dict}")
+            # Called once per key on folder runs; only format the dict when INFO is on
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(f"Created metadata file: {metadata_key} with {metadata_dict}")
             return True
 
         except Exception as e:
@@ -76,32 +149,15 @@ class MetadataService:
         Returns:
             Dict: Metadata attributes to add
         """
-        metadata_to_add = {}
-
-        if document_type == 'accounting-global':
-            if complexity:
-                metadata_to_add = {"complexity": complexity}
-
-        elif document_type == 'Banking Regulations-test':
-            metadata_to_add = {"country": country}
-            if complexity:
-                metadata_to_add["complexity"] = complexity
-
-        elif document_type == 'Banking-Regulations-Bahrain':
-            metadata_to_add = {"country": country}
-            if volume:
-                metadata_to_add["volume"] = volume
+        handler = self.METADATA_HANDLERS.get(document_type)
+        if handler is not None:
+            return handler(country, complexity, volume, user_id)
 
-        elif document_type in self.ONLY_COUNTRY_LIST:
-            metadata_to_add = {"country": country}
+        if document_type in self.ONLY_COUNTRY_LIST:
+            return {"country": country}
 
-        elif document_type == 'userspecific-temp-docs':
-            if user_id:
-                metadata_to_add = {"user_id": user_id}
-        else:
-            self.logger.info(f"No metadata rules matched for {document_type}")
-
-        return metadata_to_add
+        self.logger.info(f"No metadata rules matched for {document_type}")
+        return {}
     
     def create_metadata_for_file(self, s3_key: str, bucket: str = 'chunked-rules-repository') -> bool:
         """
@@ -116,13 +172,12 @@ class MetadataService:
         """
         try:
             # Parse the S3 key to extract folder structure
-            parts = s3_key.split('/')
-            if len(parts) < 2:
+            levels = split_folder_levels(s3_key)
+            if levels is None:
                 self.logger.warning(f"Invalid S3 key format: {s3_key}")
                 return False
             
-            document_type = parts[0]
-            country = parts[1] if len(parts) > 1 else None
+            document_type, country, third_level = levels
             
             # Handle different folder structures
             complexity = None
@@ -131,14 +186,14 @@ class MetadataService:
             
             if document_type == 'userspecific-temp-docs':
                 # For userspecific-temp-docs: folder/user_id/filename
-                user_id = parts[1] if len(parts) > 1 else None
+                user_id = country
                 country = None  # Not applicable for user-specific docs
             elif document_type == 'Banking-Regulations-Bahrain' and country == 'Bahrain':
                 # For Banking Regulations Bahrain: folder/country/volume/...
-                volume = parts[2] if len(parts) > 2 else None
+                volume = third_level
             else:
                 # For other folders: folder/country/complexity/...
-                complexity = parts[2] if len(parts) > 2 else None
+                complexity = third_level
             
             # Determine metadata attributes
             metadata_attributes = self.determine_metadata_attributes(document_type, country, complexity, volume, user_id)
@@ -154,26 +209,86 @@ class MetadataService:
             self.logger.error(f"Error creating metadata for {s3_key}: {str(e)}")
             return False
     
-    def generate_metadata_for_folder(self, s3_path: str, max_workers: int = 10) -> None:
+    async def _put_one(self, s3, bucket: str, key: str, body: bytes, semaphore: asyncio.Semaphore) -> bool:
+        """Upload one pre-serialized metadata file on a shared aioboto3 client."""
+        metadata_key = f"{key}.metadata.json"
+        async with semaphore:
+            try:
+                await s3.put_object(Bucket=bucket, Key=metadata_key, Body=body)
+                self.logger.info(f"Created metadata file: {metadata_key}")
+                return True
+            except Exception as e:
+                self.logger.error(f"Error creating metadata file for {key}: {str(e)}")
+                return False
+    
+    def _iter_key_pages(self, bucket: str, prefix: str) -> Iterator[List[str]]:
+        """Yield the keys needing a metadata file, one ListObjectsV2 page at a time."""
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            yield [
+                obj['Key'] for obj in page.get('Contents', ())
+                if not obj['Key'].endswith(SKIP_KEY_SUFFIXES)
+            ]
+    
+    async def _async_fanout(self, bucket: str, key_pages: Iterator[List[str]], body: bytes, concurrency: int = 64) -> int:
+        """
+        Create metadata files for keys concurrently with aioboto3.
+        
+        One client (and HTTP connection pool) is shared by all uploads, with at
+        most `concurrency` requests in flight. Keys are consumed page by page as
+        they are listed, so memory stays bounded on huge prefixes.
+        
+        Returns:
+            int: Number of keys submitted
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        config = Config(
+            retries={'max_attempts': 3, 'mode': 'adaptive'},
+            max_pool_connections=concurrency
+        )
+        loop = asyncio.get_running_loop()
+        pending = set()
+        submitted = 0
+        session = aioboto3.Session()
+        async with session.client('s3', config=config) as s3:
+            while True:
+                # List the next page off the event loop so uploads keep flowing
+                keys = await loop.run_in_executor(None, next, key_pages, None)
+                if keys is None:
+                    break
+                for key in keys:
+                    if len(pending) >= concurrency * 4:
+                        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    pending.add(asyncio.ensure_future(self._put_one(s3, bucket, key, body, semaphore)))
+                    submitted += 1
+            if pending:
+                await asyncio.wait(pending)
+        return submitted
+    
+    def generate_metadata_for_folder(self, s3_path: str, max_workers: int = 10, concurrency: int = 64) -> None:
         """
-        Generate metadata for all files in a folder using concurrent threads.
+        Generate metadata for all files in a folder concurrently.
+        
+        Uses aioboto3 with up to `concurrency` uploads in flight when it is
+        installed and no event loop is already running in this thread;
+        otherwise falls back to a thread pool of max_workers.
         
         Args:
             s3_path: S3 path like s3://bucket/document-type/country/complexity/
-            max_workers: Maximum number of concurrent workers
+            max_workers: Maximum number of concurrent workers (thread fallback)
+            concurrency: Maximum number of in-flight uploads (aioboto3)
         """
         try:
             parsed = urlparse(s3_path)
             bucket = parsed.netloc
             prefix = parsed.path.lstrip('/')
 
-            parts = prefix.strip('/').split('/')
-            if len(parts) < 2:
+            levels = split_folder_levels(prefix.strip('/'))
+            if levels is None:
                 self.logger.error("Invalid path format. Expecting at least: bucket/document-type/country/")
                 return
 
-            document_type = parts[0]
-            country = parts[1]
+            document_type, country, third_level = levels
             
             # Handle different folder structures
             complexity = None
@@ -181,12 +296,12 @@ class MetadataService:
             
             if document_type == 'Banking-Regulations-Bahrain' and country == 'Bahrain':
                 # For Banking Regulations Bahrain: folder/country/volume/...
-                volume = parts[2] if len(parts) > 2 else None
+                volume = third_level
                 self.logger.info(f"Scanning S3 folder: bucket={bucket}, prefix={prefix}")
                 self.logger.info(f"Extracted document_type={document_type}, country={country}, volume={volume}")
             else:
                 # For other folders: folder/country/complexity/...
-                complexity = parts[2] if len(parts) > 2 else None
+                complexity = third_level
                 self.logger.info(f"Scanning S3 folder: bucket={bucket}, prefix={prefix}")
                 self.logger.info(f"Extracted document_type={document_type}, country={country}, complexity={complexity}")
 
@@ -197,28 +312,43 @@ class MetadataService:
                 self.logger.info("No metadata attributes to add. Exiting...")
                 return
 
-            # Get all files in the folder
-            keys = []
-            paginator = self.s3_client.get_paginator('list_objects_v2')
-            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-                for obj in page.get('Contents', []):
-                    key = obj['Key']
-                    if key.endswith('.metadata.json') or key.endswith('/'):
-                        continue
-                    keys.append(key)
+            # Every file in the folder gets the same metadata, so serialize it once
+            body = serialize_metadata(metadata_to_add)
+
+            # Keys are streamed from the paginator into the uploads rather than
+            # collected up front
+            key_pages = self._iter_key_pages(bucket, prefix)
+            self.logger.info("Starting concurrent metadata creation...")
 
-            self.logger.info(f"Found {len(keys)} files. Starting concurrent metadata creation...")
+            try:
+                asyncio.get_running_loop()
+                use_async = False  # asyncio.run() cannot nest inside a running loop
+            except RuntimeError:
+                use_async = AIOBOTO3_AVAILABLE
+
+            if use_async:
+                submitted = asyncio.run(self._async_fanout(bucket, key_pages, body, concurrency))
+                self.logger.info(f"All metadata creation tasks completed ({submitted} files).")
+                return
+
+            # Create metadata files concurrently with at most max_workers * 4 tasks
+            # queued or running; each task frees its slot when it finishes, so no
+            # set of pending futures has to be tracked or waited on
+            submitted = 0
+            slots = BoundedSemaphore(max_workers * 4)
+
+            def release_slot(future):
+                slots.release()
+                if future.exception() is not None:
+                    self.logger.error(f"Metadata creation task failed: {future.exception()}")
 
-            # Create metadata files concurrently
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = [
-                    executor.submit(self.create_metadata_file, bucket, key, metadata_to_add)
-                    for key in keys
-                ]
-                for future in as_completed(futures):
-                    future.result()  # Force exception raise if any
-
-            self.logger.info("All metadata creation tasks completed.")
+                for key in itertools.chain.from_iterable(key_pages):
+                    slots.acquire()
+                    executor.submit(self.create_metadata_file, bucket, key, metadata_to_add, body).add_done_callback(release_slot)
+                    submitted += 1
+
+            self.logger.info(f"All metadata creation tasks completed ({submitted} files).")
             
         except Exception as e:
             self.logger.error(f"Error generating metadata for folder {s3_path}: {str(e)}")
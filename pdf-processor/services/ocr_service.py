@@ -8,45 +8,298 @@ import pytesseract
 from PIL import Image
 import io
 import logging
+import math
 import asyncio
-from typing import List, Tuple
-from concurrent.futures import ProcessPoolExecutor
+import atexit
+import threading
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 import os
 
+# Tesseract (OpenMP build) parallelizes inside each page; cap it at
+# OCR_OMP_THREADS threads per page and size the page-level pool so the two
+# together fill the CPUs without oversubscribing them. Set before tesserocr
+# loads the engine (and inherited by tesseract subprocesses)
+OCR_OMP_THREADS = int(os.environ.setdefault('OMP_THREAD_LIMIT', '4'))
+
+# Try to import tesserocr (in-process Tesseract API that releases the GIL while
+# recognizing), fallback to the pytesseract subprocess if not available
+try:
+    from tesserocr import PyTessBaseAPI, PSM
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+# Try to import pypdfium2 (PDFium) for page rasterization, fallback to PyMuPDF
+# rendering if not available
+try:
+    import pypdfium2 as pdfium
+    PYPDFIUM2_AVAILABLE = True
+except ImportError:
+    PYPDFIUM2_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
-DEFAULT_DPI_OCR = 300
+DEFAULT_DPI_OCR = 200
+# Pages whose embedded images are all at or below this resolution are rendered
+# at it; rendering finer only adds pixels for Tesseract to process
+LOW_RES_IMAGE_DPI = 150
+# MuPDF keeps decoded images and fonts in a global store; empty it after this
+# many rendered pages so long scans do not accumulate it
+STORE_SHRINK_INTERVAL = 32
+# Pages that would render to more pixels than this (large-format drawings,
+# posters) are rendered and OCR'd in horizontal strips of at most this size
+MAX_OCR_PAGE_PIXELS = 25_000_000
 OCR_TEXT_THRESHOLD = 50
-MAX_WORKERS_OCR_PAGE = os.cpu_count() if os.cpu_count() else 4
+# Threshold page images to 1-bit before OCR (see binarize_image). Off until its
+# accuracy has been compared against Tesseract's own thresholding on our scans
+OCR_BINARIZE = os.getenv('OCR_BINARIZE', 'false').lower() == 'true'
+MAX_WORKERS_OCR_PAGE = max(1, (os.cpu_count() or 4) // OCR_OMP_THREADS)
+# Documents OCR'd at once through apply_ocr_to_pdf_async. Each one renders in
+# its own thread and feeds the shared page pool, so a few keep that pool busy
+MAX_CONCURRENT_OCR_FILES = int(os.getenv('MAX_CONCURRENT_OCR_FILES', 4))
+# Tesseract language data directory. The image points this at the
+# tessdata_fast models (about 3x faster than tessdata_best for bulk ingestion);
+# unset means Tesseract's built-in default
+TESSDATA_PREFIX = os.getenv('TESSDATA_PREFIX')
+
+# tesserocr state: one PyTessBaseAPI per OCR thread, so the language model is
+# loaded once per thread rather than per page. The threads live in one shared
+# pool that outlives individual documents (a per-call pool would take its
+# thread-local APIs down with it)
+_api_tls = threading.local()
+_tess_apis = []
+_tess_lock = threading.Lock()
+_ocr_thread_pool = None
+
+# PDFium is not thread-safe and pypdfium2 does no locking of its own; its ctypes
+# calls release the GIL, so every open, render and close across all OCR threads
+# goes through this one lock
+_pdfium_lock = threading.Lock()
+
+def _get_tess_api():
+    """Return this thread's PyTessBaseAPI, creating it on first use."""
+    api = getattr(_api_tls, 'api', None)
+    if api is None:
+        # PSM.SINGLE_BLOCK is the API equivalent of --psm 6
+        if TESSDATA_PREFIX:
+            api = PyTessBaseAPI(path=TESSDATA_PREFIX, lang='eng', psm=PSM.SINGLE_BLOCK)
+        else:
+            api = PyTessBaseAPI(lang='eng', psm=PSM.SINGLE_BLOCK)
+        _api_tls.api = api
+        with _tess_lock:
+            _tess_apis.append(api)
+    return api
+
+def _get_ocr_thread_pool() -> ThreadPoolExecutor:
+    """Return the shared OCR thread pool, creating it on first use."""
+    global _ocr_thread_pool
+    with _tess_lock:
+        if _ocr_thread_pool is None:
+            _ocr_thread_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS_OCR_PAGE, thread_name_prefix='ocr')
+    return _ocr_thread_pool
+
+@atexit.register
+def _end_tess_apis():
+    """Release the Tesseract engines at interpreter exit."""
+    with _tess_lock:
+        for api in _tess_apis:
+            api.End()
+        _tess_apis.clear()
 
 class OCRService:
     """Service for performing OCR on scanned PDF pages."""
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # Owned pool for async callers, instead of the loop's default executor
+        # that every other blocking call in the process also lands on
+        self._ocr_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_OCR_FILES, thread_name_prefix='ocr-file')
     
-    def perform_ocr_on_page(self, pdf_bytes: bytes, page_num: int, dpi: int = DEFAULT_DPI_OCR) -> Tuple[int, str]:
+    def __getstate__(self):
+        """Leave the file pool out when pickled to page OCR worker processes."""
+        state = self.__dict__.copy()
+        state.pop('_ocr_pool', None)
+        return state
+    
+    def render_page_image(self, page: fitz.Page, dpi: int = DEFAULT_DPI_OCR, clip: Optional[fitz.Rect] = None) -> Image.Image:
         """
-        Perform OCR on a single page.
+        Render a page of an open document to a grayscale image for OCR.
         
         Args:
-            pdf_bytes: PDF file as bytes
+            page: Page of the already-open fitz document
+            dpi: DPI for rendering
+            clip: Area of the page to render, or None for the whole page
+            
+        Returns:
+            PIL Image (mode "L") of the page
+        """
+        # Tesseract binarizes a grayscale image anyway; rendering straight to
+        # one channel is a third of the RGB buffer to copy and hand over
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+        img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+        # frombytes copied the samples; release the pixmap now, not at GC
+        pix = None
+        return img
+    
+    def render_pdfium_page_image(self, pdfium_doc: "pdfium.PdfDocument", page_num: int, dpi: int = DEFAULT_DPI_OCR) -> Image.Image:
+        """
+        Render a page with PDFium straight to a grayscale image for OCR.
+        
+        Args:
+            pdfium_doc: Already-open pypdfium2 document
             page_num: Page number (0-indexed)
             dpi: DPI for rendering
             
+        Returns:
+            PIL Image (mode "L") of the page
+        """
+        with _pdfium_lock:
+            page = pdfium_doc[page_num]
+            try:
+                bitmap = page.render(scale=dpi / 72, grayscale=True, draw_annots=False)
+                # The bitmap buffer is Python-allocated, so the image keeps it
+                # alive; the PDFium handle is released here, under the lock,
+                # rather than by a finalizer on whichever thread collects it
+                img = bitmap.to_pil()
+                bitmap.close()
+                return img
+            finally:
+                page.close()
+    
+    def ocr_clips(self, page_rect: fitz.Rect, dpi: int) -> List[Optional[fitz.Rect]]:
+        """
+        Split a page into the horizontal strips it is rendered and OCR'd in.
+        
+        Args:
+            page_rect: Page rectangle
+            dpi: DPI the page is rendered at
+            
+        Returns:
+            Strip rectangles from top to bottom, or [None] when the whole page
+            fits in MAX_OCR_PAGE_PIXELS
+        """
+        pixels = page_rect.width * page_rect.height * (dpi / 72) ** 2
+        if pixels <= MAX_OCR_PAGE_PIXELS:
+            return [None]
+        
+        strips = math.ceil(pixels / MAX_OCR_PAGE_PIXELS)
+        height = page_rect.height / strips
+        return [
+            fitz.Rect(page_rect.x0, page_rect.y0 + k * height,
+                      page_rect.x1, page_rect.y0 + (k + 1) * height)
+            for k in range(strips)
+        ]
+    
+    def probe_page_content(self, page: fitz.Page) -> Tuple[bool, bool]:
+        """
+        Find out whether a page has text and whether it draws images.
+        
+        Args:
+            page: Page of the already-open fitz document
+            
+        Returns:
+            Tuple of (has_text, has_images)
+        """
+        # One block-level pass answers both questions: no per-character
+        # output is built, and image blocks come from the same content run
+        has_text = has_images = False
+        for block in page.get_text("blocks", flags=fitz.TEXT_PRESERVE_IMAGES):
+            if block[6] == 1:
+                has_images = True
+            elif not has_text and block[4] and not block[4].isspace():
+                # isspace() scans in place; strip() would copy the block text
+                has_text = True
+            if has_text and has_images:
+                break
+        return has_text, has_images
+    
+    def choose_ocr_dpi(self, page: fitz.Page) -> int:
+        """
+        Pick the render DPI for a page from the resolution of its embedded images.
+        
+        Args:
+            page: Page of the already-open fitz document
+            
+        Returns:
+            LOW_RES_IMAGE_DPI if no image on the page is finer than that, else DEFAULT_DPI_OCR
+        """
+        image_dpi = 0
+        for info in page.get_image_info():
+            bbox = fitz.Rect(info["bbox"])
+            if bbox.width > 0 and bbox.height > 0:
+                # Effective resolution: image pixels per inch of page it covers
+                image_dpi = max(image_dpi, info["width"] * 72 / bbox.width, info["height"] * 72 / bbox.height)
+        
+        if 0 < image_dpi <= LOW_RES_IMAGE_DPI:
+            return LOW_RES_IMAGE_DPI
+        return DEFAULT_DPI_OCR
+    
+    def binarize_image(self, img: Image.Image) -> Image.Image:
+        """
+        Threshold a grayscale page image to 1-bit with Otsu's method.
+        
+        Tesseract would otherwise run the same global Otsu pass itself; doing
+        it here uses Pillow's C histogram and lookup table, and the 1-bit
+        image is an eighth of the bytes to hand over to Tesseract. Only used
+        when OCR_BINARIZE is set.
+        
+        Args:
+            img: Grayscale (mode "L") page image
+            
+        Returns:
+            PIL Image (mode "1") of the page
+        """
+        histogram = img.histogram()
+        total = sum(histogram)
+        weighted_total = sum(level * count for level, count in enumerate(histogram))
+        
+        # Pick the level that maximizes the between-class variance
+        best_level = best_variance = 0
+        background = weighted_background = 0
+        for level, count in enumerate(histogram):
+            background += count
+            if background == 0:
+                continue
+            foreground = total - background
+            if foreground == 0:
+                break
+            weighted_background += level * count
+            mean_background = weighted_background / background
+            mean_foreground = (weighted_total - weighted_background) / foreground
+            variance = background * foreground * (mean_background - mean_foreground) ** 2
+            if variance > best_variance:
+                best_level, best_variance = level, variance
+        
+        return img.point(lambda value: 255 if value > best_level else 0, mode="1")
+    
+    def perform_ocr_on_page(self, img: Image.Image, page_num: int) -> Tuple[int, str]:
+        """
+        Perform OCR on a single rendered page.
+        
+        Args:
+            img: Page image from render_page_image
+            page_num: Page number (0-indexed)
+            
         Returns:
             Tuple of (page_number, extracted_text)
         """
         try:
-            temp_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            page = temp_doc.load_page(page_num)
-            pix = page.get_pixmap(dpi=dpi)
-            
-            img_mode = "RGB" if pix.n == 3 else "RGBA" if pix.n == 4 else pix.mode
-            img = Image.frombytes(img_mode, [pix.width, pix.height], pix.samples)
+            if OCR_BINARIZE:
+                binary = self.binarize_image(img)
+                img.close()
+                img = binary
             
-            text = pytesseract.image_to_string(img, lang='eng', config='--psm 6')
-            temp_doc.close()
+            if TESSEROCR_AVAILABLE:
+                api = _get_tess_api()
+                api.SetImage(img)
+                text = api.GetUTF8Text()
+                # Drop the engine's copy of the image and its results now
+                # rather than at this thread's next page
+                api.Clear()
+            else:
+                text = pytesseract.image_to_string(img, lang='eng', config='--psm 6')
             
             self.logger.debug(f"Page {page_num+1}: OCR completed, {len(text)} characters")
             return (page_num, text)
@@ -54,6 +307,9 @@ class OCRService:
         except Exception as e:
             self.logger.error(f"Page {page_num+1}: OCR failed: {e}")
             return (page_num, f"Error on page {page_num+1}: {str(e)}")
+        
+        finally:
+            img.close()
     
     def apply_ocr_to_pdf(self, pdf_stream: io.BytesIO, file_key: str) -> Tuple[io.BytesIO, List[int]]:
         """
@@ -73,18 +329,19 @@ class OCRService:
         try:
             pdf_stream.seek(0)
             pdf_bytes = pdf_stream.read()
-            ocr_analysis_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            # Opened once: used to find OCR candidates, render them and rebuild
+            original_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
             
-            num_pages = len(ocr_analysis_doc)
+            num_pages = len(original_doc)
             pages_to_ocr = []
+            page_dpi = {}
+            page_clips = {}
             
             # Identify pages needing OCR based on your exact requirements:
             # Apply OCR for: (a) text+images, (b) only images, (c) no text
             # Skip OCR only for: pure text pages with no embedded images
-            for i, page in enumerate(ocr_analysis_doc):
-                original_text = page.get_text("text", flags=fitz.TEXT_PRESERVE_WHITESPACE).strip()
-                has_images = len(page.get_images()) > 0
-                has_text = bool(original_text) and len(original_text.strip()) > 0
+            for i, page in enumerate(original_doc):
+                has_text, has_images = self.probe_page_content(page)
                 
                 # Apply OCR for these cases:
                 # 1. Text + Images (hybrid content)
@@ -94,83 +351,132 @@ class OCRService:
                 
                 if has_images or not has_text:
                     pages_to_ocr.append(i)
+                    page_dpi[i] = self.choose_ocr_dpi(page) if has_images else DEFAULT_DPI_OCR
+                    page_clips[i] = self.ocr_clips(page.rect, page_dpi[i])
             
             self.logger.info(f"Identified {len(pages_to_ocr)} pages for OCR")
-            ocr_analysis_doc.close()
             
             if not pages_to_ocr:
+                original_doc.close()
                 return None, []
             
-            # Perform OCR in parallel
+            # Perform OCR in parallel. tesserocr releases the GIL during
+            # recognition, so the shared thread pool suffices; the pytesseract
+            # path spawns a tesseract process per page and keeps a process pool
+            strip_texts = {}
+            if TESSEROCR_AVAILABLE:
+                executor_context = nullcontext(_get_ocr_thread_pool())
+            else:
+                executor_context = ProcessPoolExecutor(max_workers=MAX_WORKERS_OCR_PAGE)
+            # PDFium rasterizes; fitz still does the page analysis and rebuild
+            pdfium_doc = None
+            if PYPDFIUM2_AVAILABLE:
+                try:
+                    with _pdfium_lock:
+                        pdfium_doc = pdfium.PdfDocument(pdf_bytes)
+                except pdfium.PdfiumError as e:
+                    # MuPDF opened the file, so OCR goes on with fitz rendering
+                    self.logger.warning(f"PDFium could not open {file_key}, rendering with PyMuPDF: {e}")
+                    pdfium_doc = None
+            try:
+                with executor_context as executor:
+                    # Pages (or strips of oversized pages) are rendered here, one at
+                    # a time (a fitz document is not thread-safe), and only the
+                    # images go to the workers; at most two images per worker are
+                    # held at once, so the next strip renders while one is OCR'd
+                    pending = {}
+                    rendered = 0
+                    for i in pages_to_ocr:
+                        for strip, clip in enumerate(page_clips[i]):
+                            if len(pending) >= MAX_WORKERS_OCR_PAGE * 2:
+                                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                                for future in done:
+                                    strip_texts[pending.pop(future)] = future.result()[1]
+                            try:
+                                if pdfium_doc is not None and clip is None:
+                                    img = self.render_pdfium_page_image(pdfium_doc, i, page_dpi[i])
+                                else:
+                                    img = self.render_page_image(original_doc.load_page(i), page_dpi[i], clip)
+                            except Exception as e:
+                                self.logger.error(f"Page {i+1}: OCR failed: {e}")
+                                strip_texts[(i, strip)] = f"Error on page {i+1}: {str(e)}"
+                                continue
+                            pending[executor.submit(self.perform_ocr_on_page, img, i)] = (i, strip)
+                            # The worker owns the image from here (and closes it)
+                            img = None
+                            
+                            rendered += 1
+                            if rendered % STORE_SHRINK_INTERVAL == 0:
+                                fitz.TOOLS.store_shrink(100)
+                    
+                    for future in as_completed(pending):
+                        strip_texts[pending[future]] = future.result()[1]
+            finally:
+                if pdfium_doc is not None:
+                    with _pdfium_lock:
+                        pdfium_doc.close()
+            
+            # Join each page's strips top to bottom; a failed strip fails the page
             ocr_results = {}
-            with ProcessPoolExecutor(max_workers=MAX_WORKERS_OCR_PAGE) as executor:
-                future_to_page = {
-                    executor.submit(self.perform_ocr_on_page, pdf_bytes, i): i
-                    for i in pages_to_ocr
-                }
-                
-                for future in future_to_page:
-                    page_num, text = future.result()
-                    ocr_results[page_num] = text
+            for i in pages_to_ocr:
+                texts = [strip_texts[(i, strip)] for strip in range(len(page_clips[i]))]
+                errors = [text for text in texts if text.startswith(f"Error on page {i+1}:")]
+                ocr_results[i] = errors[0] if errors else "".join(texts)
             
-            # Rebuild PDF with OCR results
-            new_pdf_doc = fitz.open()
-            original_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            fitz.TOOLS.store_shrink(100)
+            
+            # Rebuild the PDF in place: OCR pages are appended to the open
+            # document and then swapped into their original positions with one
+            # select(), so kept pages are never copied
             replaced_pages = []
+            page_order = list(range(num_pages))
             
-            for i in range(num_pages):
-                original_page = original_doc.load_page(i)
+            for i in sorted(ocr_results):
+                ocr_text = ocr_results[i]
+                page_rect = original_doc.load_page(i).rect
+                new_page = original_doc.new_page(
+                    width=page_rect.width,
+                    height=page_rect.height
+                )
                 
-                if i in ocr_results:
-                    ocr_text = ocr_results[i]
+                if "Error" in ocr_text:
+                    # Create error page
+                    new_page.insert_text((50, 50), f"OCR Failed: {ocr_text}", 
+                                       fontsize=8, fontname="Courier")
+                else:
+                    # Create OCR text page
+                    margin = 50
+                    box = fitz.Rect(margin, margin, 
+                                  page_rect.width - margin,
+                                  page_rect.height - margin)
                     
-                    if "Error" in ocr_text:
-                        # Create error page
-                        new_page = new_pdf_doc.new_page(
-                            width=original_page.rect.width,
-                            height=original_page.rect.height
-                        )
-                        new_page.insert_text((50, 50), f"OCR Failed: {ocr_text}", 
-                                           fontsize=8, fontname="Courier")
-                    else:
-                        # Create OCR text page
-                        new_page = new_pdf_doc.new_page(
-                            width=original_page.rect.width,
-                            height=original_page.rect.height
+                    inserted = 0
+                    font_size = 9
+                    while font_size >= 5:
+                        inserted = new_page.insert_textbox(
+                            box, ocr_text.strip(),
+                            fontsize=font_size,
+                            fontname="Times-Roman",
+                            align=fitz.TEXT_ALIGN_LEFT
                         )
-                        margin = 50
-                        box = fitz.Rect(margin, margin, 
-                                      original_page.rect.width - margin,
-                                      original_page.rect.height - margin)
-                        
-                        inserted = 0
-                        font_size = 9
-                        while font_size >= 5:
-                            inserted = new_page.insert_textbox(
-                                box, ocr_text.strip(),
-                                fontsize=font_size,
-                                fontname="Times-Roman",
-                                align=fitz.TEXT_ALIGN_LEFT
-                            )
-                            if inserted > 0:
-                                break
-                            font_size -= 1
-                    
-                    replaced_pages.append(i + 1)
-                else:
-                    # Keep original page
-                    new_pdf_doc.insert_pdf(original_doc, from_page=i, to_page=i)
-            
-            original_doc.close()
+                        if inserted > 0:
+                            break
+                        font_size -= 1
+                
+                page_order[i] = new_page.number
+                replaced_pages.append(i + 1)
             
             if replaced_pages:
-                final_stream = io.BytesIO()
-                new_pdf_doc.save(final_stream)
-                final_stream.seek(0)
-                new_pdf_doc.close()
+                original_doc.select(page_order)
+                # Same settings as the watermark stage: drop the replaced pages'
+                # objects, merge duplicates and compress the new text streams,
+                # so chunking parses a smaller file. As there, the stream wraps
+                # immutable bytes so later stages read them without a copy
+                final_stream = io.BytesIO(original_doc.tobytes(garbage=4, deflate=True))
+                original_doc.close()
                 return final_stream, replaced_pages
             else:
-                new_pdf_doc.close()
+                original_doc.close()
                 return None, []
                 
         except Exception as e:
@@ -206,7 +512,7 @@ class OCRService:
                     # Add context to the exception
                     raise Exception(f"OCR processing failed for {file_key}: {str(e)}") from e
             
-            result = await loop.run_in_executor(None, _ocr_with_error_context)
+            result = await loop.run_in_executor(self._ocr_pool, _ocr_with_error_context)
             
             if result and result[0]:
                 self.logger.info(f"✅ Async OCR completed successfully for: {file_key}")
@@ -3,16 +3,20 @@ Complete Fixed Orchestrator Service with Working Metrics
 """
 
 import sys
-import boto3
 import io
 import os
 import time
 import logging
 import asyncio
-from typing import List, Dict, Any
+import hashlib
+import queue
+import atexit
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Dict, Any, Optional, Union, BinaryIO
 from urllib.parse import unquote
-import PyPDF2
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
 from services.filename_service import FilenameService
 from services.watermark_service import WatermarkService
 from services.ocr_service import OCRService
@@ -20,14 +24,83 @@ from services.chunking_service import ChunkingService
 from services.s3_service import S3Service
 from services.conversion_service import ConversionService
 from services.pdf_plumber_service import PDFPlumberService
-from prometheus_client import Counter, Histogram, Gauge
+from services.metadata_service import MetadataService
+from services.kb_sync_service import KBIngestionService, KBSyncBatcher
+from services import ocr_service, watermark_service
 from config import (
     AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION,
     SOURCE_BUCKET, CHUNKED_BUCKET, DIRECT_CHUNKED_BUCKET,
-    MAX_WORKERS_PER_STAGE, ASYNC_PROCESSING
+    MAX_WORKERS_PER_STAGE, ASYNC_PROCESSING,
+    DOCUMENT_CACHE_BUCKET, DOCUMENT_CACHE_PREFIX, DOCUMENT_CACHE_VERSION
 )
 from monitoring.metrics_collector import metrics
-from monitoring.metrics import sanitize_label_value
+from monitoring.metrics import sanitize_label_value, canonical_folder, observe_duration
+
+def _stage_settings_fingerprint() -> str:
+    """
+    Short hash of everything besides the source bytes that shapes a prepared
+    PDF, so the document cache misses once a setting or the OCR model changes.
+    """
+    settings = [
+        DOCUMENT_CACHE_VERSION,
+        watermark_service.WATERMARK_TERMS_TO_REMOVE,
+        ocr_service.DEFAULT_DPI_OCR, ocr_service.LOW_RES_IMAGE_DPI,
+        ocr_service.OCR_TEXT_THRESHOLD, ocr_service.MAX_OCR_PAGE_PIXELS,
+        ocr_service.OCR_BINARIZE,
+        ocr_service.TESSEROCR_AVAILABLE, ocr_service.PYPDFIUM2_AVAILABLE,
+    ]
+    
+    # The traineddata file itself, so a different model build changes the key
+    model_path = os.path.join(ocr_service.TESSDATA_PREFIX or '', 'eng.traineddata')
+    if ocr_service.TESSDATA_PREFIX and os.path.isfile(model_path):
+        with open(model_path, 'rb') as f:
+            settings.append(hashlib.sha256(f.read()).hexdigest())
+    else:
+        settings.append(ocr_service.TESSDATA_PREFIX)
+    
+    return hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+
+# Logging is configured once per process, at import, rather than by every
+# Orchestrator that gets constructed
+_logging_configured = False
+_logging_lock = threading.Lock()
+
+def _configure_logging() -> None:
+    """
+    Configure root logging for the processor.
+    
+    Records go to stdout and to pdf_processor.log. For the file, logging
+    calls only put the record on a queue; a QueueListener thread writes it
+    to a rotating file, so request threads never wait on disk I/O.
+    """
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        _logging_configured = True
+        
+        # Same rule as basicConfig: an application that already set up root
+        # handlers keeps them, and no listener thread is started for nothing
+        if logging.getLogger().handlers:
+            return
+        
+        log_queue = queue.SimpleQueue()
+        file_handler = RotatingFileHandler('pdf_processor.log', maxBytes=100_000_000, backupCount=5)
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        # Drain whatever is still queued when the worker exits
+        atexit.register(listener.stop)
+        
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.StreamHandler(sys.stdout),
+                QueueHandler(log_queue)
+            ]
+        )
+
+_configure_logging()
 
 class Orchestrator:
     """Main orchestrator for PDF processing workflow."""
@@ -41,6 +114,12 @@ class Orchestrator:
         self.pdf_plumber_service = PDFPlumberService()
         self.chunking_service = ChunkingService()
         self.s3_service = S3Service(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION)
+        self._metadata_service = MetadataService()
+        self._kb_service = KBIngestionService(
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            region_name=AWS_REGION
+        )
         
         # Initialize S3 constants
         self.SOURCE_BUCKET = SOURCE_BUCKET
@@ -50,26 +129,40 @@ class Orchestrator:
         # Thread pool for CPU-intensive operations
         self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS_PER_STAGE)
         
+        # Label handles bound once for the fixed label sets updated on every
+        # file and every chunk; labels() is a locked dict lookup per call
+        self._stage_files = {
+            stage: metrics.pipeline_stage_files.labels(stage=stage)
+            for stage in ('processing', 'conversion', 'ocr', 'chunking', 'kb_sync', 'completed')
+        }
+        self._download_duration = metrics.processing_duration.labels(step='s3_download')
+        self._upload_duration = metrics.processing_duration.labels(step='s3_upload')
+        self._uploads_succeeded = metrics.s3_uploads_total.labels(bucket=self.CHUNKED_BUCKET, status='success')
+        self._uploads_failed = metrics.s3_uploads_total.labels(bucket=self.CHUNKED_BUCKET, status='failed')
+        self._upload_errors = metrics.processing_errors.labels(error_type='upload_failed', step='s3_upload')
+        self._metadata_errors = metrics.processing_errors.labels(error_type='metadata_failed', step='metadata_creation')
+        self._ocr_jobs = {
+            status: metrics.ocr_jobs_total.labels(status=status)
+            for status in ('success', 'skipped')
+        }
+        
+        # Stage settings are fixed for the process, so hash them once
+        self._cache_settings = _stage_settings_fingerprint() if DOCUMENT_CACHE_BUCKET else None
+        
+        # KB syncs are batched per folder and run on a background thread
+        self._kb_sync_queue = KBSyncBatcher(self._kb_service)
+        
         # Async processing semaphores
         self.processing_semaphore = asyncio.Semaphore(MAX_WORKERS_PER_STAGE)
         
-        # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(sys.stdout),
-                logging.FileHandler('pdf_processor.log')
-            ]
-        )
         self.logger.info("Orchestrator initialized successfully")
 
     def process_single_file(self, file_key: str) -> bool:
         """Process a single PDF file through the complete pipeline."""
         metrics.increment_active_jobs()
         metrics.sqs_messages_in_flight.inc()
-        metrics.pipeline_stage_files.labels(stage='processing').inc()
-        start_time = time.time()
+        self._stage_files['processing'].inc()
+        start_time = time.perf_counter()
         folder_name = file_key.split('/')[0] if '/' in file_key else 'default'
         
         # Record file uploaded to source bucket
@@ -77,12 +170,18 @@ class Orchestrator:
         
         try:
             # Handle URL encoding for Arabic characters
-            from urllib.parse import unquote
             decoded_file_key = unquote(file_key)
             
             self.logger.info(f"Starting processing for: {file_key}")
             self.logger.info(f"Decoded filename: {decoded_file_key}")
             
+            # Anything that is neither a PDF nor convertible would only be
+            # discarded after the download, so it is skipped before it
+            if not self.conversion_service.is_supported_format(file_key):
+                self.logger.warning(f"Skipping unsupported file type: {file_key}")
+                metrics.record_file_processed('skipped', folder_name)
+                return True
+            
             # Enhanced S3 file access with retry and better logging
             max_retries = 3
             retry_delay = 1  # seconds
@@ -90,11 +189,11 @@ class Orchestrator:
             for attempt in range(max_retries):
                 try:
                     self.logger.info(f"Attempt {attempt + 1}/{max_retries} to download: {decoded_file_key}")
-                    download_start = time.time()
+                    download_start = time.perf_counter()
                     file_bytes = self.s3_service.get_object(self.SOURCE_BUCKET, decoded_file_key)
                     
                     if file_bytes is not None:
-                        metrics.processing_duration.labels(step='s3_download').observe(time.time() - download_start)
+                        self._download_duration.observe(time.perf_counter() - download_start)
                         self.logger.info(f"Successfully downloaded {len(file_bytes)} bytes from {decoded_file_key}")
                         break
                     
@@ -118,50 +217,62 @@ class Orchestrator:
             file_ext = os.path.splitext(file_key)[1].lower()
             pdf_stream = io.BytesIO(file_bytes)
             
-            # Format conversion if needed
-            if self.conversion_service.is_convertible_format(file_key):
-                metrics.files_in_conversion.inc()
-                metrics.pipeline_stage_files.labels(stage='conversion').inc()
-                convert_start = time.time()
-                pdf_content, converted_filename = self.conversion_service.convert_to_pdf(file_bytes, file_key)
-                metrics.record_processing_time('conversion', time.time() - convert_start)
-                metrics.files_in_conversion.dec()
-                metrics.pipeline_stage_files.labels(stage='conversion').dec()
-                
-                if pdf_content is None:
-                    metrics.processing_errors.labels(error_type='conversion_failed', step='conversion').inc()
-                    metrics.conversions_total.labels(from_format=file_ext, to_format='pdf', status='failed').inc()
-                    metrics.record_file_processed('failed', folder_name)
-                    return False
-                
-                metrics.conversions_total.labels(from_format=file_ext, to_format='pdf', status='success').inc()
-                pdf_stream = io.BytesIO(pdf_content)
-                self.logger.info(f"Successfully converted {file_key} to PDF")
+            # A document seen before (same bytes) skips conversion, watermark
+            # removal and OCR: its OCR'd PDF comes from the document cache
+            cache_key = self._document_cache_key('sync', file_bytes, file_ext)
+            cached_pdf = self._get_cached_document(cache_key)
+            if cached_pdf is not None:
+                pdf_stream = io.BytesIO(cached_pdf)
+                self.logger.info(f"Document cache hit for {file_key}, skipping conversion, watermark removal and OCR")
+            else:
+                # Format conversion if needed
+                if self.conversion_service.needs_conversion(file_bytes, file_key):
+                    metrics.files_in_conversion.inc()
+                    self._stage_files['conversion'].inc()
+                    convert_start = time.perf_counter()
+                    pdf_content, converted_filename = self.conversion_service.convert_to_pdf(file_bytes, file_key)
+                    metrics.record_processing_time('conversion', time.perf_counter() - convert_start)
+                    metrics.files_in_conversion.dec()
+                    self._stage_files['conversion'].dec()
+                    
+                    if pdf_content is None:
+                        metrics.processing_errors.labels(error_type='conversion_failed', step='conversion').inc()
+                        metrics.conversions_total.labels(from_format=file_ext, to_format='pdf', status='failed').inc()
+                        metrics.record_file_processed('failed', folder_name)
+                        return False
+                    
+                    metrics.conversions_total.labels(from_format=file_ext, to_format='pdf', status='success').inc()
+                    pdf_stream = io.BytesIO(pdf_content)
+                    self.logger.info(f"Successfully converted {file_key} to PDF")
 
-            # Watermark removal
-            watermark_start = time.time()
-            watermark_result = self.watermark_service.remove_watermarks(pdf_stream, file_key)
-            metrics.record_processing_time('watermark_removal', time.time() - watermark_start)
-            
-            if watermark_result[0]:
-                pdf_stream = watermark_result[0]
-                self.logger.info("Watermark processing completed")
+                # Watermark removal
+                watermark_start = time.perf_counter()
+                watermark_result = self.watermark_service.remove_watermarks(pdf_stream, file_key)
+                metrics.record_processing_time('watermark_removal', time.perf_counter() - watermark_start)
+                
+                if watermark_result[0]:
+                    pdf_stream = watermark_result[0]
+                    self.logger.info("Watermark processing completed")
 
-            # OCR processing
-            metrics.files_in_ocr.inc()
-            metrics.pipeline_stage_files.labels(stage='ocr').inc()
-            ocr_start = time.time()
-            ocr_result = self.ocr_service.apply_ocr_to_pdf(pdf_stream, file_key)
-            metrics.record_processing_time('ocr', time.time() - ocr_start)
-            metrics.files_in_ocr.dec()
-            metrics.pipeline_stage_files.labels(stage='ocr').dec()
-            
-            if ocr_result[0]:
-                pdf_stream = ocr_result[0]
-                metrics.ocr_jobs_total.labels(status='success').inc()
-                self.logger.info("OCR processing completed")
-            else:
-                metrics.ocr_jobs_total.labels(status='skipped').inc()
+                # OCR processing
+                metrics.files_in_ocr.inc()
+                self._stage_files['ocr'].inc()
+                ocr_start = time.perf_counter()
+                ocr_result = self.ocr_service.apply_ocr_to_pdf(pdf_stream, file_key)
+                metrics.record_processing_time('ocr', time.perf_counter() - ocr_start)
+                metrics.files_in_ocr.dec()
+                self._stage_files['ocr'].dec()
+                
+                if ocr_result[0]:
+                    pdf_stream = ocr_result[0]
+                    self._ocr_jobs['success'].inc()
+                    self.logger.info("OCR processing completed")
+                else:
+                    self._ocr_jobs['skipped'].inc()
+                
+                # Only OCR'd documents are cached: they are the expensive ones
+                if ocr_result[0]:
+                    self._store_cached_document(cache_key, pdf_stream.getvalue())
 
             # Clean filename while preserving folder structure
             folder_path = '/'.join(file_key.split('/')[:-1]) if '/' in file_key else ''
@@ -184,122 +295,72 @@ class Orchestrator:
 
             # Chunking
             metrics.files_in_chunking.inc()
-            metrics.pipeline_stage_files.labels(stage='chunking').inc()
-            chunk_start = time.time()
+            self._stage_files['chunking'].inc()
+            chunk_start = time.perf_counter()
             chunks = self.chunking_service.chunk_pdf(pdf_stream, file_key, cleaned_key)
-            metrics.record_processing_time('chunking', time.time() - chunk_start)
+            metrics.record_processing_time('chunking', time.perf_counter() - chunk_start)
             
             # Record chunks created - YOUR NEW METRIC!
             metrics.record_chunks_created(folder_name, len(chunks))
             
             metrics.files_in_chunking.dec()
-            metrics.pipeline_stage_files.labels(stage='chunking').dec()
+            self._stage_files['chunking'].dec()
             
             if not chunks:
                 metrics.processing_errors.labels(error_type='chunking_failed', step='chunking').inc()
                 metrics.record_file_processed('failed', folder_name)
                 return False
 
-            # Upload chunks to S3
+            # Upload chunks to S3. Each chunk's upload and metadata file go to
+            # the executor as soon as it is serialized, so the network round
+            # trips overlap with writing out the chunks that follow
+            # Use cleaned filename for chunk keys, preserving folder structure;
+            # only the page number differs between chunks
+            chunk_folder_path, _, filename_only = cleaned_key.rpartition('/')
+            base_name = os.path.splitext(filename_only)[0]
+            
+            # Only normalize the filename, preserve folder structure
+            normalized_base_name = base_name.replace(' ', '_')
+            
+            if chunk_folder_path:
+                chunk_key_prefix = f"{chunk_folder_path}/{normalized_base_name}_page_"
+            else:
+                chunk_key_prefix = f"{normalized_base_name}_page_"
+            
+            # Upload counters are updated here, as results come in, rather
+            # than from every executor thread. At most two uploads per worker
+            # are in flight, so a large document's serialized chunks are not
+            # all held in memory at once
             success_count = 0
+            pending = set()
             for writer, metadata in chunks:
+                if len(pending) >= MAX_WORKERS_PER_STAGE * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    success_count += self._count_chunk_uploads(done)
+                
                 output = io.BytesIO()
                 writer.write(output)
                 output.seek(0)
                 
                 page_num = metadata.get('page_number', 1)
-                # Use cleaned filename for chunk key, preserving folder structure
-                folder_path = '/'.join(cleaned_key.split('/')[:-1]) if '/' in cleaned_key else ''
-                filename_only = cleaned_key.split('/')[-1]
-                base_name = os.path.splitext(filename_only)[0]
+                chunk_key = f"{chunk_key_prefix}{page_num}.pdf"
                 
-                # Only normalize the filename, preserve folder structure
-                normalized_base_name = base_name.replace(' ', '_')
-                
-                if folder_path:
-                    chunk_key = f"{folder_path}/{normalized_base_name}_page_{page_num}.pdf"
-                else:
-                    chunk_key = f"{normalized_base_name}_page_{page_num}.pdf"
-                
-                upload_start = time.time()
-                if self.s3_service.put_object(self.CHUNKED_BUCKET, chunk_key, output.getvalue()):
-                    success_count += 1
-                    metrics.s3_uploads_total.labels(bucket=self.CHUNKED_BUCKET, status='success').inc()
-                    metrics.record_processing_time('s3_upload', time.time() - upload_start)
-                    self.logger.info(f"Uploaded chunk: {chunk_key}")
-                    
-                    # COMMENTED OUT: Fix metadata page orientation to landscape
-                    # self.logger.info(f"🔧 Starting landscape fix for: {chunk_key}")
-                    # try:
-                    #     self.logger.info(f"🔧 Importing MetadataFixer...")
-                    #     from services.metadata_fixer import MetadataFixer
-                    #     self.logger.info(f"🔧 Creating MetadataFixer instance...")
-                    #     fixer = MetadataFixer(s3_service=self.s3_service, bucket_name=self.CHUNKED_BUCKET)
-                    #     self.logger.info(f"🔧 Calling fix_single_file for: {chunk_key}")
-                    #     fix_result = fixer.fix_single_file(chunk_key)
-                    #     self.logger.info(f"🔧 Fix result: {fix_result}")
-                    #     
-                    #     if fix_result['status'] == 'fixed':
-                    #         self.logger.info(f"✅ Fixed landscape orientation for: {chunk_key}")
-                    #     elif fix_result['status'] == 'skipped':
-                    #         self.logger.info(f"⏭️ Landscape fix skipped for: {chunk_key} - {fix_result['action_taken']}")
-                    #     else:
-                    #         self.logger.warning(f"⚠️ Landscape fix result for {chunk_key}: {fix_result['status']} - {fix_result.get('error', 'Unknown')}")
-                    #         
-                    # except Exception as e:
-                    #     self.logger.error(f"❌ Failed to fix landscape orientation for {chunk_key}: {e}")
-                    #     metrics.processing_errors.labels(error_type='landscape_fix_failed', step='metadata_fixing').inc()
-                    #     # Continue processing - don't fail the entire pipeline
-                    
-                    # Create metadata file
-                    try:
-                        from services.metadata_service import MetadataService
-                        metadata_service = MetadataService()
-                        success = metadata_service.create_metadata_for_file(
-                            s3_key=chunk_key,
-                            bucket=self.CHUNKED_BUCKET
-                        )
-                        if success:
-                            self.logger.info(f"Created metadata file for {chunk_key}")
-                        else:
-                            self.logger.warning(f"Metadata creation returned False for {chunk_key}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to create metadata file for {chunk_key}: {e}")
-                        metrics.processing_errors.labels(error_type='metadata_failed', step='metadata_creation').inc()
-                else:
-                    metrics.s3_uploads_total.labels(bucket=self.CHUNKED_BUCKET, status='failed').inc()
-                    metrics.processing_errors.labels(error_type='upload_failed', step='s3_upload').inc()
+                # Hand the stream itself to the upload so the chunk bytes are
+                # not copied out of the buffer a second time by getvalue()
+                pending.add(self.executor.submit(self._upload_chunk_sync, chunk_key, output))
+            
+            success_count += self._count_chunk_uploads(wait(pending).done)
 
             # KB sync
             try:
-                from services.kb_sync_service import KBIngestionService
-                kb_service = KBIngestionService(
-                    aws_access_key_id=AWS_ACCESS_KEY_ID, 
-                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-                )
-                
-                kb_mapping = kb_service.get_kb_mapping()
+                kb_mapping = self._kb_service.get_kb_mapping()
                 self.logger.info(f"KB sync check: folder_name={folder_name}, available_mappings={list(kb_mapping.keys())}")
                 
                 if folder_name in kb_mapping:
-                    self.logger.info(f"Starting KB sync for folder: {folder_name}")
-                    metrics.files_in_kb_sync.inc()
-                    metrics.pipeline_stage_files.labels(stage='kb_sync').inc()
-                    kb_start = time.time()
-                    kb_result = kb_service.sync_to_knowledge_base_simple(folder_name)
-                    kb_duration = time.time() - kb_start
-                    metrics.files_in_kb_sync.dec()
-                    metrics.pipeline_stage_files.labels(stage='kb_sync').dec()
-                    self.logger.info(f"KB sync completed for {folder_name}: {kb_result}, duration={kb_duration:.2f}s")
-                    
-                    if kb_result.get('status') == 'COMPLETE':
-                        # Record successful KB sync - YOUR NEW METRIC!
-                        metrics.record_kb_sync_success(folder_name)
-                        metrics.record_processing_time('kb_sync', kb_duration)
-                        self.logger.info(f"KB sync completed in {kb_duration:.1f}s")
-                    else:
-                        metrics.record_kb_sync_attempt(folder_name, 'failed', kb_duration)
-                        self.logger.warning(f"KB sync failed with status: {kb_result.get('status')}")
+                    # Synced in the background together with the other files
+                    # that land in this folder before the next flush
+                    self.logger.info(f"Queued KB sync for folder: {folder_name}")
+                    self._kb_sync_queue.add(folder_name)
                 else:
                     self.logger.info(f"No KB mapping found for folder: {folder_name}")
                     # No KB sync attempted, so no metrics to record
@@ -310,7 +371,7 @@ class Orchestrator:
                 self.logger.error(f"KB sync error: {str(e)}")
 
             # Final metrics
-            processing_time_total = time.time() - start_time
+            processing_time_total = time.perf_counter() - start_time
             metrics.record_processing_time('total', processing_time_total)
             metrics.record_file_processed('success', folder_name)
             
@@ -329,8 +390,76 @@ class Orchestrator:
         finally:
             metrics.decrement_active_jobs()
             metrics.sqs_messages_in_flight.dec()
-            metrics.pipeline_stage_files.labels(stage='processing').dec()
-            metrics.pipeline_stage_files.labels(stage='completed').inc()
+            self._stage_files['processing'].dec()
+            self._stage_files['completed'].inc()
+    
+    def stop_kb_sync_batching(self):
+        """Start the KB jobs of all queued folders now; folders queued later start theirs at once"""
+        self._kb_sync_queue.shutdown()
+    
+    def shutdown(self):
+        """Start KB jobs for any queued folders and stop the worker threads"""
+        self._kb_sync_queue.shutdown()
+        self.executor.shutdown(wait=True)
+    
+    def _count_chunk_uploads(self, futures) -> int:
+        """Record finished chunk uploads and return how many succeeded"""
+        succeeded = 0
+        for future in futures:
+            if future.result():
+                succeeded += 1
+                self._uploads_succeeded.inc()
+            else:
+                self._uploads_failed.inc()
+                self._upload_errors.inc()
+        return succeeded
+    
+    def _upload_chunk_sync(self, chunk_key: str, chunk_data: Union[bytes, BinaryIO]) -> bool:
+        """Upload one chunk to the chunked bucket and create its metadata file."""
+        upload_start = time.perf_counter()
+        if self.s3_service.put_object(self.CHUNKED_BUCKET, chunk_key, chunk_data):
+            observe_duration(self._upload_duration, time.perf_counter() - upload_start)
+            self.logger.info(f"Uploaded chunk: {chunk_key}")
+            
+            # COMMENTED OUT: Fix metadata page orientation to landscape
+            # self.logger.info(f"🔧 Starting landscape fix for: {chunk_key}")
+            # try:
+            #     self.logger.info(f"🔧 Importing MetadataFixer...")
+            #     from services.metadata_fixer import MetadataFixer
+            #     self.logger.info(f"🔧 Creating MetadataFixer instance...")
+            #     fixer = MetadataFixer(s3_service=self.s3_service, bucket_name=self.CHUNKED_BUCKET)
+            #     self.logger.info(f"🔧 Calling fix_single_file for: {chunk_key}")
+            #     fix_result = fixer.fix_single_file(chunk_key)
+            #     self.logger.info(f"🔧 Fix result: {fix_result}")
+            #     
+            #     if fix_result['status'] == 'fixed':
+            #         self.logger.info(f"✅ Fixed landscape orientation for: {chunk_key}")
+            #     elif fix_result['status'] == 'skipped':
+            #         self.logger.info(f"⏭️ Landscape fix skipped for: {chunk_key} - {fix_result['action_taken']}")
+            #     else:
+            #         self.logger.warning(f"⚠️ Landscape fix result for {chunk_key}: {fix_result['status']} - {fix_result.get('error', 'Unknown')}")
+            #         
+            # except Exception as e:
+            #     self.logger.error(f"❌ Failed to fix landscape orientation for {chunk_key}: {e}")
+            #     metrics.processing_errors.labels(error_type='landscape_fix_failed', step='metadata_fixing').inc()
+            #     # Continue processing - don't fail the entire pipeline
+            
+            # Create metadata file
+            try:
+                success = self._metadata_service.create_metadata_for_file(
+                    s3_key=chunk_key,
+                    bucket=self.CHUNKED_BUCKET
+                )
+                if success:
+                    self.logger.info(f"Created metadata file for {chunk_key}")
+                else:
+                    self.logger.warning(f"Metadata creation returned False for {chunk_key}")
+            except Exception as e:
+                self.logger.error(f"Failed to create metadata file for {chunk_key}: {e}")
+                self._metadata_errors.inc()
+            return True
+        
+        return False
     
     async def process_single_file_async(self, file_key: str) -> bool:
         """
@@ -343,110 +472,145 @@ class Orchestrator:
             True if successful, False otherwise
         """
         async with self.processing_semaphore:
-            start_time = time.time()
+            start_time = time.perf_counter()
             original_folder_name = file_key.split('/')[0]  # Original folder name for KB sync
             folder_name = sanitize_label_value(original_folder_name)  # Sanitized for metrics
             
             try:
                 self.logger.info(f"🚀 Starting async processing: {file_key}")
                 
-                # Stage 0: File Existence Check (OPTIMIZATION)
-                try:
-                    await self.s3_service.head_object_async(self.SOURCE_BUCKET, file_key)
-                except Exception as e:
-                    self.logger.info(f"⏭️  Skipping non-existent file: {file_key} - {str(e)}")
+                if not self.conversion_service.is_supported_format(file_key):
+                    self.logger.warning(f"⏭️  Skipping unsupported file type: {file_key}")
+                    metrics.record_file_processed('skipped', folder_name)
                     return True  # Return True to mark as "successfully skipped"
                 
-                # Stage 1: File Download (ASYNC)
+                # Stage 1: File Download (ASYNC). There is no separate HEAD
+                # existence check first: a missing file shows up as NoSuchKey on
+                # the GET itself (None on the executor fallback)
                 self.logger.info(f"📥 Starting async S3 download: {file_key}")
-                pdf_data = await self.s3_service.get_object_async(self.SOURCE_BUCKET, file_key)
+                try:
+                    pdf_data = await self.s3_service.get_object_async(self.SOURCE_BUCKET, file_key)
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                        raise
+                    pdf_data = None
+                
+                if pdf_data is None:
+                    self.logger.info(f"⏭️  Skipping non-existent file: {file_key}")
+                    return True  # Return True to mark as "successfully skipped"
                 
                 if not pdf_data:
                     return False
                 
-                # Stage 2: Document Preparation (sync operations in thread pool)
-                loop = asyncio.get_event_loop()
-                original_pdf_data, processed_pdf_data = await loop.run_in_executor(
-                    self.executor,
-                    self._prepare_document_sync,
-                    pdf_data, file_key
-                )
-                
-                if not original_pdf_data:
-                    return False
-                
-                # Stage 3: Enhanced Processing (ASYNC OCR + PDF-plumber)
-                self.logger.info(f"🔄 Starting async OCR + PDF-plumber processing: {file_key}")
-                
-                # Run OCR and PDF-plumber in parallel
-                ocr_task = asyncio.create_task(
-                    self.ocr_service.apply_ocr_to_pdf_async(processed_pdf_data, file_key)
-                )
-                pdf_plumber_task = asyncio.create_task(
-                    self.pdf_plumber_service.apply_pdf_plumber_to_pdf_async(processed_pdf_data, file_key)
-                )
-                
-                # Wait for both to complete with error handling
-                try:
-                    ocr_result, pdf_plumber_result = await asyncio.gather(
-                        ocr_task, pdf_plumber_task, return_exceptions=True
+                # A document seen before (same bytes) skips stages 2 and 3: its
+                # enhanced PDF comes from the document cache
+                cache_key = self._document_cache_key('async', pdf_data, os.path.splitext(file_key)[1].lower())
+                cached_pdf = None
+                if cache_key is not None:
+                    # The lookup is a blocking boto3 GET; keep it off the event loop
+                    cached_pdf = await asyncio.get_event_loop().run_in_executor(
+                        self.executor, self._get_cached_document, cache_key
+                    )
+                if cached_pdf is not None:
+                    original_pdf_data, enhanced_pdf_data = pdf_data, cached_pdf
+                    self.logger.info(f"📦 Document cache hit for {file_key}, skipping preparation and enhancement")
+                else:
+                    # Stage 2: Document Preparation (sync operations in thread pool)
+                    loop = asyncio.get_event_loop()
+                    original_pdf_data, processed_pdf_data = await loop.run_in_executor(
+                        self.executor,
+                        self._prepare_document_sync,
+                        pdf_data, file_key
                     )
                     
-                    # Handle exceptions in results with detailed logging
-                    if isinstance(ocr_result, Exception):
-                        self.logger.error(f"❌ OCR processing failed for {file_key}: {ocr_result}")
-                        # Log the full exception chain for debugging
-                        if hasattr(ocr_result, '__cause__') and ocr_result.__cause__:
-                            self.logger.error(f"OCR root cause: {ocr_result.__cause__}")
-                        ocr_result = (None, [])
+                    if not original_pdf_data:
+                        return False
                     
-                    if isinstance(pdf_plumber_result, Exception):
-                        self.logger.error(f"❌ PDF-plumber processing failed for {file_key}: {pdf_plumber_result}")
-                        # Log the full exception chain for debugging
-                        if hasattr(pdf_plumber_result, '__cause__') and pdf_plumber_result.__cause__:
-                            self.logger.error(f"PDF-plumber root cause: {pdf_plumber_result.__cause__}")
-                        pdf_plumber_result = (None, [])
+                    # Stage 3: Enhanced Processing (ASYNC OCR + PDF-plumber)
+                    self.logger.info(f"🔄 Starting async OCR + PDF-plumber processing: {file_key}")
                     
-                    # Use the best result with memory optimization
-                    enhanced_pdf_data = processed_pdf_data  # Default fallback
+                    # Run OCR and PDF-plumber in parallel
+                    ocr_task = asyncio.create_task(
+                        self.ocr_service.apply_ocr_to_pdf_async(processed_pdf_data, file_key)
+                    )
+                    pdf_plumber_task = asyncio.create_task(
+                        self.pdf_plumber_service.apply_pdf_plumber_to_pdf_async(processed_pdf_data, file_key)
+                    )
                     
-                    if pdf_plumber_result and pdf_plumber_result[0]:
-                        enhanced_pdf_data = pdf_plumber_result[0].getvalue()
-                        # Clean up OCR result to free memory
-                        if ocr_result and ocr_result[0]:
-                            ocr_result[0].close()
-                        self.logger.info(f"✅ Using PDF-plumber enhanced data for: {file_key}")
-                    elif ocr_result and ocr_result[0]:
-                        enhanced_pdf_data = ocr_result[0].getvalue()
-                        self.logger.info(f"✅ Using OCR enhanced data for: {file_key}")
-                    else:
-                        # Clean up unused results to free memory
+                    # Wait for both to complete with error handling
+                    enhanced = False
+                    try:
+                        ocr_result, pdf_plumber_result = await asyncio.gather(
+                            ocr_task, pdf_plumber_task, return_exceptions=True
+                        )
+                        
+                        # Handle exceptions in results with detailed logging
+                        if isinstance(ocr_result, Exception):
+                            self.logger.error(f"❌ OCR processing failed for {file_key}: {ocr_result}")
+                            # Log the full exception chain for debugging
+                            if hasattr(ocr_result, '__cause__') and ocr_result.__cause__:
+                                self.logger.error(f"OCR root cause: {ocr_result.__cause__}")
+                            ocr_result = (None, [])
+                        
+                        if isinstance(pdf_plumber_result, Exception):
+                            self.logger.error(f"❌ PDF-plumber processing failed for {file_key}: {pdf_plumber_result}")
+                            # Log the full exception chain for debugging
+                            if hasattr(pdf_plumber_result, '__cause__') and pdf_plumber_result.__cause__:
+                                self.logger.error(f"PDF-plumber root cause: {pdf_plumber_result.__cause__}")
+                            pdf_plumber_result = (None, [])
+                        
+                        # Use the best result with memory optimization
+                        enhanced_pdf_data = processed_pdf_data  # Default fallback
+                        
                         if pdf_plumber_result and pdf_plumber_result[0]:
-                            pdf_plumber_result[0].close()
-                        if ocr_result and ocr_result[0]:
-                            ocr_result[0].close()
-                        self.logger.info(f"⚠️ Using original data (no enhancement) for: {file_key}")
-                    
-                    # Clear processed_pdf_data reference to help GC
-                    processed_pdf_data = None
+                            enhanced_pdf_data = pdf_plumber_result[0].getvalue()
+                            # Clean up OCR result to free memory
+                            if ocr_result and ocr_result[0]:
+                                ocr_result[0].close()
+                            self.logger.info(f"✅ Using PDF-plumber enhanced data for: {file_key}")
+                            enhanced = True
+                        elif ocr_result and ocr_result[0]:
+                            enhanced_pdf_data = ocr_result[0].getvalue()
+                            self.logger.info(f"✅ Using OCR enhanced data for: {file_key}")
+                            enhanced = True
+                        else:
+                            # Clean up unused results to free memory
+                            if pdf_plumber_result and pdf_plumber_result[0]:
+                                pdf_plumber_result[0].close()
+                            if ocr_result and ocr_result[0]:
+                                ocr_result[0].close()
+                            self.logger.info(f"⚠️ Using original data (no enhancement) for: {file_key}")
                         
-                except Exception as e:
-                    self.logger.error(f"Error in async enhancement processing: {e}")
-                    enhanced_pdf_data = processed_pdf_data
+                        # Clear processed_pdf_data reference to help GC
+                        processed_pdf_data = None
+                            
+                    except Exception as e:
+                        self.logger.error(f"Error in async enhancement processing: {e}")
+                        enhanced_pdf_data = processed_pdf_data
+                    
+                    # Only enhanced documents are cached: they are the expensive ones
+                    if enhanced:
+                        self._store_cached_document(cache_key, enhanced_pdf_data)
                 
                 # Stage 4: Dual Chunking Strategy (PARALLEL PROCESSING)
                 self.logger.info(f"🔄 Starting dual chunking for: {file_key}")
                 
+                # When no stage changed the document, both streams chunk the same
+                # bytes: parse them once and hand both the same reader
+                shared_reader = None
+                if enhanced_pdf_data == original_pdf_data:
+                    shared_reader = self.chunking_service.open_reader(original_pdf_data)
+                
                 # Create both chunking tasks simultaneously
                 processed_task = asyncio.create_task(
                     self.chunking_service.chunk_pdf_processed(
-                        original_pdf_data, file_key, enhanced_pdf_data
+                        original_pdf_data, file_key, enhanced_pdf_data, reader=shared_reader
                     )
                 )
                 
                 direct_task = asyncio.create_task(
                     self.chunking_service.chunk_pdf_direct(
-                        original_pdf_data, file_key
+                        original_pdf_data, file_key, reader=shared_reader
                     )
                 )
                 
@@ -466,9 +630,9 @@ class Orchestrator:
                 
                 # Record dual chunking metrics
                 if processed_chunks:
-                    metrics.processed_chunks_created_total.labels(folder=folder_name).inc(len(processed_chunks))
+                    metrics.processed_chunks_created_total.labels(folder=canonical_folder(folder_name)).inc(len(processed_chunks))
                 if direct_chunks:
-                    metrics.direct_chunks_created_total.labels(folder=folder_name).inc(len(direct_chunks))
+                    metrics.direct_chunks_created_total.labels(folder=canonical_folder(folder_name)).inc(len(direct_chunks))
                 
                 # Stage 5: Upload chunks to S3 (PARALLEL PROCESSING)
                 upload_tasks = []
@@ -478,14 +642,14 @@ class Orchestrator:
                     # Use the S3 key with _processed suffix for storage differentiation
                     chunk_key = metadata['chunk_s3_uri_processed'].replace(f's3://{self.CHUNKED_BUCKET}/', '')
                     upload_tasks.append(
-                        self._upload_chunk_async(chunk_stream, self.CHUNKED_BUCKET, chunk_key, metadata)
+                        (chunk_stream, self.CHUNKED_BUCKET, chunk_key, metadata)
                     )
                 
                 # Upload direct chunks to rules-repository-alpha
                 for chunk_stream, metadata in direct_chunks:
                     chunk_key = metadata['chunk_s3_uri'].replace(f's3://{self.DIRECT_CHUNKED_BUCKET}/', '')
                     upload_tasks.append(
-                        self._upload_chunk_async(chunk_stream, self.DIRECT_CHUNKED_BUCKET, chunk_key, metadata)
+                        (chunk_stream, self.DIRECT_CHUNKED_BUCKET, chunk_key, metadata)
                     )
                 
                 # Execute uploads with controlled concurrency to prevent connection pool exhaustion
@@ -493,36 +657,24 @@ class Orchestrator:
                     # Limit concurrent uploads to 20 to stay within connection pool limits
                     semaphore = asyncio.Semaphore(20)
                     
-                    async def controlled_upload(task):
-                        async with semaphore:
-                            return await task
-                    
-                    controlled_tasks = [controlled_upload(task) for task in upload_tasks]
-                    upload_results = await asyncio.gather(*controlled_tasks, return_exceptions=True)
+                    # One async client (and connection pool) carries every upload
+                    async with self.s3_service.async_client(max_pool_connections=20) as s3:
+                        async def controlled_upload(task):
+                            async with semaphore:
+                                return await self._upload_chunk_async(*task, s3=s3)
+                        
+                        controlled_tasks = [controlled_upload(task) for task in upload_tasks]
+                        upload_results = await asyncio.gather(*controlled_tasks, return_exceptions=True)
                     successful_uploads = sum(1 for result in upload_results if result is True)
                     self.logger.info(f"📤 Uploaded {successful_uploads}/{len(upload_tasks)} chunks successfully")
                 
                 # Stage 6: KB Sync (if applicable)
                 try:
-                    from services.kb_sync_service import KBIngestionService
-                    kb_service = KBIngestionService(
-                        aws_access_key_id=AWS_ACCESS_KEY_ID,
-                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                        region_name=AWS_REGION
-                    )
-                    kb_mapping = kb_service.get_kb_mapping()
+                    kb_mapping = self._kb_service.get_kb_mapping()
                     
                     if original_folder_name in kb_mapping:
-                        self.logger.info(f"🔄 Starting KB sync for folder: {original_folder_name}")
-                        kb_start = time.time()
-                        kb_result = await asyncio.get_event_loop().run_in_executor(
-                            self.executor, kb_service.sync_to_knowledge_base_simple, original_folder_name
-                        )
-                        kb_duration = time.time() - kb_start
-                        self.logger.info(f"✅ KB sync completed: {kb_result}, duration={kb_duration:.2f}s")
-                        
-                        if kb_result.get('status') == 'COMPLETE':
-                            metrics.record_kb_sync_success(folder_name)
+                        self.logger.info(f"🔄 Queued KB sync for folder: {original_folder_name}")
+                        self._kb_sync_queue.add(original_folder_name)
                     else:
                         self.logger.info(f"ℹ️ No KB mapping found for folder: {original_folder_name}")
                         
@@ -530,7 +682,7 @@ class Orchestrator:
                     self.logger.error(f"❌ KB sync failed for {folder_name}: {e}")
                 
                 # Record metrics
-                processing_time = time.time() - start_time
+                processing_time = time.perf_counter() - start_time
                 metrics.record_processing_time('total_async', processing_time)
                 metrics.record_file_processed('success', folder_name)
                 
@@ -538,12 +690,40 @@ class Orchestrator:
                 return True
                 
             except Exception as e:
-                processing_time = time.time() - start_time
+                processing_time = time.perf_counter() - start_time
                 self.logger.error(f"💥 Async processing failed for {file_key}: {e} ({processing_time:.2f}s)")
                 metrics.record_file_processed('failed', folder_name)
                 metrics.processing_errors.labels(error_type='async_processing', step='orchestrator').inc()
                 return False
     
+    def _document_cache_key(self, pipeline: str, file_bytes: bytes, file_ext: str) -> Optional[str]:
+        """Document cache key for a file's content, or None if the cache is disabled"""
+        if not DOCUMENT_CACHE_BUCKET:
+            return None
+        # Conversion depends on the extension as well as the bytes, and every
+        # stage on the settings it ran with
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        return f"{DOCUMENT_CACHE_PREFIX}{pipeline}/{self._cache_settings}/{file_ext.lstrip('.') or 'noext'}/{content_hash}.pdf"
+    
+    def _get_cached_document(self, cache_key: Optional[str]) -> Optional[bytes]:
+        """Fetch a previously prepared PDF from the document cache"""
+        if cache_key is None:
+            return None
+        try:
+            response = self.s3_service.s3.get_object(Bucket=DOCUMENT_CACHE_BUCKET, Key=cache_key)
+            return response['Body'].read()
+        except self.s3_service.s3.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            self.logger.warning(f"Document cache lookup failed for {cache_key}: {e}")
+            return None
+    
+    def _store_cached_document(self, cache_key: Optional[str], pdf_data: bytes) -> None:
+        """Write a prepared PDF to the document cache in the background"""
+        if cache_key is None:
+            return
+        self.executor.submit(self.s3_service.put_object, DOCUMENT_CACHE_BUCKET, cache_key, pdf_data)
+    
     def _download_file_sync(self, file_key: str) -> bytes:
         """Synchronous file download for thread pool execution"""
         try:
@@ -556,7 +736,7 @@ class Orchestrator:
         """Synchronous document preparation (conversion + watermark removal)"""
         try:
             # Format conversion if needed
-            if self.conversion_service.is_convertible_format(file_key):
+            if self.conversion_service.needs_conversion(pdf_data, file_key):
                 conversion_result = self.conversion_service.convert_to_pdf(pdf_data, file_key)
                 if conversion_result and conversion_result[0]:
                     processed_data = conversion_result[0]
@@ -578,14 +758,18 @@ class Orchestrator:
             self.logger.error(f"Document preparation failed for {file_key}: {e}")
             return pdf_data, pdf_data  # Return original as fallback
     
-    async def _upload_chunk_async(self, chunk_stream, bucket: str, chunk_key: str, metadata: dict) -> bool:
+    async def _upload_chunk_async(self, chunk_stream, bucket: str, chunk_key: str, metadata: dict, s3=None) -> bool:
         """Async chunk upload with metadata creation"""
         try:
-            # Upload chunk to S3
-            chunk_data = chunk_stream.getvalue()
-            upload_success = await asyncio.get_event_loop().run_in_executor(
-                self.executor, self.s3_service.put_object, bucket, chunk_key, chunk_data
-            )
+            # Upload chunk to S3, streaming from the chunk's own buffer rather
+            # than a getvalue() copy of it
+            chunk_stream.seek(0)
+            if s3 is not None:
+                upload_success = await self.s3_service.put_object_async(bucket, chunk_key, chunk_stream, s3=s3)
+            else:
+                upload_success = await asyncio.get_event_loop().run_in_executor(
+                    self.executor, self.s3_service.put_object, bucket, chunk_key, chunk_stream
+                )
             
             if upload_success:
                 self.logger.info(f"📤 Uploaded chunk: {chunk_key}")
@@ -593,10 +777,8 @@ class Orchestrator:
                 # Create metadata file (only for processed chunks in chunked-rules-repository)
                 if bucket == self.CHUNKED_BUCKET:
                     try:
-                        from services.metadata_service import MetadataService
-                        metadata_service = MetadataService()
                         await asyncio.get_event_loop().run_in_executor(
-                            self.executor, metadata_service.create_metadata_for_file, chunk_key, bucket
+                            self.executor, self._metadata_service.create_metadata_for_file, chunk_key, bucket
                         )
                         self.logger.info(f"📝 Created metadata for: {chunk_key}")
                     except Exception as e:
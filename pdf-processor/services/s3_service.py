@@ -4,12 +4,18 @@ Handles all AWS S3 operations including upload, download, copy, and delete.
 """
 
 import boto3
+import io
 import os
 import logging
 import asyncio
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, BinaryIO, Union
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from config import S3_MAX_POOL_CONNECTIONS, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT
 
 # Try to import aioboto3 for true async, fallback to executor if not available
 try:
@@ -21,6 +27,54 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Objects are downloaded in byte ranges of this size (AWS's recommended 8-16 MB
+# range for parallel GETs); anything past the first range is fetched with up
+# to DOWNLOAD_MAX_CONCURRENCY concurrent requests
+DOWNLOAD_PART_SIZE = 16 * 1024 * 1024
+DOWNLOAD_MAX_CONCURRENCY = 8
+
+# Uploads at or above the threshold go through the transfer manager as a
+# multipart upload with concurrent parts; smaller ones (every page chunk) stay
+# a single PutObject
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+# One S3 client per credential set for the whole process, so the services
+# that talk to S3 (this one, metadata, KB sync) share one pool of warm HTTPS
+# connections instead of each paying fresh TLS handshakes
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+def get_s3_client(aws_access_key_id: str = None, aws_secret_access_key: str = None, region_name: str = 'us-east-1'):
+    """Return the shared boto3 S3 client for these credentials, creating it on first use."""
+    client_key = (aws_access_key_id, aws_secret_access_key, region_name)
+    with _s3_clients_lock:
+        client = _s3_clients.get(client_key)
+        if client is None:
+            config = Config(
+                region_name=region_name,
+                retries={'max_attempts': 3, 'mode': 'adaptive'},
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=S3_CONNECT_TIMEOUT,
+                read_timeout=S3_READ_TIMEOUT,
+                # Keep idle pooled sockets alive between bursts of requests
+                tcp_keepalive=True
+            )
+            client = boto3.client(
+                's3',
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=region_name,
+                config=config
+            )
+            _s3_clients[client_key] = client
+    return client
+
 class S3Service:
     """Service for handling S3 operations."""
     
@@ -40,18 +94,10 @@ class S3Service:
                 region_name=self.region_name
             )
             
-            # Configure S3 client with increased connection pool for high-throughput uploads
-            config = Config(
-                region_name=self.region_name,
-                retries={'max_attempts': 3, 'mode': 'adaptive'},
-                max_pool_connections=50,  # Increased from default 10 to 50
-                connect_timeout=60,
-                read_timeout=60
-            )
-            
-            self.s3 = boto3.client('s3', config=config)
+            # Shared S3 client with a connection pool sized for high-throughput uploads
+            self.s3 = get_s3_client(self.aws_access_key_id, self.aws_secret_access_key, self.region_name)
             self.s3.list_buckets()  # Test connection
-            logger.info("S3 client initialized successfully with optimized connection pool (50 connections)")
+            logger.info(f"S3 client initialized successfully with optimized connection pool ({S3_MAX_POOL_CONNECTIONS} connections)")
         except Exception as e:
             logger.error(f"Failed to setup S3 client: {e}")
             raise
@@ -100,9 +146,17 @@ class S3Service:
         try:
             # First try with the exact key
             try:
-                response = self.s3.get_object(Bucket=bucket, Key=key)
+                # The first range costs the same one request as a plain GET for
+                # the common small file, and its Content-Range gives the size
+                response = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{DOWNLOAD_PART_SIZE - 1}")
+                first_part = response['Body'].read()
+                total_size = int(response['ContentRange'].rsplit('/', 1)[1])
+                if total_size > len(first_part):
+                    data = self._get_remaining_parts(bucket, key, response['ETag'], first_part, total_size)
+                else:
+                    data = first_part
                 logger.debug(f"Successfully retrieved {key} from {bucket}")
-                return response['Body'].read()
+                return data
             except self.s3.exceptions.NoSuchKey:
                 logger.warning(f"File not found with key: {key}")
                 return None
@@ -110,6 +164,9 @@ class S3Service:
                 if e.response['Error']['Code'] == 'NoSuchKey':
                     logger.warning(f"File not found (NoSuchKey): {key}")
                     return None
+                if e.response['Error']['Code'] == 'InvalidRange':
+                    # Empty object: no byte range exists to request
+                    return self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
                 # For other client errors, log and re-raise
                 logger.error(f"S3 ClientError for key {key}: {str(e)}")
                 raise
@@ -118,20 +175,55 @@ class S3Service:
             logger.error(f"Unexpected error getting object {key}: {str(e)}")
             raise
     
-    def put_object(self, bucket: str, key: str, body: bytes) -> bool:
+    def _get_remaining_parts(self, bucket: str, key: str, etag: str, first_part: bytes, total_size: int) -> bytes:
+        """
+        Download the rest of an object in concurrent byte-range requests.
+        
+        Args:
+            bucket: S3 bucket name
+            key: Object key
+            etag: ETag of the first range, so every part comes from the same version
+            first_part: Bytes already downloaded from the start of the object
+            total_size: Object size in bytes
+            
+        Returns:
+            Complete object bytes
+        """
+        ranges = [
+            (start, min(start + DOWNLOAD_PART_SIZE, total_size) - 1)
+            for start in range(len(first_part), total_size, DOWNLOAD_PART_SIZE)
+        ]
+        
+        def get_range(byte_range):
+            response = self.s3.get_object(
+                Bucket=bucket, Key=key, IfMatch=etag,
+                Range=f"bytes={byte_range[0]}-{byte_range[1]}"
+            )
+            return response['Body'].read()
+        
+        with ThreadPoolExecutor(max_workers=min(len(ranges), DOWNLOAD_MAX_CONCURRENCY)) as executor:
+            parts = list(executor.map(get_range, ranges))
+        
+        return b''.join([first_part, *parts])
+    
+    def put_object(self, bucket: str, key: str, body: Union[bytes, BinaryIO]) -> bool:
         """
         Put object to S3.
         
         Args:
             bucket: S3 bucket name
             key: Object key
-            body: Object bytes
+            body: Object bytes, or a seekable file-like object to stream from
             
         Returns:
             True if successful
         """
         try:
-            self.s3.put_object(Bucket=bucket, Key=key, Body=body)
+            if self._body_size(body) >= MULTIPART_THRESHOLD:
+                fileobj = io.BytesIO(body) if isinstance(body, (bytes, bytearray)) else body
+                self.s3.upload_fileobj(fileobj, bucket, key, Config=UPLOAD_TRANSFER_CONFIG)
+            else:
+                self.s3.put_object(Bucket=bucket, Key=key, Body=body)
             logger.debug(f"Successfully saved to S3: {bucket}/{key}")
             return True
             
@@ -139,6 +231,16 @@ class S3Service:
             logger.error(f"Error saving to S3 {key}: {e}")
             return False
     
+    @staticmethod
+    def _body_size(body: Union[bytes, BinaryIO]) -> int:
+        """Bytes left to upload from a body, without reading it"""
+        if isinstance(body, (bytes, bytearray)):
+            return len(body)
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END) - position
+        body.seek(position)
+        return size
+    
     def copy_object(self, source_bucket: str, source_key: str, dest_bucket: str, dest_key: str) -> bool:
         """
         Copy object within S3.
@@ -256,6 +358,65 @@ class S3Service:
             logger.error(f"Error during async S3 get_object: {e}")
             raise
     
+    @asynccontextmanager
+    async def async_client(self, max_pool_connections: int = 50):
+        """
+        Open one aioboto3 S3 client to share across many async calls.
+        
+        Yields None when aioboto3 is not installed; the *_async methods then
+        fall back to the executor.
+        
+        Args:
+            max_pool_connections: HTTP connection pool size of the client
+        """
+        if not AIOBOTO3_AVAILABLE:
+            yield None
+            return
+        
+        session = aioboto3.Session(
+            aws_access_key_id=self.aws_access_key_id,
+            aws_secret_access_key=self.aws_secret_access_key,
+            region_name=self.region_name
+        )
+        
+        config = Config(
+            region_name=self.region_name,
+            retries={'max_attempts': 3, 'mode': 'adaptive'},
+            max_pool_connections=max_pool_connections,
+            connect_timeout=60,
+            read_timeout=60
+        )
+        
+        async with session.client('s3', config=config) as s3:
+            yield s3
+    
+    async def put_object_async(self, bucket: str, key: str, body: Union[bytes, BinaryIO], s3=None) -> bool:
+        """
+        Async version of put_object.
+        Uses the given aioboto3 client if any, falls back to executor.
+        
+        Args:
+            bucket: S3 bucket name
+            key: Object key
+            body: Object bytes, or a seekable file-like object to stream from
+            s3: Client from async_client(), shared by concurrent uploads
+            
+        Returns:
+            True if successful
+        """
+        if s3 is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self.put_object, bucket, key, body)
+        
+        try:
+            await s3.put_object(Bucket=bucket, Key=key, Body=body)
+            logger.debug(f"Successfully saved to S3: {bucket}/{key}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error saving to S3 {key}: {e}")
+            return False
+    
     async def head_object_async(self, bucket: str, key: str) -> bool:
         """
         True async version of head_object to check if object exists.
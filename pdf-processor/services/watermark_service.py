@@ -50,10 +50,13 @@ class WatermarkService:
             # Process each page
             for i, page in enumerate(doc):
                 page_modified = False
+                # Extract the page text once for all terms; search_for would
+                # otherwise rebuild it from the content stream for every term
+                textpage = page.get_textpage()
                 
                 # Remove specified terms (case-sensitive)
                 for term in WATERMARK_TERMS_TO_REMOVE:
-                    text_instances = page.search_for(term)
+                    text_instances = page.search_for(term, textpage=textpage)
                     if text_instances:
                         pages_with_terms_indices.add(i)
                         page_modified = True
@@ -87,19 +90,13 @@ class WatermarkService:
             
             # Identify empty pages to remove
             if modified:
-                temp_stream = io.BytesIO()
-                doc.save(temp_stream, garbage=4, deflate=True)
-                temp_stream.seek(0)
-                temp_doc = fitz.open("pdf", temp_stream.read())
-                
-                # Find pages to remove
+                # Checked on the open document: apply_redactions() has already
+                # rewritten the pages, so no save/reopen round trip is needed
                 indices_to_delete = [
-                    i for i, page in enumerate(temp_doc)
+                    i for i, page in enumerate(doc)
                     if self.is_page_empty(page) and i not in pages_with_terms_indices
                 ]
                 
-                temp_doc.close()
-                
                 # Remove identified pages
                 removed_pages = []
                 indices_to_delete.sort(reverse=True)
@@ -108,10 +105,10 @@ class WatermarkService:
                         doc.delete_page(index)
                         removed_pages.append(index + 1)
                 
-                # Save final document
-                final_stream = io.BytesIO()
-                doc.save(final_stream, garbage=4, deflate=True)
-                final_stream.seek(0)
+                # Save final document. Wrapping the tobytes() result lets the
+                # next stage read() or getvalue() the same bytes object back
+                # without copying it, unlike a stream that was written into
+                final_stream = io.BytesIO(doc.tobytes(garbage=4, deflate=True))
                 doc.close()
                 
                 return final_stream, removed_pages
@@ -9,8 +9,9 @@ import json
 import logging
 import time
 import asyncio
+import signal
 from typing import List, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import boto3
 from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
@@ -18,7 +19,15 @@ from services.orchestrator import Orchestrator
 from services.filename_service import FilenameService
 from services.sqs_monitor import SQSMonitor
 from monitoring.metrics_collector import metrics, start_metrics_server
-from config import ASYNC_PROCESSING
+from config import ASYNC_PROCESSING, MAX_SOURCE_FILE_SIZE
+
+# Try to import uvloop (libuv-based event loop with a cheaper scheduling and
+# socket hot path), fallback to the stock asyncio loop if not available
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(
@@ -87,6 +96,17 @@ class SQSWorker:
                     'receipt_handle': message['ReceiptHandle']
                 }
             
+            # The event already carries the size, so oversized uploads are
+            # dropped without a download (or a HEAD request)
+            if object_size is not None and int(object_size) > MAX_SOURCE_FILE_SIZE:
+                logger.warning(f"[PARALLEL] Skipping oversized file ({object_size} bytes): s3://{bucket_name}/{object_key}")
+                metrics.record_file_processed('skipped', object_key.split('/')[0])
+                return {
+                    'success': True,
+                    'file': object_key,
+                    'receipt_handle': message['ReceiptHandle']
+                }
+            
             # Log with proper path formatting
             display_path = object_key.replace('+', ' ')
             
@@ -131,56 +151,45 @@ class SQSWorker:
                 'receipt_handle': message.get('ReceiptHandle', 'unknown')
             }
     
-    def process_messages_parallel(self, messages: List[Dict]) -> List[str]:
-        """Process messages in parallel using ThreadPoolExecutor"""
-        if not messages:
-            return []
-            
-        logger.info(f"[PARALLEL] Processing {len(messages)} messages with {self.max_workers} workers")
+    def _process_message(self, message: Dict) -> Dict[str, Any]:
+        """Process every S3 record of one SQS message, for the rolling sync loop"""
+        try:
+            records = json.loads(message['Body']).get('Records', [])
+        except Exception as e:
+            logger.error(f"[PARALLEL] Error preparing message: {e}")
+            return None
+        
+        if not records:
+            return None
         
-        # Prepare message data for parallel processing
-        message_data_list = []
-        for message in messages:
+        results = [
+            self.process_single_file_wrapper({'message': message, 'record': record})
+            for record in records
+        ]
+        return {
+            'success': all(result['success'] for result in results),
+            'results': results,
+            'receipt_handle': message['ReceiptHandle']
+        }
+    
+    def _delete_completed(self, futures) -> None:
+        """Delete the SQS messages of completed message futures"""
+        receipt_handles = []
+        for future in futures:
             try:
-                body = json.loads(message['Body'])
-                records = body.get('Records', [])
-                
-                for record in records:
-                    message_data_list.append({
-                        'message': message,
-                        'record': record
-                    })
+                result = future.result()
             except Exception as e:
-                logger.error(f"[PARALLEL] Error preparing message: {e}")
-        
-        if not message_data_list:
-            return []
-        
-        # Process files in parallel
-        successful_receipts = []
-        failed_receipts = []
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            future_to_message = {
-                executor.submit(self.process_single_file_wrapper, msg_data): msg_data
-                for msg_data in message_data_list
-            }
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_message):
-                try:
-                    result = future.result()
-                    if result['success']:
-                        successful_receipts.append(result['receipt_handle'])
-                    else:
-                        failed_receipts.append(result['receipt_handle'])
-                        logger.error(f"[PARALLEL] Processing failed: {result}")
-                except Exception as e:
-                    logger.error(f"[PARALLEL] Thread execution error: {e}")
+                logger.error(f"[PARALLEL] Thread execution error: {e}")
+                continue
+            if result is None:
+                continue
+            if not result['success']:
+                logger.error(f"[PARALLEL] Processing failed: {result}")
+            receipt_handles.append(result['receipt_handle'])  # Delete all processed messages
         
-        logger.info(f"[PARALLEL] Completed: {len(successful_receipts)} successful, {len(failed_receipts)} failed")
-        return successful_receipts + failed_receipts  # Delete all processed messages
+        if receipt_handles:
+            logger.info(f"[PARALLEL] Completed {len(receipt_handles)} messages")
+            self.delete_messages(receipt_handles)
     
     def _delete_message(self, message, object_key):
         """Helper method to delete a message from SQS"""
@@ -250,27 +259,46 @@ class SQSWorker:
         # Start SQS monitoring
         self.sqs_monitor.start_monitoring()
         
+        # Files run on the worker pool as a rolling window rather than in
+        # poll-sized batches: a new file starts downloading as soon as any
+        # earlier one finishes, so one slow OCR job no longer holds back the
+        # downloads, conversions and uploads of the files behind it
+        in_flight = set()
+        
         while True:
             try:
-                # Poll for up to 10 messages
-                messages = self.poll_sqs(max_messages=10)
+                # Keep at most max_workers messages in flight; once full, wait
+                # for one to finish before polling for more
+                if len(in_flight) >= self.max_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._delete_completed(done)
+                    continue
+                
+                # Poll for up to 10 messages, no more than there are free workers
+                messages = self.poll_sqs(max_messages=min(10, self.max_workers - len(in_flight)))
                 
                 if messages:
                     logger.info(f"[PARALLEL] Received {len(messages)} messages from queue")
-                    
-                    # Process messages in parallel
-                    processed_receipts = self.process_messages_parallel(messages)
-                    
-                    # Delete processed messages
-                    if processed_receipts:
-                        self.delete_messages(processed_receipts)
-                else:
+                    for message in messages:
+                        in_flight.add(self.executor.submit(self._process_message, message))
+                elif not in_flight:
                     logger.debug("No messages, sleeping...")
                     time.sleep(5)
+                
+                # Delete the messages of files that finished meanwhile
+                done = {future for future in in_flight if future.done()}
+                if done:
+                    in_flight -= done
+                    self._delete_completed(done)
                     
             except KeyboardInterrupt:
                 logger.info("Worker stopped by user")
+                # Folders of already deleted messages get their KB jobs before
+                # the wait for in-flight files, which can outlast the stop timeout
+                self.orchestrator.stop_kb_sync_batching()
                 self.executor.shutdown(wait=True)
+                self._delete_completed(in_flight)
+                self.orchestrator.shutdown()
                 break
             except Exception as e:
                 logger.error(f"Worker error: {str(e)}")
@@ -299,6 +327,15 @@ class SQSWorker:
                                 'receipt_handle': message['ReceiptHandle']
                             }
                         
+                        if object_size is not None and int(object_size) > MAX_SOURCE_FILE_SIZE:
+                            logger.warning(f"[ASYNC] Skipping oversized file ({object_size} bytes): s3://{bucket}/{object_key}")
+                            metrics.record_file_processed('skipped', object_key.split('/')[0])
+                            return {
+                                'success': True,
+                                'file': object_key,
+                                'receipt_handle': message['ReceiptHandle']
+                            }
+                        
                         logger.info(f"[ASYNC] Processing S3 object: {object_key}")
                         
                         # Use async orchestrator method
@@ -327,32 +364,20 @@ class SQSWorker:
                 'receipt_handle': message.get('ReceiptHandle', 'unknown')
             }
     
-    async def process_messages_async(self, messages: List[Dict]) -> List[str]:
-        """Process messages asynchronously with dual chunking support"""
-        if not messages:
-            return []
-            
-        logger.info(f"[ASYNC] Processing {len(messages)} messages with async dual chunking")
-        
-        # Create async tasks for all messages
-        tasks = []
-        for message in messages:
-            task = asyncio.create_task(self.process_single_message_async(message))
-            tasks.append(task)
-        
-        # Wait for all tasks to complete
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Collect receipt handles for successful processing
+    def _delete_finished(self, tasks) -> None:
+        """Delete the SQS messages of finished message tasks that succeeded"""
         receipt_handles = []
-        for result in results:
+        for task in tasks:
+            if task.exception() is not None:
+                logger.error(f"[ASYNC] Task exception: {task.exception()}")
+                continue
+            result = task.result()
             if isinstance(result, dict) and result.get('success'):
                 receipt_handles.append(result['receipt_handle'])
-            elif isinstance(result, Exception):
-                logger.error(f"[ASYNC] Task exception: {result}")
         
-        logger.info(f"[ASYNC] Completed processing: {len(receipt_handles)}/{len(messages)} successful")
-        return receipt_handles
+        if receipt_handles:
+            self.delete_messages(receipt_handles)
+            logger.info(f"✅ Deleted {len(receipt_handles)} processed messages")
     
     async def run_async(self):
         """Run the SQS worker with async processing and dual chunking"""
@@ -364,36 +389,42 @@ class SQSWorker:
         # Start SQS monitor in background
         self.sqs_monitor.start_monitoring()
         
+        loop = asyncio.get_running_loop()
+        in_flight = set()
+        
         try:
             while True:
                 try:
-                    # Get messages from SQS
+                    # Keep at most max_workers messages in flight; once full, wait
+                    # for one to finish before polling for more
+                    if len(in_flight) >= self.max_workers:
+                        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        self._delete_finished(done)
+                        continue
+                    
+                    # Get messages from SQS. The long poll runs off the event loop,
+                    # so files already in flight keep downloading and processing
+                    # while the next ones are fetched
                     logger.info("🔍 Polling SQS for messages...")
-                    messages = self.poll_sqs()
+                    free_slots = min(self.max_messages, 10, self.max_workers - len(in_flight))
+                    messages = await loop.run_in_executor(None, self.poll_sqs, free_slots)
                     
                     if messages:
                         logger.info(f"📥 Received {len(messages)} messages from SQS")
-                        
-                        # Process messages asynchronously
-                        try:
-                            processed_receipts = await self.process_messages_async(messages)
-                            
-                            # Delete processed messages
-                            if processed_receipts:
-                                self.delete_messages(processed_receipts)
-                                logger.info(f"✅ Deleted {len(processed_receipts)} processed messages")
-                            
-                            logger.info("🔄 Batch processing complete, continuing to poll...")
+                        for message in messages:
+                            in_flight.add(asyncio.create_task(self.process_single_message_async(message)))
                             
-                        except Exception as process_error:
-                            logger.error(f"❌ Error in message processing: {process_error}")
-                            logger.info("🔄 Continuing to poll despite processing error...")
-                            
-                    else:
-                        queue_depth = self.get_queue_depth()
+                    elif not in_flight:
+                        queue_depth = await loop.run_in_executor(None, self.get_queue_depth)
                         logger.info(f"📊 No messages received. Queue depth: {queue_depth}. Waiting 5 seconds...")
                         await asyncio.sleep(5)
                     
+                    # Delete the messages of files that finished meanwhile
+                    done = {task for task in in_flight if task.done()}
+                    if done:
+                        in_flight -= done
+                        self._delete_finished(done)
+                    
                     # Ensure we always continue the loop
                     logger.debug("🔁 Polling cycle complete, continuing...")
                         
@@ -411,13 +442,27 @@ class SQSWorker:
         finally:
             # Cleanup
             if hasattr(self.orchestrator, 'executor'):
-                self.orchestrator.executor.shutdown(wait=True)
+                self.orchestrator.shutdown()
+
+
+def _handle_sigterm(signum, frame):
+    """Treat SIGTERM (container stop) like Ctrl-C so the worker shuts down cleanly"""
+    raise KeyboardInterrupt
+
+
 if __name__ == "__main__":
+    # The shutdown path starts the KB syncs of queued folders whose SQS
+    # messages are already deleted; a plain SIGTERM would skip it
+    signal.signal(signal.SIGTERM, _handle_sigterm)
     worker = SQSWorker()
     
     # Check if async processing is enabled
     if ASYNC_PROCESSING:
         logger.info("🔄 Starting with ASYNC processing and dual chunking")
+        if UVLOOP_AVAILABLE:
+            # Also covers the loops asyncio.run() creates in worker threads
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("⚡ Using uvloop event loop")
         asyncio.run(worker.run_async())
     else:
         logger.info("⚙️ Starting with SYNC processing")